@@ -5,7 +5,8 @@ import psycopg2
 from psycopg2.extras import DictCursor
 
 import setup_logging
-from src.scrapers import SCRAPERS
+from src.scrapers import SCRAPERS, Reddit
+from src.scrapers.reddit import REDDIT_COMBINED_FEEDS
 from src.utils.dbutils import DbUtil
 
 setup_logging.setup()
@@ -36,3 +37,6 @@ with conn:
     for Scraper in SCRAPERS.values():
         scraper = Scraper(conn, DbUtil(conn))  # type: ignore[abstract]
         scraper.add_service()
+
+    if REDDIT_COMBINED_FEEDS:
+        Reddit(conn, DbUtil(conn)).enable_combined_feeds()
@@ -0,0 +1,3 @@
+DROP TRIGGER IF EXISTS manga_service_next_update_notify ON manga_service;
+DROP TRIGGER IF EXISTS scheduled_runs_notify ON scheduled_runs;
+DROP FUNCTION IF EXISTS notify_scheduler();
@@ -0,0 +1,25 @@
+-- Wakes up the scheduler when new runs are scheduled
+CREATE OR REPLACE FUNCTION notify_scheduler() RETURNS TRIGGER AS
+$$
+BEGIN
+    PERFORM pg_notify('scheduler', json_build_object(
+        'table', TG_TABLE_NAME,
+        'manga_id', NEW.manga_id,
+        'service_id', NEW.service_id
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER scheduled_runs_notify
+    AFTER INSERT ON scheduled_runs
+    FOR EACH ROW EXECUTE PROCEDURE notify_scheduler();
+
+-- Only notify when the update is moved earlier. NULL means that the manga is due now.
+-- Scrapers move next_update forward after every update so those don't cause notifications
+CREATE TRIGGER manga_service_next_update_notify
+    AFTER UPDATE OF next_update ON manga_service
+    FOR EACH ROW
+    WHEN (NEW.next_update IS DISTINCT FROM OLD.next_update AND
+          COALESCE(NEW.next_update, '-infinity') < COALESCE(OLD.next_update, '-infinity'))
+    EXECUTE PROCEDURE notify_scheduler();
@@ -0,0 +1,2 @@
+ALTER TABLE manga_service DROP COLUMN IF EXISTS lease_expires;
+ALTER TABLE service_whole DROP COLUMN IF EXISTS lease_expires;
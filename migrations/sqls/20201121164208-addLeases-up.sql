@@ -0,0 +1,3 @@
+-- Rows claimed by a scheduler are leased until lease_expires so other schedulers skip them
+ALTER TABLE manga_service ADD COLUMN lease_expires TIMESTAMP WITH TIME ZONE DEFAULT NULL;
+ALTER TABLE service_whole ADD COLUMN lease_expires TIMESTAMP WITH TIME ZONE DEFAULT NULL;
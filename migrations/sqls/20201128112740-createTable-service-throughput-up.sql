@@ -0,0 +1,13 @@
+-- manga_per_hour and max_concurrency are configured per service.
+-- The rest is state of the adaptive controller persisted between runs.
+CREATE TABLE service_throughput (
+    service_id          SMALLINT PRIMARY KEY REFERENCES services ON DELETE CASCADE,
+    manga_per_hour      REAL NOT NULL DEFAULT 30 CHECK ( manga_per_hour > 0 ),
+    max_concurrency     SMALLINT NOT NULL DEFAULT 4 CHECK ( max_concurrency > 0 ),
+    concurrency         REAL NOT NULL DEFAULT 1,
+    allowance           REAL DEFAULT NULL,
+    allowance_updated   TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    latency             REAL DEFAULT NULL
+);
+
+INSERT INTO service_throughput (service_id) SELECT service_id FROM services;
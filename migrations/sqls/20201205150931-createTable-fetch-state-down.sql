@@ -0,0 +1 @@
+DROP TABLE IF EXISTS fetch_state;
@@ -0,0 +1,8 @@
+-- Validators of the last successfully processed response of each url.
+-- Used to make conditional requests.
+CREATE TABLE fetch_state (
+    url             TEXT PRIMARY KEY,
+    etag            TEXT DEFAULT NULL,
+    last_modified   TEXT DEFAULT NULL,
+    updated_at      TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
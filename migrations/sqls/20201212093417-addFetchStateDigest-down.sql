@@ -0,0 +1 @@
+ALTER TABLE fetch_state DROP COLUMN IF EXISTS digest;
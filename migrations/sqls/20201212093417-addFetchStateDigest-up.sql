@@ -0,0 +1,3 @@
+-- Digest of the last processed body. Used to skip unchanged responses
+-- from servers that don't support conditional requests.
+ALTER TABLE fetch_state ADD COLUMN digest TEXT DEFAULT NULL;
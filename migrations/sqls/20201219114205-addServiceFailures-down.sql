@@ -0,0 +1 @@
+ALTER TABLE services DROP COLUMN IF EXISTS consecutive_failures;
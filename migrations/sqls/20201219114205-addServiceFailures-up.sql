@@ -0,0 +1,3 @@
+-- Consecutive failed updates of the service. The circuit breaker of the
+-- service opens when this reaches a threshold and disabled_until is set.
+ALTER TABLE services ADD COLUMN consecutive_failures SMALLINT NOT NULL DEFAULT 0;
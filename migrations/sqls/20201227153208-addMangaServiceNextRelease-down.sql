@@ -0,0 +1 @@
+ALTER TABLE manga_service DROP COLUMN IF EXISTS next_release;
@@ -0,0 +1,3 @@
+-- Release time of the next chapter announced by the service. Used to schedule
+-- updates when the service responds that nothing has changed.
+ALTER TABLE manga_service ADD COLUMN next_release TIMESTAMP WITH TIME ZONE DEFAULT NULL;
@@ -0,0 +1,2 @@
+DROP TRIGGER IF EXISTS chapters_delete_notify ON chapters;
+DROP FUNCTION IF EXISTS notify_chapter_deleted();
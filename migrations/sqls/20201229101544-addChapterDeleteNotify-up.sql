@@ -0,0 +1,16 @@
+-- Tells the schedulers to forget deleted chapters so they can be added again
+CREATE OR REPLACE FUNCTION notify_chapter_deleted() RETURNS TRIGGER AS
+$$
+BEGIN
+    PERFORM pg_notify('scheduler', json_build_object(
+        'table', TG_TABLE_NAME,
+        'service_id', OLD.service_id,
+        'chapter_identifier', OLD.chapter_identifier
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER chapters_delete_notify
+    AFTER DELETE ON chapters
+    FOR EACH ROW EXECUTE PROCEDURE notify_chapter_deleted();
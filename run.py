@@ -1,11 +1,19 @@
+from argparse import ArgumentParser
 from datetime import datetime, timezone
 import os
+import signal
 
 import sentry_sdk
 
 import setup_logging
 from src.scheduler import UpdateScheduler
 
+parser = ArgumentParser()
+parser.add_argument('--daemon', '-d', action='store_true',
+                    help='Keep running and sleep between updates instead of exiting after a single update')
+
+args = parser.parse_args()
+
 logger = setup_logging.setup()
 
 if 'SENTRY_URL' in os.environ:
@@ -17,6 +25,24 @@ else:
     logger.info('Skipping sentry initialization')
 
 scheduler = UpdateScheduler()
-logger.debug("Next update in %s", scheduler.run_once()-datetime.utcnow().replace(tzinfo=timezone.utc).astimezone(tz=timezone.utc))
+
+if args.daemon:
+    def shutdown(signum, _):
+        logger.info('Received signal %s. Shutting down after the current update', signum)
+        scheduler.stop()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    try:
+        scheduler.run_forever(after_tick=sentry_sdk.flush)
+    finally:
+        scheduler.close()
+else:
+    try:
+        logger.debug("Next update in %s", scheduler.run_once()-datetime.utcnow().replace(tzinfo=timezone.utc).astimezone(tz=timezone.utc))
+    finally:
+        # Saves the known chapters so the next run doesn't have to load all of them
+        scheduler.close()
 
 sentry_sdk.flush()
@@ -13,4 +13,7 @@ print(args)
 setup_logging.setup()
 
 scheduler = UpdateScheduler()
-scheduler.force_run(args.service, args.manga)
\ No newline at end of file
+try:
+    scheduler.force_run(args.service, args.manga)
+finally:
+    scheduler.close()
@@ -0,0 +1,76 @@
+"""
+Compares IN (%s,%s,...) lists with a single array parameter (= ANY(%s))
+for different amounts of ids. Uses a temporary table so it can be run
+against any database configured with the DB_* environment variables.
+
+Usage: python scripts/benchmark_in_list.py [--rounds N]
+"""
+import os
+import random
+import time
+from argparse import ArgumentParser
+
+import psycopg2
+
+SIZES = (10, 1_000, 10_000)
+TABLE_ROWS = 50_000
+
+
+def timed(f, rounds: int) -> float:
+    """
+    Returns:
+        Mean time of a single call in milliseconds
+    """
+    start = time.perf_counter()
+    for _ in range(rounds):
+        f()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(host=os.environ['DB_HOST'],
+                            port=os.environ['DB_PORT'],
+                            user=os.environ['DB_USER'],
+                            password=os.environ['DB_PASSWORD'],
+                            dbname=os.environ['DB_NAME'])
+
+    with conn.cursor() as cur:
+        cur.execute('CREATE TEMP TABLE bench_manga (manga_id INT PRIMARY KEY, latest_chapter INT)')
+        cur.execute('INSERT INTO bench_manga SELECT i, i %% 100 FROM generate_series(1, %s) i', (TABLE_ROWS,))
+        cur.execute('ANALYZE bench_manga')
+        cur.execute('PREPARE bench_any(int[]) AS SELECT latest_chapter, manga_id FROM bench_manga WHERE manga_id=ANY($1)')
+
+        print(f'{"ids":>6} {"IN sql bytes":>13} {"IN ms":>9} {"ANY ms":>9} {"prepared ANY ms":>16}')
+        for size in SIZES:
+            ids = random.sample(range(1, TABLE_ROWS + 1), size)
+
+            format_ids = ','.join(['%s'] * len(ids))
+            in_sql = f'SELECT latest_chapter, manga_id FROM bench_manga WHERE manga_id IN ({format_ids})'
+            any_sql = 'SELECT latest_chapter, manga_id FROM bench_manga WHERE manga_id=ANY(%s)'
+
+            def run_in():
+                cur.execute(in_sql, ids)
+                cur.fetchall()
+
+            def run_any():
+                cur.execute(any_sql, (ids,))
+                cur.fetchall()
+
+            def run_prepared():
+                cur.execute('EXECUTE bench_any(%s)', (ids,))
+                cur.fetchall()
+
+            sql_bytes = len(cur.mogrify(in_sql, ids))
+            print(f'{size:>6} {sql_bytes:>13} {timed(run_in, args.rounds):>9.2f} '
+                  f'{timed(run_any, args.rounds):>9.2f} {timed(run_prepared, args.rounds):>16.2f}')
+
+    conn.rollback()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
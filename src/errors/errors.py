@@ -27,3 +27,9 @@ class InvalidChapterIdentifier(BaseScraperException):
 
 class RequiredInformationMissing(BaseScraperException):
     pass
+
+
+class ServiceUpdateFailed(BaseScraperException):
+    """
+    Raised by scrape_service when the service wide data could not be fetched
+    """
@@ -1,20 +1,36 @@
+import asyncio
+import contextvars
 import logging
 import os
-import random
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, Future
 from contextlib import contextmanager
-from datetime import datetime, timedelta
-from typing import Type, ContextManager, TypedDict, Optional, Collection, List
+from datetime import datetime, timedelta, timezone
+from typing import (
+    Type, ContextManager, TypedDict, Optional, List, Callable, Any, Dict,
+    Set, Tuple, Iterable
+)
 
 import psycopg2
 from psycopg2.extras import DictCursor, execute_values
 from psycopg2.pool import ThreadedConnectionPool
-from psycopg2.extensions import connection as Connection
+from psycopg2.extensions import connection as Connection, Notify
 
+from src.errors import ServiceUpdateFailed
 from src.scrapers import SCRAPERS
 from src.scrapers.base_scraper import BaseScraper
+from src.utils.async_fetch import AsyncFetcher
+from src.utils.circuit_breaker import CircuitBreaker, BreakerState
 from src.utils.dbutils import DbUtil
+from src.utils.deadline import deadline, expired, statement_timeout
+from src.utils.http import http_client, NOT_MODIFIED
+from src.utils.known_chapters import known_chapters, fingerprint
+from src.utils.notify import NotifyListener, parse_payload
+from src.utils.prepared import statements
+from src.utils.throughput import ServiceThroughput
+from src.utils.work_queue import WorkQueue
 
 logger = logging.getLogger('debug')
 
@@ -28,6 +44,51 @@ class MangaServiceInfo(TypedDict):
 
 class UpdateScheduler:
     MAX_POOLS = 5
+    # Amount of threads for whole service scrapes and saving manga updates.
+    # Threads only hold a connection while writing to the database so this
+    # can be larger than MAX_POOLS. Manga are fetched on the event loop of
+    # the fetcher so fetches don't use these threads.
+    MAX_WORKERS = 8
+    # Scheduled runs are done before any regular updates
+    SCHEDULED_RUN_PRIORITY = float('inf')
+    # How long claimed rows are reserved for this scheduler. Leases are released
+    # at the end of a run so this only matters when a scheduler dies mid run
+    LEASE_DURATION = timedelta(minutes=30)
+    # Upper bound for how long the daemon sleeps between ticks
+    MAX_SLEEP = timedelta(minutes=5)
+    # Time budget of fetching and saving updates in a single run. Requests and
+    # statements are cut short when it runs out and the rest of the queued
+    # updates are left for the next run.
+    RUN_DEADLINE = timedelta(minutes=8)
+    # How long manga of services without a scraper are postponed when claimed
+    MISSING_SCRAPER_DELAY = timedelta(hours=6)
+
+    # Time of the next update of any manga or service
+    _next_run = statements.register('next_run', '''
+            SELECT MIN(t.update) FROM (
+                SELECT
+                   LEAST(
+                       GREATEST(
+                           MIN(GREATEST(ms.next_update, ms.lease_expires)), s.disabled_until,
+                           -- Time when the quota of the service allows the next update
+                           CASE WHEN st.allowance < 1
+                                THEN st.allowance_updated + (1 - st.allowance) / st.manga_per_hour * INTERVAL '1 hour'
+                           END
+                       ),
+                       (
+                           SELECT MIN(GREATEST(sw.next_update, s2.disabled_until, sw.lease_expires))
+                           FROM service_whole sw 
+                               INNER JOIN services s2 ON s2.service_id = sw.service_id 
+                           WHERE s2.disabled=FALSE
+                       )
+                   ) as update
+                FROM manga_service ms
+                INNER JOIN services s ON s.service_id = ms.service_id
+                LEFT JOIN service_throughput st ON st.service_id = s.service_id
+                WHERE s.disabled=FALSE AND ms.disabled=FALSE
+                GROUP BY s.service_id, ms.service_id, st.service_id
+            ) as t
+            ''')
 
     def __init__(self):
         config = {
@@ -38,23 +99,72 @@ class UpdateScheduler:
             'db_port': os.environ['DB_PORT']
         }
 
-        self.pool = ThreadedConnectionPool(1, self.MAX_POOLS,
-                                            host=config['db_host'],
-                                            port=config['db_port'],
-                                            user=config['db_user'],
-                                            password=config['db_pass'],
-                                            dbname=config['db'],
-                                            cursor_factory=DictCursor)
-        self.thread_pool = ThreadPoolExecutor(max_workers=self.MAX_POOLS-1)
+        self._conn_kwargs = dict(host=config['db_host'],
+                                 port=config['db_port'],
+                                 user=config['db_user'],
+                                 password=config['db_pass'],
+                                 dbname=config['db'],
+                                 cursor_factory=DictCursor)
+        self.pool = ThreadedConnectionPool(1, self.MAX_POOLS, **self._conn_kwargs)
+        # ThreadedConnectionPool raises an error when it's exhausted. This makes threads wait instead
+        self._conn_semaphore = threading.BoundedSemaphore(self.MAX_POOLS)
+        self.thread_pool = ThreadPoolExecutor(max_workers=self.MAX_WORKERS)
+        self.fetcher = AsyncFetcher()
+
+        # Throughput quota and concurrency controller of each service
+        self.throughput: Dict[int, ServiceThroughput] = {}
+        # Circuit breakers of each service. The rest of the manga of a
+        # service are skipped when its circuit opens
+        self.breakers: Dict[int, CircuitBreaker] = {}
+        # Amount of updates running per service
+        self._in_flight = Counter()
+        self._slots_lock = threading.Lock()
+
+        # Validators for conditional requests. Loaded from the database on the first run
+        self.validators = http_client.validators
+        self._validators_loaded = False
+        # Chapters known to exist in the database. Read from disk and
+        # completed from the database on the first run
+        self.known_chapters = known_chapters
+        self._known_chapters_loaded = False
+        # Amount of checks and checks whose response had not changed per service since the last report
+        self._stats_lock = threading.Lock()
+        self._checks = Counter()
+        self._unchanged = Counter()
+        # Manga id, service id pairs of updates skipped because of the run deadline
+        self._skipped: Set[Tuple[int, int]] = set()
+
+        self._stop_event = threading.Event()
+        self._wakeup_event = threading.Event()
+
+    def connect(self) -> Connection:
+        """
+        Creates a new connection that is not part of the connection pool
+        """
+        return psycopg2.connect(**self._conn_kwargs)
 
     @contextmanager
     def conn(self) -> ContextManager[Connection]:
+        with self._conn_semaphore:
+            with self._pooled_conn() as conn:
+                yield conn
+
+    @contextmanager
+    def _pooled_conn(self) -> ContextManager[Connection]:
         conn = self.pool.getconn()
+        # Statements end around the deadline of the run
+        timeout = statement_timeout()
         try:
             conn.set_client_encoding('UTF8')
             if conn.get_parameter_status('timezone') != 'UTC':
                 with conn.cursor() as cur:
                     cur.execute("SET TIMEZONE TO 'UTC'")
+            # Hot statements are prepared once per physical connection
+            statements.prepare_all(conn)
+            if timeout is not None:
+                with conn.cursor() as cur:
+                    cur.execute('SET statement_timeout = %s', (timeout,))
+                conn.commit()
             yield conn
         except:
             conn.rollback()
@@ -62,79 +172,428 @@ class UpdateScheduler:
         else:
             conn.commit()
         finally:
-            self.pool.putconn(conn)
+            if timeout is not None and not conn.closed:
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute('RESET statement_timeout')
+                    conn.commit()
+                except psycopg2.Error:
+                    logger.exception('Failed to reset statement timeout')
+                    conn.close()
+
+            # Broken connections are discarded so the pool can reconnect
+            self.pool.putconn(conn, close=bool(conn.closed))
+
+    def queue_scheduled_runs(self, conn: Connection,
+                             queue: WorkQueue[MangaServiceInfo]) -> Tuple[Dict[int, Type[BaseScraper]], List[Tuple[int, int]]]:
+        """
+        Claims scheduled runs and adds them to the queue with a priority
+        higher than any regular update. Scheduled runs ignore the update
+        schedule of the manga and the service.
+
+        Returns:
+            The scraper class of each service in the scheduled runs and
+            the manga id, service id pairs of all scheduled runs claimed
+        """
+        scrapers = {}
+        runs = []
+        with conn.cursor() as cur:
+            for row in DbUtil.claim_scheduled_runs(cur, self.LEASE_DURATION):
+                manga_id = row['manga_id']
+                service_id = row['service_id']
+                runs.append((manga_id, service_id))
+
+                if not row['title_id']:
+                    logger.error(f'Manga {manga_id} on service {service_id} scheduled but not found from manga service')
+                    continue
+
+                Scraper = SCRAPERS.get(row['url'])
+                if not Scraper:
+                    logger.error(f'Failed to find scraper for {row}')
+                    continue
+
+                scrapers[service_id] = Scraper
+                queue.put(MangaServiceInfo(
+                    manga_id=manga_id,
+                    title_id=row['title_id'],
+                    service_id=service_id,
+                    feed_url=row['feed_url']
+                ), self.SCHEDULED_RUN_PRIORITY)
 
-    def do_scheduled_runs(self) -> List[int]:
-        # TODO maybe make these have some ratelimits as well
+        return scrapers, runs
+
+    @contextmanager
+    def scraper_conn(self, scraper: BaseScraper) -> ContextManager[Connection]:
+        """
+        Checks out a connection and binds the scraper to it for the duration
+        of the context manager
+        """
         with self.conn() as conn:
+            with scraper.bind_connection(conn):
+                yield conn
+
+    def postpone_manga(self, scraper: BaseScraper, service_id: int, manga_id: int) -> None:
+        """
+        Moves the next update of a manga forward after a failed update
+        """
+        try:
+            with self.scraper_conn(scraper):
+                scraper.dbutil.update_manga_next_update(service_id, manga_id, scraper.next_update())
+        except psycopg2.Error:
+            logger.exception(f'Failed to postpone update of manga {manga_id} on service {service_id}')
+
+    async def scrape_manga(self, scraper: BaseScraper, info: MangaServiceInfo) -> Optional[bool]:
+        """
+        Updates a single manga. The manga is fetched on the event loop of
+        the fetcher and saved on the thread pool. Connections are only
+        checked out when the scraper writes to the database.
+
+        Returns:
+            The return value of save_series or None if the update failed
+        """
+        title_id = info['title_id']
+        manga_id = info['manga_id']
+        service_id = info['service_id']
+        logger.info(f'Updating {title_id} on service {service_id}')
+        try:
+            data = await scraper.fetch_series_async(self.fetcher, title_id, service_id, manga_id, info['feed_url'])
+        except Exception:
+            logger.exception(f'Failed to fetch manga {title_id} on service {service_id}')
+            data = None
+
+        return await asyncio.wrap_future(
+            self.thread_pool.submit(contextvars.copy_context().run, self.save_manga, scraper, info, data)
+        )
+
+    def save_manga(self, scraper: BaseScraper, info: MangaServiceInfo, data: Any) -> Optional[bool]:
+        """
+        Database part of scrape_manga. Postpones the manga if fetching or saving failed.
+
+        Args:
+            scraper: The scraper that fetched the data
+            info: The manga
+            data: Return value of fetch_series
+
+        Returns:
+            The return value of save_series or None if the update failed
+        """
+        title_id = info['title_id']
+        manga_id = info['manga_id']
+        service_id = info['service_id']
+        feed_url = info['feed_url']
+        if data is None and expired():
+            # The manga is not postponed as the failure was caused by the deadline
+            logger.warning(f'Run deadline exceeded while updating {title_id} on service {service_id}')
+            self.record_skipped([(manga_id, service_id)])
+            return None
+
+        try:
+            res = None
+            if data is NOT_MODIFIED:
+                logger.debug(f'{title_id} on service {service_id} not modified')
+                with self.scraper_conn(scraper):
+                    scraper.skip_update(service_id, manga_id)
+                self.record_check(service_id, unchanged=True)
+                return False
+
+            if data is not None:
+                with self.scraper_conn(scraper):
+                    res = scraper.save_series(data, title_id, service_id, manga_id, feed_url)
+
+            if res is None:
+                logger.error(f'Failed to scrape series {title_id} {manga_id}')
+            else:
+                scraper.commit_validators()
+                self.record_check(service_id, unchanged=False)
+            return res
+        except psycopg2.Error:
+            logger.exception(f'Database error while updating manga {title_id} on service {service_id}')
+        except:
+            logger.exception(f'Unknown error while updating manga {title_id} on service {service_id}')
+
+        self.postpone_manga(scraper, service_id, manga_id)
+        return None
+
+    def record_check(self, service_id: int, unchanged: bool) -> None:
+        with self._stats_lock:
+            self._checks[service_id] += 1
+            if unchanged:
+                self._unchanged[service_id] += 1
+
+    def record_skipped(self, skipped: Iterable[Tuple[int, int]]) -> None:
+        with self._stats_lock:
+            self._skipped.update(skipped)
+
+    def pop_skipped(self) -> Set[Tuple[int, int]]:
+        """
+        Returns:
+            Manga id, service id pairs of the updates skipped since the last call
+        """
+        with self._stats_lock:
+            skipped = self._skipped
+            self._skipped = set()
+            return skipped
+
+    def report_unchanged(self) -> Dict[int, Tuple[int, int]]:
+        """
+        Logs how many responses of each service had not changed since the
+        last report and resets the counts.
+
+        Returns:
+            Unchanged and total amount of checks per service
+        """
+        with self._stats_lock:
+            stats = {
+                service_id: (self._unchanged[service_id], checks)
+                for service_id, checks in self._checks.items()
+            }
+            self._checks.clear()
+            self._unchanged.clear()
+
+        for service_id, (unchanged, checks) in stats.items():
+            logger.info(f'{unchanged}/{checks} ({unchanged / checks:.0%}) responses of service {service_id} were unchanged')
+
+        return stats
+
+    def report_statements(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Logs how many times each prepared statement was prepared and executed
+        since the last report and resets the counts.
+
+        Returns:
+            Amount of prepares and executions per statement
+        """
+        stats = statements.pop_stats()
+        for name, (prepares, executions) in sorted(stats.items()):
+            logger.debug(f'Statement {name} was executed {executions} times and prepared {prepares} times')
+
+        return stats
+
+    def get_throughput(self, service_id: int) -> ServiceThroughput:
+        throughput = self.throughput.get(service_id)
+        if throughput is None:
+            throughput = self.throughput.setdefault(service_id, ServiceThroughput(service_id))
+        return throughput
+
+    def pop_dirty_breakers(self) -> List[Tuple[int, int, Optional[datetime]]]:
+        """
+        Returns:
+            Service id, consecutive failures, disabled until tuples of the
+            circuit breakers changed since the last call
+        """
+        dirty = []
+        for breaker in list(self.breakers.values()):
+            if breaker.dirty:
+                breaker.dirty = False
+                dirty.append((breaker.service_id, breaker.failures, breaker.disabled_until))
+        return dirty
+
+    def get_breaker(self, service_id: int) -> CircuitBreaker:
+        breaker = self.breakers.get(service_id)
+        if breaker is None:
+            breaker = self.breakers.setdefault(service_id, CircuitBreaker(service_id))
+        return breaker
+
+    def _take_manga(self, queue: WorkQueue[MangaServiceInfo]) -> Optional[MangaServiceInfo]:
+        """
+        Pops the manga with the highest priority whose service has fewer updates
+        running than its concurrency limit and reserves a slot for it.
+
+        Returns:
+            The manga or None if no manga can be updated right now
+        """
+        def has_free_slot(info: MangaServiceInfo) -> bool:
+            service_id = info['service_id']
+            return self._in_flight[service_id] < self.get_throughput(service_id).limit
+
+        with self._slots_lock:
+            info = queue.pop(has_free_slot)
+            if info is not None:
+                self._in_flight[info['service_id']] += 1
+
+            return info
+
+    def _release_slot(self, service_id: int) -> None:
+        with self._slots_lock:
+            self._in_flight[service_id] -= 1
+
+    async def process_queue(self,
+                            queue: WorkQueue[MangaServiceInfo],
+                            scrapers: Dict[int, Type[BaseScraper]]) -> Set[int]:
+        """
+        Updates manga from the queue concurrently until it's empty. The amount
+        of concurrent updates per service is limited by the throughput
+        controller of the service. Requests are ratelimited per host by the
+        fetcher so no need to sleep between manga. Manga left in the queue
+        when the deadline of the run passes are skipped.
+
+        Args:
+            queue: The queue of manga to update
+            scrapers: Scraper class of each service in the queue
+
+        Returns:
+            Ids of the manga that were updated
+        """
+        manga_ids = set()
+        tasks: Dict[asyncio.Future, MangaServiceInfo] = {}
+        while len(queue) or tasks:
+            if len(queue) and expired():
+                skipped = queue.remove(lambda _: True)
+                self.record_skipped([(i['manga_id'], i['service_id']) for i in skipped])
+                logger.warning(f'Run deadline exceeded. Skipping {len(skipped)} manga until the next run')
+                continue
+
+            info = self._take_manga(queue)
+            if info is not None:
+                tasks[asyncio.ensure_future(self.update_manga(queue, scrapers, info))] = info
+                continue
+
+            if not tasks:
+                # Slots are taken by updates of another queue
+                await asyncio.sleep(1)
+                continue
+
+            done, _ = await asyncio.wait(tasks.keys(), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                info = tasks.pop(task)
+                if task.result() is True:
+                    manga_ids.add(info['manga_id'])
+
+        return manga_ids
+
+    async def update_manga(self,
+                           queue: WorkQueue[MangaServiceInfo],
+                           scrapers: Dict[int, Type[BaseScraper]],
+                           info: MangaServiceInfo) -> Optional[bool]:
+        """
+        Updates a manga whose slot has been reserved and feeds the result
+        to the throughput controller and the circuit breaker of the service.
+
+        Returns:
+            The return value of scrape_manga
+        """
+        service_id = info['service_id']
+        throughput = self.get_throughput(service_id)
+
+        # Time spent waiting for the ratelimiter is not part of the response time
+        started = time.monotonic()
+        waited = self.fetcher.waited()
+        try:
+            res = await self.scrape_manga(scrapers[service_id](None, None), info)
+        finally:
+            self._release_slot(service_id)
+        latency = time.monotonic() - started - (self.fetcher.waited() - waited)
+
+        breaker = self.get_breaker(service_id)
+        if res is not None:
+            throughput.on_success(latency)
+            breaker.on_success()
+            return res
+
+        if expired():
+            # Failures caused by the deadline say nothing about the health of the service
+            return res
+
+        throughput.on_failure()
+
+        # Skip the rest of the service when it looks like the service is down
+        if breaker.on_failure(datetime.now(timezone.utc)):
+            skipped = queue.remove(lambda i: i['service_id'] == service_id)
+            if skipped:
+                logger.warning(f'Too many errors on service {service_id}. Skipping {len(skipped)} manga '
+                               f'until {breaker.disabled_until}')
+
+        return res
+
+    def queue_due_manga(self, conn: Connection,
+                        queue: WorkQueue[MangaServiceInfo]) -> Tuple[Dict[int, Type[BaseScraper]], List[Tuple[int, int]]]:
+        """
+        Claims the manga that need to be updated and adds them to the queue
+        ordered by their priority. Manga claimed by other schedulers are skipped.
+        The amount of manga claimed per service is limited by the throughput
+        quota of the service. Services whose circuit is open are skipped and
+        a single manga is claimed as a probe from half-open services.
+
+        Returns:
+            The scraper class of each service added to the queue and
+            the manga id, service id pairs of the claimed manga
+        """
+        scrapers = {}
+        claimed = []
+        now = datetime.now(timezone.utc)
+        with conn.cursor() as cursor:
+            # Controller state is loaded every run since other schedulers might have changed it
+            self.throughput = {
+                row['service_id']: ServiceThroughput(**row)
+                for row in DbUtil.get_service_throughput(cursor)
+            }
+            limits = {service_id: t.claim_limit(now) for service_id, t in self.throughput.items()}
+            counts = Counter()
+
+            self.breakers = {
+                row['service_id']: CircuitBreaker(**row)
+                for row in DbUtil.get_circuit_breakers(cursor)
+            }
+            half_open = set()
+            for service_id, breaker in self.breakers.items():
+                state = breaker.state(now)
+                if state is BreakerState.OPEN:
+                    limits.pop(service_id, None)
+                elif state is BreakerState.HALF_OPEN and service_id in limits:
+                    limits[service_id] = min(limits[service_id], 1)
+                    half_open.add(service_id)
+
+            no_scraper = defaultdict(list)
+            for row in DbUtil.claim_due_manga(cursor, limits, self.LEASE_DURATION):
+                claimed.append((row['manga_id'], row['service_id']))
+                counts[row['service_id']] += 1
+                Scraper = SCRAPERS.get(row['url'])
+                if not Scraper:
+                    logger.error(f'Failed to find scraper for {row}')
+                    no_scraper[row['service_id']].append(row['manga_id'])
+                    continue
+
+                scrapers[row['service_id']] = Scraper
+                queue.put(MangaServiceInfo(
+                    manga_id=row['manga_id'],
+                    title_id=row['title_id'],
+                    service_id=row['service_id'],
+                    feed_url=row['feed_url']
+                ), row['priority'])
+
+            # Otherwise the manga would be claimed again on every run
             dbutil = DbUtil(conn)
-            delete = []
-            manga_ids = []
+            for service_id, manga_ids in no_scraper.items():
+                dbutil.update_manga_next_updates(cursor, service_id, manga_ids, now + self.MISSING_SCRAPER_DELAY)
 
-            with conn.cursor() as cur:
-                for row in dbutil.get_scheduled_runs(cur):
-                    manga_id = row['manga_id']
-                    service_id = row['service_id']
-                    title_id = row['title_id']
-                    if not title_id:
-                        logger.error(f'Manga {manga_id} on service {service_id} scheduled but not found from manga service')
-                        delete.append((manga_id, service_id))
-                        continue
+            for service_id, count in counts.items():
+                self.throughput[service_id].consume(count)
 
-                    self.force_run(service_id, manga_id)
-                    delete.append((manga_id, service_id))
-                    manga_ids.append(manga_id)
+            probes = [self.breakers[service_id] for service_id in half_open if counts[service_id]]
+            for breaker in probes:
+                breaker.start_probe(now)
+            # Saved right away so other schedulers don't start probes of their own
+            DbUtil.update_circuit_breakers(cursor, [(b.service_id, b.failures, b.disabled_until) for b in probes])
 
-            dbutil.delete_scheduled_runs(delete)
+            DbUtil.update_service_allowances(cursor, [
+                (t.service_id, t.allowance, t.allowance_updated)
+                for t in self.throughput.values()
+            ])
 
-            return manga_ids
+        return scrapers, claimed
 
-    # noinspection PyPep8Naming
-    def scrape_service(self,
-                       service_id: int,
-                       Scraper: Type[BaseScraper],
-                       manga_info: Collection[MangaServiceInfo]):
-        with self.conn() as conn:
-            with conn:
-                scraper = Scraper(conn, DbUtil(conn))
-                rng = random.Random()
-                manga_ids = set()
-                errors = 0
-
-                idx = 0
-                for info in manga_info:
-                    title_id = info['title_id']
-                    manga_id = info['manga_id']
-                    feed_url = info['feed_url']
-                    logger.info(f'Updating {title_id} on service {service_id}')
-                    try:
-                        if res := scraper.scrape_series(title_id, service_id,
-                                                        manga_id, feed_url) is True:
-                            manga_ids.add(manga_id)
-                        elif res is None:
-                            errors += 1
-                            logger.error(f'Failed to scrape series {title_id} {manga_id}')
-                    except psycopg2.Error:
-                        conn.rollback()
-                        logger.exception(f'Database error while updating manga {title_id} on service {service_id}')
-                        scraper.dbutil.update_manga_next_update(service_id, manga_id, scraper.next_update())
-                        errors += 1
-                    except:
-                        conn.rollback()
-                        logger.exception(f'Unknown error while updating manga {title_id} on service {service_id}')
-                        scraper.dbutil.update_manga_next_update(service_id, manga_id, scraper.next_update())
-                        errors += 1
-
-                    if errors > 1:
-                        break
-
-                    idx += 1
-                    if idx != len(manga_info):
-                        time.sleep(rng.randint(5, 30))
+    def start_workers(self, queue: WorkQueue[MangaServiceInfo],
+                      scrapers: Dict[int, Type[BaseScraper]]) -> List[Future]:
+        """
+        Starts processing the queue on the event loop of the fetcher
 
-                scraper.set_checked(service_id)
+        Returns:
+            Futures that return the ids of the updated manga
+        """
+        if not len(queue):
+            return []
 
-                return manga_ids
+        return [self.fetcher.submit(self.process_queue(queue, scrapers))]
 
     def force_run(self, service_id: int, manga_id: int = None):
         with self.conn() as conn:
@@ -205,83 +664,198 @@ class UpdateScheduler:
                 scraper = Scraper(conn, DbUtil(conn))
                 logger.info(f'Updating service {row["url"]}')
                 with conn:
-                    retval = scraper.scrape_service(row['service_id'], row['feed_url'], None)
-                if retval:
+                    try:
+                        retval = scraper.scrape_service(row['service_id'], row['feed_url'], None)
+                    except psycopg2.Error:
+                        logger.exception(f'Database error while scraping service {service_id}')
+                        return
+                    except ServiceUpdateFailed:
+                        logger.exception(f'Failed to scrape service {service_id}')
+                        return
+
+                if retval and retval is not NOT_MODIFIED:
                     manga_ids.update(retval)
 
                 return manga_ids
 
-    def run_once(self):
-        with self.conn() as conn:
-            futures = []
-            sql = '''
-                SELECT ms.service_id, s.url, array_agg(json_build_object('title_id', ms.title_id, 'manga_id', ms.manga_id, 'feed_url', ms.feed_url)) as manga_info
-                FROM manga_service ms
-                INNER JOIN services s ON s.service_id=ms.service_id
-                WHERE NOT (s.disabled OR ms.disabled) AND (s.disabled_until IS NULL OR s.disabled_until < NOW()) AND (ms.next_update IS NULL OR ms.next_update < NOW())
-                GROUP BY ms.service_id, s.url
-            '''
-
-            with conn.cursor() as cursor:
-                cursor.execute(sql)
+    def claim_due_services(self, conn: Connection) -> List[Tuple[int, Type[BaseScraper], str]]:
+        """
+        Claims the services whose service wide feeds need to be updated.
+        Services claimed by other schedulers and services whose circuit
+        is open are skipped. Scraping the feed of a half-open service
+        is used as its probe.
+
+        Returns:
+            List of service id, scraper class and feed url of the claimed services
+        """
+        services = []
+        now = datetime.now(timezone.utc)
+        probes = []
+        with conn.cursor() as cursor:
+            for row in DbUtil.claim_due_services(cursor, self.LEASE_DURATION):
+                Scraper = SCRAPERS.get(row['url'])
+                if not Scraper:
+                    logger.error(f'Failed to find scraper for {row}')
+                    continue
 
-                manga_ids = set()
-                for row in cursor:
-                    batch_size = random.randint(3, 6)
-                    Scraper = SCRAPERS.get(row['url'])
-                    if not Scraper:
-                        logger.error(f'Failed to find scraper for {row}')
-                        continue
+                breaker = self.get_breaker(row['service_id'])
+                if breaker.state(now) is BreakerState.HALF_OPEN:
+                    breaker.start_probe(now)
+                    probes.append((breaker.service_id, breaker.failures, breaker.disabled_until))
 
-                    futures.append(self.thread_pool.submit(
-                        self.scrape_service, row['service_id'],
-                        Scraper, row['manga_info'][:batch_size]
-                    ))
+                services.append((row['service_id'], Scraper, row['feed_url']))
 
-            sql = """SELECT s.service_id, sw.feed_url, s.url
-                     FROM service_whole sw INNER JOIN services s on sw.service_id = s.service_id
-                     WHERE NOT s.disabled AND (sw.next_update IS NULL OR sw.next_update < NOW())"""
+            DbUtil.update_circuit_breakers(cursor, probes)
 
-            services = []
-            with conn.cursor() as cursor:
-                cursor.execute(sql)
-                for row in cursor:
-                    services.append(row)
+        return services
 
-            for service in services:
-                Scraper = SCRAPERS.get(service['url'])
-                if not Scraper:
-                    logger.error(f'Failed to find scraper for {service}')
-                    continue
+    # noinspection PyPep8Naming
+    def scrape_whole_service(self, service_id: int, Scraper: Type[BaseScraper], feed_url: str) -> Set[int]:
+        """
+        Scrapes the service wide feed of a service using its own connection.
+        Errors are logged and don't affect the scrapes of other services.
+        Failed scrapes count towards opening the circuit of the service.
+
+        Returns:
+            Ids of the manga that were updated
+        """
+        manga_ids = set()
+        if expired():
+            logger.warning(f'Run deadline exceeded. Skipping service {service_id} until the next run')
+            return manga_ids
 
+        breaker = self.get_breaker(service_id)
+        try:
+            with self.conn() as conn:
                 scraper = Scraper(conn, DbUtil(conn))
-                logger.info(f'Updating service {service[2]}')
+                logger.info(f'Updating service {scraper.URL}')
+
+                try:
+                    retval = scraper.scrape_service(service_id, feed_url, None)
+                    conn.commit()
+                    scraper.commit_validators()
+                    self.record_check(service_id, unchanged=retval is NOT_MODIFIED)
+                    breaker.on_success()
+                    if retval and retval is not NOT_MODIFIED:
+                        manga_ids.update(retval)
+                except psycopg2.Error:
+                    conn.rollback()
+                    logger.exception(f'Database error while scraping {feed_url}')
+                    failed = True
+                except:
+                    conn.rollback()
+                    logger.exception(f'Failed to scrape service {feed_url}')
+                    failed = True
+                else:
+                    failed = False
 
-                with conn:
+                scraper.set_checked(service_id)
+
+                if failed:
+                    now = datetime.now(timezone.utc)
+                    if not expired() and breaker.on_failure(now):
+                        logger.warning(f'Service {service_id} disabled until {breaker.disabled_until}')
+
+                    # Without this the failed service would be due again right
+                    # away and retried on every tick until the circuit opens
                     try:
-                        retval = scraper.scrape_service(service[0], service[1], None)
+                        DbUtil(conn).postpone_service_whole(service_id, now + breaker.backoff)
                     except psycopg2.Error:
-                        logger.exception(f'Database error while scraping {service[1]}')
-                        scraper.set_checked(service[0])
-                        continue
-                    except:
-                        logger.exception(f'Failed to scrape service {service[1]}')
-                        scraper.set_checked(service[0])
-                        continue
-
-                scraper.set_checked(service[0])
-                if retval:
-                    manga_ids.update(retval)
+                        logger.exception(f'Failed to postpone service {service_id}')
+        except psycopg2.Error:
+            logger.exception(f'Failed to get a connection for service {service_id}')
+
+        return manga_ids
+
+    def load_known_chapters(self, conn: Connection) -> None:
+        """
+        Reads the known chapters saved by the previous process and loads
+        the chapters added after that from the database. All chapters are
+        loaded if the file is from another database or contains chapters
+        that were deleted while the scheduler was not running.
+        """
+        known = self.known_chapters
+        with conn.cursor() as cur:
+            system_identifier, database = DbUtil.get_database_identity(cur)
+            database_id = fingerprint(f'{system_identifier}/{database}')
+
+            if known.read(database_id):
+                known.load(DbUtil.get_chapter_identifiers(cur, known.max_chapter_id))
+                if known.counts() != DbUtil.get_chapter_counts(cur, known.max_chapter_id):
+                    logger.info('Saved known chapters are out of date. Loading all chapters')
+                    known.clear()
+                    known.load(DbUtil.get_chapter_identifiers(cur))
+            else:
+                known.clear()
+                known.load(DbUtil.get_chapter_identifiers(cur))
 
-            conn.commit()
+        known.database_id = database_id
+        self._known_chapters_loaded = True
+        logger.info(f'{len(self.known_chapters)} known chapters loaded')
 
-            retval = self.do_scheduled_runs()
-            manga_ids.update(retval)
+    def save_known_chapters(self) -> None:
+        if not self._known_chapters_loaded:
+            return
+
+        try:
+            self.known_chapters.save()
+        except OSError:
+            logger.exception('Failed to save known chapters')
+
+    def run_once(self):
+        # Manga are grouped by service since whether a manga can be taken only depends on its service
+        queue = WorkQueue(key=lambda info: info['service_id'])
+        with self.conn() as conn:
+            if not self._validators_loaded:
+                with conn.cursor() as cur:
+                    self.validators.load(DbUtil.get_fetch_state(cur))
+                self._validators_loaded = True
+
+            if not self._known_chapters_loaded:
+                self.load_known_chapters(conn)
+
+            # Scheduled runs are claimed first so their manga are not claimed again as due manga
+            scheduled_scrapers, scheduled_runs = self.queue_scheduled_runs(conn, queue)
+            scrapers, claimed = self.queue_due_manga(conn, queue)
+            services = self.claim_due_services(conn)
+
+        # The deadline is passed to the threads with the context
+        with deadline(self.RUN_DEADLINE.total_seconds()):
+            # Service wide scrapes are submitted first since they are few and
+            # manga workers share the rest of the threads
+            futures = [
+                self.thread_pool.submit(contextvars.copy_context().run, self.scrape_whole_service, *service)
+                for service in services
+            ]
+            futures.extend(self.start_workers(queue, {**scheduled_scrapers, **scrapers}))
+
+        manga_ids = set()
+        for r in futures:
+            manga_ids.update(r.result())
+
+        # Skipped scheduled runs are kept so they are done on the next run
+        skipped = self.pop_skipped()
+        scheduled_runs_done = [run for run in scheduled_runs if run not in skipped]
+
+        # Responses are only reused within a single run
+        http_client.cache.clear()
+        self.report_unchanged()
+        self.report_statements()
 
-            for r in futures:
-                res = r.result()
-                if isinstance(res, set):
-                    manga_ids.update(res)
+        with self.conn() as conn:
+            dbutil = DbUtil(conn)
+            with conn.cursor() as cur:
+                dbutil.delete_scheduled_runs(cur, scheduled_runs_done)
+                dbutil.release_leases(cur, scheduled_runs + claimed, [service[0] for service in services])
+                dbutil.update_service_concurrency(cur, [
+                    (t.service_id, t.concurrency, t.latency)
+                    for t in self.throughput.values()
+                ])
+                dbutil.update_fetch_state(cur, self.validators.pop_dirty())
+                DbUtil.update_circuit_breakers(cur, self.pop_dirty_breakers())
+
+            for service_id, Scraper in scrapers.items():
+                Scraper(conn, DbUtil(conn)).set_checked(service_id)
 
             with conn:
                 if manga_ids:
@@ -289,30 +863,109 @@ class UpdateScheduler:
                     dbutil = DbUtil(conn)
                     with conn.cursor() as cursor:
                         dbutil.update_latest_release(cursor, list(manga_ids))
-                        for manga_id in manga_ids:
-                            dbutil.update_chapter_interval(cursor, manga_id)
+                        dbutil.update_chapter_intervals(cursor, manga_ids)
 
-            sql = '''
-            SELECT MIN(t.update) FROM (
-                SELECT
-                   LEAST(
-                       GREATEST(MIN(ms.next_update), s.disabled_until),
-                       (
-                           SELECT MIN(GREATEST(sw.next_update, s2.disabled_until))
-                           FROM service_whole sw 
-                               INNER JOIN services s2 ON s2.service_id = sw.service_id 
-                           WHERE s2.disabled=FALSE
-                       )
-                   ) as update
-                FROM manga_service ms
-                INNER JOIN services s ON s.service_id = ms.service_id
-                WHERE s.disabled=FALSE AND ms.disabled=FALSE
-                GROUP BY s.service_id, ms.service_id
-            ) as t
-            '''
             with conn.cursor() as cursor:
-                cursor.execute(sql)
+                statements.execute(cursor, self._next_run)
                 retval = cursor.fetchone()
                 if not retval:
                     return datetime.utcnow() + timedelta(hours=1)
                 return retval[0]
+
+    def seconds_until(self, next_run: Optional[datetime]) -> float:
+        """
+        Get the amount of seconds to sleep before next_run.
+        The value is clamped between 0 and MAX_SLEEP
+        """
+        max_sleep = self.MAX_SLEEP.total_seconds()
+        if next_run is None:
+            return max_sleep
+
+        if next_run.tzinfo is None:
+            next_run = next_run.replace(tzinfo=timezone.utc)
+
+        delta = (next_run - datetime.now(timezone.utc)).total_seconds()
+        return min(max(delta, 0), max_sleep)
+
+    def wake_up(self) -> None:
+        """
+        Interrupts the sleep of run_forever and starts the next tick immediately
+        """
+        self._wakeup_event.set()
+
+    def stop(self) -> None:
+        """
+        Makes run_forever return after the current tick has finished.
+        Safe to call from signal handlers.
+        """
+        self._stop_event.set()
+        self._wakeup_event.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop_event.is_set()
+
+    def on_notify(self, notify: Notify) -> None:
+        payload = parse_payload(notify) or {}
+        if payload.get('table') == 'chapters':
+            # Deleted chapters can be added again so they must not stay known
+            self.known_chapters.discard(payload.get('service_id'), payload.get('chapter_identifier') or '')
+            return
+
+        logger.debug(f'Woken up by a change in {payload.get("table")} '
+                     f'for manga {payload.get("manga_id")} on service {payload.get("service_id")}')
+        self.wake_up()
+
+    def start_listener(self) -> NotifyListener:
+        """
+        Starts listening to database notifications about newly scheduled
+        runs and earlier next updates, which wake up the scheduler, and
+        deleted chapters, which are removed from the known chapters.
+        """
+        listener = NotifyListener(self.connect, self.on_notify)
+        listener.start()
+        return listener
+
+    def run_forever(self, after_tick: Callable[[], Any] = None, listen: bool = True) -> None:
+        """
+        Runs run_once in a loop, sleeping until the returned next update
+        time or until wake_up is called. Keeps the connection pool and the
+        thread pool alive between ticks.
+
+        Args:
+            after_tick: Optional function called after every tick
+            listen: Whether to wake up on database notifications
+        """
+        listener = self.start_listener() if listen else None
+        try:
+            self._run_forever(after_tick)
+        finally:
+            if listener:
+                listener.stop()
+
+    def _run_forever(self, after_tick: Optional[Callable[[], Any]]) -> None:
+        while not self.stopped:
+            self._wakeup_event.clear()
+            next_run = None
+            try:
+                next_run = self.run_once()
+            except Exception:
+                logger.exception('Failed to run scheduled update')
+
+            if after_tick:
+                after_tick()
+
+            if self.stopped:
+                break
+
+            timeout = self.seconds_until(next_run)
+            logger.debug('Next update in %s', timedelta(seconds=timeout))
+            self._wakeup_event.wait(timeout)
+
+        logger.info('Scheduler stopped')
+
+    def close(self) -> None:
+        self.fetcher.close()
+        self.thread_pool.shutdown(wait=True)
+        self.save_known_chapters()
+        self.pool.closeall()
@@ -1,12 +1,20 @@
 import abc
 import logging
+from contextlib import contextmanager
 from datetime import timedelta, datetime
-from typing import Optional
+from typing import Optional, Any, Generator, Dict, Union
 
+import feedparser
 import psycopg2
+import requests
 from psycopg2.extensions import connection as Connection
 
+from src.errors import FeedHttpError
+from src.utils.async_fetch import AsyncFetcher
 from src.utils.dbutils import DbUtil
+from src.utils.http import HttpClient, http_client, Validators, NotModified, NOT_MODIFIED
+from src.utils.polling import next_poll
+from src.utils.prepared import statements
 
 logger = logging.getLogger('debug')
 
@@ -99,9 +107,13 @@ class BaseScraper(metaclass=abc.ABCMeta):
         if cls.URL is None:
             raise NotImplementedError("Service doesn't have the URL class property")
 
-    def __init__(self, conn, dbutil: DbUtil):
+    def __init__(self, conn: Optional[Connection], dbutil: Optional[DbUtil],
+                 http: Optional[HttpClient] = None):
         self._conn = conn
         self._dbutil = dbutil
+        self._http = http or http_client
+        # Validators of responses that are saved once the update succeeds
+        self._pending_validators: Dict[str, Validators] = {}
 
     @property
     def conn(self) -> Connection:
@@ -111,13 +123,33 @@ class BaseScraper(metaclass=abc.ABCMeta):
     def dbutil(self) -> DbUtil:
         return self._dbutil
 
+    @property
+    def http(self) -> HttpClient:
+        return self._http
+
+    @contextmanager
+    def bind_connection(self, conn: Connection) -> Generator[Connection, None, None]:
+        """
+        Temporarily makes the scraper use the given connection.
+        Used to give a scraper a connection only for the duration of the
+        database part of a scrape.
+        """
+        old_conn, old_dbutil = self._conn, self._dbutil
+        self._conn = conn
+        self._dbutil = DbUtil(conn)
+        try:
+            yield conn
+        finally:
+            self._conn, self._dbutil = old_conn, old_dbutil
+
+    _set_checked = statements.register('set_service_checked', 'UPDATE services SET last_check=$1 WHERE service_id=$2')
+
     def set_checked(self, service_id: int) -> None:
+        # The amount of updates per service is limited by the throughput
+        # quota of the service so the service is not disabled after updates
         with self.conn.cursor() as cursor:
-            now = datetime.utcnow()
-            disabled_until = now + self.min_update_interval()
-            sql = "UPDATE services SET last_check=%s, disabled_until=%s WHERE service_id=%s"
             try:
-                cursor.execute(sql, (datetime.utcnow(), disabled_until, service_id))
+                statements.execute(cursor, self._set_checked, (datetime.utcnow(), service_id))
             except psycopg2.Error:
                 logger.exception(f'Failed to update last check of {service_id}')
                 return
@@ -128,8 +160,93 @@ class BaseScraper(metaclass=abc.ABCMeta):
     def min_update_interval() -> timedelta:
         raise NotImplementedError
 
-    def next_update(self) -> datetime:
-        return datetime.utcnow() + self.min_update_interval()
+    def next_update(self, estimated_release: Optional[datetime] = None,
+                    release_interval: Optional[timedelta] = None) -> datetime:
+        """
+        Returns the time of the next update of a manga. When the estimated
+        release is given the manga is checked often around the release and
+        less often the further away the release is.
+        """
+        return next_poll(self.min_update_interval(), estimated_release, release_interval)
+
+    def schedule_next_update(self, service_id: int, manga_id: int) -> datetime:
+        """
+        Sets the next update of the manga based on its estimated release
+        """
+        estimate = self.dbutil.get_release_estimate(manga_id)
+        if estimate:
+            next_update = self.next_update(estimate['estimated_release'], estimate['release_interval'])
+        else:
+            next_update = self.next_update()
+
+        self.dbutil.update_manga_next_update(service_id, manga_id, next_update)
+        return next_update
+
+    def skip_update(self, service_id: int, manga_id: int) -> None:
+        """
+        Called instead of save_series when the manga has not changed since
+        the last update. Only schedules the next update.
+        """
+        self.schedule_next_update(service_id, manga_id)
+
+    def stage_validators(self, url: str, r: requests.Response) -> None:
+        """
+        Remembers the validators of a successfully processed response.
+        They are only used for conditional requests after commit_validators is called.
+        """
+        self._pending_validators[url] = Validators.from_response(r)
+
+    def commit_validators(self) -> None:
+        """
+        Makes the staged validators available for conditional requests.
+        Should be called after the data of the responses has been saved.
+        """
+        if self._pending_validators:
+            self.http.validators.update(self._pending_validators)
+            self._pending_validators = {}
+
+    def fetch_feed(self, url: str) -> Union[feedparser.FeedParserDict, NotModified]:
+        """
+        Fetches and parses a feed with a conditional request.
+        Validators of the feed are staged if it's valid.
+
+        Returns:
+            The parsed feed or NOT_MODIFIED if the feed has not changed
+
+        Raises:
+            FeedHttpError: If the request failed
+        """
+        try:
+            r = self.http.get_conditional(url)
+        except requests.RequestException as e:
+            raise FeedHttpError(f'Failed to get feed {url}. {e}') from e
+
+        return self.parse_feed_response(url, r)
+
+    async def fetch_feed_async(self, fetcher: AsyncFetcher, url: str) -> Union[feedparser.FeedParserDict, NotModified]:
+        """
+        Same as fetch_feed but waits for the response on the event loop of the fetcher
+        """
+        try:
+            r = await fetcher.get(url, conditional=True)
+        except requests.RequestException as e:
+            raise FeedHttpError(f'Failed to get feed {url}. {e}') from e
+
+        return self.parse_feed_response(url, r)
+
+    def parse_feed_response(self, url: str, r: Union[requests.Response, NotModified]) -> Union[feedparser.FeedParserDict, NotModified]:
+        if r is NOT_MODIFIED:
+            return r
+
+        # feedparser expects lowercase header names
+        feed = feedparser.parse(r.content, response_headers={k.lower(): v for k, v in r.headers.items()})
+        feed['status'] = r.status_code
+        feed['headers'] = r.headers
+
+        if r.status_code == 200 and not feed.bozo:
+            self.stage_validators(url, r)
+
+        return feed
 
     @abc.abstractmethod
     def scrape_series(self, title_id: str, service_id: int, manga_id: int, feed_url: Optional[str] = None) -> Optional[bool]:
@@ -140,6 +257,43 @@ class BaseScraper(metaclass=abc.ABCMeta):
         """
         raise NotImplementedError
 
+    def fetch_series(self, title_id: str, service_id: int, manga_id: int, feed_url: Optional[str] = None) -> Optional[Any]:
+        """
+        Network and parsing part of scrape_series. The database connection
+        must not be used here as it is not held during this call.
+        Scrapers that don't split their work do everything in save_series.
+
+        Returns:
+            Data that is passed to save_series, NOT_MODIFIED if the manga
+            has not changed since the last update or None if fetching failed
+        """
+        return True
+
+    async def fetch_series_async(self, fetcher: AsyncFetcher, title_id: str, service_id: int, manga_id: int,
+                                 feed_url: Optional[str] = None) -> Optional[Any]:
+        """
+        Async version of fetch_series used by the scheduler. Scrapers that
+        implement it make their requests with the fetcher so that waiting for
+        responses doesn't reserve a thread. By default fetch_series is run
+        on a transfer thread of the fetcher.
+
+        Returns:
+            Same as fetch_series
+        """
+        return await fetcher.run(self.fetch_series, title_id, service_id, manga_id, feed_url)
+
+    def save_series(self, data: Any, title_id: str, service_id: int, manga_id: int, feed_url: Optional[str] = None) -> Optional[bool]:
+        """
+        Database part of scrape_series.
+
+        Args:
+            data: Return value of fetch_series
+
+        Returns:
+            Same as scrape_series
+        """
+        return self.scrape_series(title_id, service_id, manga_id, feed_url)
+
     @abc.abstractmethod
     def scrape_service(self, service_id: int, feed_url: str, last_update: Optional[datetime], title_id: Optional[str] = None):
         raise NotImplementedError
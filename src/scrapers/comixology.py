@@ -1,6 +1,5 @@
 import logging
 import re
-import time
 from datetime import timedelta, datetime
 from typing import Optional, Iterable, Union, List
 
@@ -10,6 +9,7 @@ from psycopg2.extras import execute_values
 
 from src.scrapers.base_scraper import BaseScraper, BaseChapter
 from src.utils.dbutils import DbUtil
+from src.utils.http import HttpClient, parse_html
 from src.utils.utilities import random_timedelta
 
 logger = logging.getLogger('debug')
@@ -121,18 +121,14 @@ class ComiXology(BaseScraper):
     CHAPTER_URL_FORMAT = 'https://www.comixology.com/chapter/digital-comic/{}'
     MANGA_URL_FORMAT = 'https://www.comixology.com/series/comics-series/{}'
 
-    def __init__(self, conn, dbutil: DbUtil):
-        super().__init__(conn, dbutil)
+    def __init__(self, conn, dbutil: DbUtil, http: Optional[HttpClient] = None):
+        super().__init__(conn, dbutil, http=http)
         self.service_id = None
 
     @staticmethod
     def min_update_interval() -> timedelta:
         return random_timedelta(timedelta(hours=1), timedelta(hours=2))
 
-    @staticmethod
-    def wait() -> None:
-        time.sleep(random_timedelta(timedelta(seconds=2), timedelta(seconds=10)).total_seconds())
-
     def scrape_series(self, title_id, service_id, manga_id, feed_url=None):
         pass
 
@@ -140,15 +136,20 @@ class ComiXology(BaseScraper):
         pass
 
     def get_chapter_release_date(self, url: str) -> Optional[datetime]:
-        r = requests.get(url)
-        if r.status_code == 429:
-            logger.error(f'Ratelimited on {self.URL}')
-            return
+        try:
+            with self.http.get(url, stream=True) as r:
+                if r.status_code == 429:
+                    logger.error(f'Ratelimited on {self.URL}')
+                    return
 
-        if r.status_code != 200:
+                if r.status_code != 200:
+                    return
+
+                root = parse_html(r)
+        except requests.RequestException:
+            logger.exception(f'Failed to fetch {url}')
             return
 
-        root = etree.HTML(r.text)
         children = root.cssselect('.credits')[0].getchildren()
 
         for idx, c in enumerate(children):
@@ -176,27 +177,30 @@ class ComiXology(BaseScraper):
 
         for source in manga_links:
             manga = source.manga
-            r = requests.get(source.manga_url)
+            try:
+                r = self.http.get(source.manga_url, cache=True)
+            except requests.RequestException:
+                logger.exception(f'Failed to fetch {source.manga_url}')
+                continue
+
             if r.status_code == 429:
                 logger.error(f'Ratelimited on {self.URL}')
                 return False
 
             if r.status_code != 200:
-                self.wait()
                 continue
 
-            root = etree.HTML(r.text)
+            root = parse_html(r)
             chapter_elements = root.cssselect('.list-content.item-list li.content-item')
             if not chapter_elements:
                 logger.warning(f'No chapters found for {source.manga_url}')
-                self.wait()
                 continue
 
             chapters = [Chapter(c, manga.title) for c in chapter_elements]
             manga_id = manga.manga_id
 
             # Check if any new chapters
-            new_chapters: List[Chapter] = list(self.dbutil.get_only_latest_entries(self.service_id, chapters, manga_id=manga_id))
+            new_chapters: List[Chapter] = list(self.dbutil.get_new_entries(self.service_id, chapters))
 
             if not new_chapters:
                 continue
@@ -261,7 +265,6 @@ class ComiXology(BaseScraper):
                           'last_check=EXCLUDED.last_check'
                     cur.execute(sql, (manga.manga_id, self.service_id, manga.title_id))
 
-            self.wait()
             updated += 1
 
         self.set_checked(self.service_id)
@@ -5,13 +5,13 @@ from calendar import timegm
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 
-import feedparser
 import psycopg2
 from psycopg2.extras import execute_values
 
-from src.errors import FeedHttpError, InvalidFeedError
+from src.errors import FeedHttpError, InvalidFeedError, ServiceUpdateFailed
 from src.scrapers.base_scraper import BaseScraper, BaseChapter
 from src.utils.feedparsing import get_latest_entries
+from src.utils.http import NOT_MODIFIED
 from src.utils.utilities import match_title, is_valid_feed, get_latest_chapters
 
 logger = logging.getLogger('debug')
@@ -110,15 +110,15 @@ class JaiminisBox(BaseScraper):
             logger.exception(f'Failed to update service {service_id}')
 
     def scrape_service(self, service_id: int, feed_url: str, last_update: Optional[datetime], title_id: Optional[str] = None):
-        feed = feedparser.parse(self.FEED_URL)
         try:
+            feed = self.fetch_feed(self.FEED_URL)
+            if feed is NOT_MODIFIED:
+                logger.info('No new entries found')
+                return feed
+
             is_valid_feed(feed)
         except (FeedHttpError, InvalidFeedError) as e:
-            if isinstance(e, FeedHttpError):
-                logger.info(str(e))
-            else:
-                logger.exception(f'Failed to fetch feed {feed_url}')
-            return
+            raise ServiceUpdateFailed(f'Failed to fetch feed {self.FEED_URL}') from e
 
         with self.conn as conn:
             with conn.cursor() as cur:
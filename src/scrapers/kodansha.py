@@ -1,14 +1,16 @@
 import logging
 import re
 from datetime import timedelta, datetime
-from typing import Optional, Collection, List
+from typing import Optional, Collection, List, Union
 
 import psycopg2
 import requests
 from lxml import etree
 from psycopg2.extras import execute_values
 
+from src.errors import ServiceUpdateFailed
 from src.scrapers.base_scraper import BaseScraper, BaseChapter
+from src.utils.http import NOT_MODIFIED
 from src.utils.utilities import random_timedelta
 from src.db.models.manga import MangaService as BaseManga
 
@@ -140,8 +142,16 @@ class KodanshaComics(BaseScraper):
         return random_timedelta(timedelta(hours=1), timedelta(hours=2))
 
     def scrape_series(self, title_id: str, service_id: int, manga_id: Optional[int], feed_url: str = None) -> Optional[bool]:
-        retval = self._scrape_service(service_id, feed_url, only_title_ids={title_id}, forced=True)
-        return bool(retval) if retval is not None else retval
+        try:
+            retval = self._scrape_service(service_id, feed_url, only_title_ids={title_id}, forced=True)
+        except ServiceUpdateFailed:
+            logger.exception(f'Failed to update {title_id}')
+            return None
+
+        if retval is None or retval is NOT_MODIFIED:
+            return None if retval is None else False
+
+        return bool(retval)
 
     def set_checked(self, service_id: int) -> None:
         try:
@@ -151,7 +161,7 @@ class KodanshaComics(BaseScraper):
             logger.exception(f'Failed to update service {service_id}')
 
     @staticmethod
-    def parse_manga_from_html(html: str) -> Optional[List[Manga]]:
+    def parse_manga_from_html(html: Union[str, bytes]) -> Optional[List[Manga]]:
         root = etree.HTML(html)
 
         manga_intervals = root.cssselect('.simulpubs__list-sections .simulpubs-list-section')
@@ -192,14 +202,31 @@ class KodanshaComics(BaseScraper):
             feed_url ():
             only_title_ids (): Only update these title ids
             forced (): If update is forced even when no new chapter is found
+
+        Raises:
+            ServiceUpdateFailed: If the manga list could not be fetched or parsed
         """
-        r = requests.get(feed_url)
+        try:
+            # Updates of selected manga must not be skipped because the
+            # page is the same as when the whole service was last updated
+            if forced or only_title_ids:
+                r = self.http.get(feed_url)
+            else:
+                r = self.http.get_conditional(feed_url)
+        except requests.RequestException as e:
+            raise ServiceUpdateFailed(f'Failed to fetch {feed_url}') from e
+
+        if r is NOT_MODIFIED:
+            logger.info(f'{feed_url} has not changed')
+            return r
+
         if r.status_code != 200:
-            return
+            raise ServiceUpdateFailed(f'Failed to fetch {feed_url}. Status {r.status_code}')
 
-        mangas = self.parse_manga_from_html(r.text)
+        # Bytes are given to the parser so the page isn't decoded to a string first
+        mangas = self.parse_manga_from_html(r.content)
         if mangas is None:
-            return
+            raise ServiceUpdateFailed(f'Failed to parse manga from {feed_url}')
 
         old_manga = self.dbutil.get_service_manga(service_id)
         old_manga = {r['title_id']: r for r in old_manga}
@@ -247,7 +274,7 @@ class KodanshaComics(BaseScraper):
                         #logger.debug(f'Scraper {source.base_url} not found')
                         continue
 
-                    scraper = Scraper(self.conn, self.dbutil)
+                    scraper = Scraper(self.conn, self.dbutil, http=self.http)
                     scrapers[source.base_url] = scraper
                     if not getattr(scraper, 'update_selected_manga', None):
                         logger.warning(f'Required method not found for {scraper.URL}')
@@ -267,6 +294,10 @@ class KodanshaComics(BaseScraper):
             if 0 < updated and updated >= len(manga.sources) - non_existing:
                 updated_manga.append(manga)
 
+        # The page only needs to be processed again after it changes if every manga on it was updated
+        if not only_title_ids and len(updated_manga) == len(mangas_to_update):
+            self.stage_validators(feed_url, r)
+
         if updated_manga:
             logger.info('%s manga actually updated on kodansha', len(updated_manga))
             with self.conn:
@@ -6,17 +6,18 @@ from calendar import timegm
 from datetime import datetime, timedelta
 from itertools import groupby
 from json.decoder import JSONDecodeError
-from typing import Dict, Collection, Iterable, Optional, List, Any
+from typing import Dict, Iterable, Optional, List, Any, Tuple
 
-import feedparser
 import psycopg2
 import requests
 from psycopg2.extras import execute_values
 
 from src.db.models.manga import MangaService
 from src.enums import Status
-from src.errors import FeedHttpError, InvalidFeedError
+from src.errors import FeedHttpError, InvalidFeedError, ServiceUpdateFailed
 from src.scrapers.base_scraper import BaseScraper, BaseChapter
+from src.utils.async_fetch import AsyncFetcher
+from src.utils.http import NOT_MODIFIED
 from src.utils.utilities import match_title, is_valid_feed, get_latest_chapters
 
 logger = logging.getLogger('debug')
@@ -106,21 +107,54 @@ class MangaDex(BaseScraper):
         return MangaDex.UPDATE_INTERVAL
 
     def scrape_series(self, title_id: str, service_id: int, manga_id: Optional[int], feed_url: str = None):
+        data = self.fetch_series(title_id, service_id, manga_id, feed_url)
+        if data is None:
+            return
+
+        return self.save_series(data, title_id, service_id, manga_id, feed_url)
+
+    def fetch_series(self, title_id: str, service_id: int, manga_id: Optional[int], feed_url: str = None) -> Optional[Tuple[dict, List[Chapter]]]:
+        """
+        Returns:
+            The data object of the manga api response and the parsed chapters
+        """
         url = f'{MangaDex.MANGADEX_API}/manga/{title_id}?include=chapters'
         try:
-            r = requests.get(url)
-            data = r.json()
-        except requests.HTTPError:
+            r = self.http.get(url, cache=True)
+        except requests.RequestException:
             logger.exception(f'Failed to fetch manga from {url}')
             return
 
+        return self.series_from_response(title_id, url, r)
+
+    async def fetch_series_async(self, fetcher: AsyncFetcher, title_id: str, service_id: int, manga_id: Optional[int],
+                                 feed_url: str = None) -> Optional[Tuple[dict, List[Chapter]]]:
+        url = f'{MangaDex.MANGADEX_API}/manga/{title_id}?include=chapters'
+        try:
+            r = await fetcher.get(url, cache=True)
+        except requests.RequestException:
+            logger.exception(f'Failed to fetch manga from {url}')
+            return
+
+        return self.series_from_response(title_id, url, r)
+
+    def series_from_response(self, title_id: str, url: str, r: requests.Response) -> Optional[Tuple[dict, List[Chapter]]]:
+        try:
+            data = r.json()
+        except ValueError:
+            logger.exception(f'Failed to decode manga from {url}')
+            return
+
         if 'data' not in data or data.get('status', '').upper() != 'OK':
             logger.warning(f'Failed to get manga data from {url}')
             return
 
         data = data['data']
-        manga = data['manga']
-        manga_title = manga['title']
+        return data, self.parse_chapters(title_id, data)
+
+    @staticmethod
+    def parse_chapters(title_id: str, data: dict) -> List[Chapter]:
+        manga_title = data['manga']['title']
         chapters: List[Chapter] = []
         groups = {}
 
@@ -154,7 +188,13 @@ class MangaDex(BaseScraper):
 
             chapters.append(c)
 
-        entries = self.dbutil.get_only_latest_entries(service_id, chapters, manga_id=manga_id, limit=len(chapters)*2)
+        return chapters
+
+    def save_series(self, series: Tuple[dict, List[Chapter]], title_id: str, service_id: int, manga_id: Optional[int], feed_url: str = None):
+        data, chapters = series
+        manga_title = data['manga']['title']
+
+        entries = self.dbutil.get_new_entries(service_id, chapters)
         all_chapters = set(chapters)
         old_chapters = all_chapters.difference(entries)
         entries: List[Chapter] = list(entries)
@@ -187,7 +227,10 @@ class MangaDex(BaseScraper):
             manga_id = manga_services[0].manga_id
 
         self.dbutil.add_chapters(manga_id, service_id, entries, fetch=False)
-        self.update_chapter_infos([title_id], [c.chapter_identifier for c in entries], service_id)
+        # The chapter infos are already in the fetched data so no need to request them again
+        self.save_chapter_infos(*self.parse_chapter_infos(
+            [(title_id, data)], [c.chapter_identifier for c in entries], service_id
+        ))
         return True
 
     def set_checked(self, service_id: int) -> None:
@@ -197,20 +240,6 @@ class MangaDex(BaseScraper):
         except psycopg2.Error:
             logger.exception(f'Failed to update service {service_id}')
 
-    def get_only_latest_entries(self, service_id: int, entries: Iterable[Chapter]) -> Collection[Chapter]:
-        try:
-            sql = 'SELECT chapter_identifier FROM chapters WHERE service_id=%s ORDER BY chapter_id DESC LIMIT 400'
-            with self.conn as conn:
-                with conn.cursor() as cur:
-                    cur.execute(sql, (service_id,))
-                    chapters = set(r[0] for r in cur)
-
-            return set(entries).difference(chapters)
-
-        except:
-            logger.exception('Failed to get old chapters')
-            return list(entries)
-
     @staticmethod
     def parse_feed(entries: typing.Iterable[dict]) -> List[Chapter]:
         titles = []
@@ -258,14 +287,20 @@ class MangaDex(BaseScraper):
         return titles
 
     def scrape_service(self, service_id: int, feed_url: str, last_update: Optional[datetime], title_id: Optional[str] = None):
-        feed = feedparser.parse(feed_url if not title_id else feed_url + f'/manga_id/{title_id}')
+        if title_id:
+            feed_url += f'/manga_id/{title_id}'
+
         try:
+            feed = self.fetch_feed(feed_url)
+            if feed is NOT_MODIFIED:
+                logger.debug(f'{feed_url} not modified')
+                return feed
+
             is_valid_feed(feed)
-        except (FeedHttpError, InvalidFeedError):
-            logger.exception(f'Failed to fetch feed {feed_url}')
-            return
+        except (FeedHttpError, InvalidFeedError) as e:
+            raise ServiceUpdateFailed(f'Failed to fetch feed {feed_url}') from e
 
-        entries = self.get_only_latest_entries(service_id, self.parse_feed(feed.entries))
+        entries = self.dbutil.get_new_entries(service_id, self.parse_feed(feed.entries))
 
         if not entries:
             logger.info('No new entries found')
@@ -328,16 +363,30 @@ class MangaDex(BaseScraper):
         if not title_ids:
             return
 
+        manga_data = self.fetch_chapter_infos(title_ids)
+        if not manga_data:
+            return
+
+        self.save_chapter_infos(*self.parse_chapter_infos(manga_data, chapter_ids, service_id))
+
+    def fetch_chapter_infos(self, title_ids: Iterable[str]) -> Optional[List[Tuple[str, dict]]]:
+        """
+        Fetches manga data from the mangadex api without touching the database
+        Args:
+            title_ids: Mangadex title ids
+
+        Returns:
+            List of title id and manga api data pairs or None if fetching failed
+        """
         url = self.MANGADEX_API + '/manga/{}?include=chapters'
         headers = {}
         fails = 0
-        sleep = 0.1
-        chapters = []
-        manga_info = []
+        manga_data = []
 
-        for idx, title_id in enumerate(title_ids):
+        for title_id in title_ids:
+            manga_url = url.format(title_id)
             try:
-                r = requests.get(url.format(title_id), headers=headers)
+                r = self.http.get(manga_url, cache=True, headers=headers)
             except requests.RequestException:
                 logger.exception('Failed to fetch manga data from mangadex api')
                 return
@@ -361,7 +410,26 @@ class MangaDex(BaseScraper):
                     return
                 continue
 
-            data = data.get('data', {})
+            manga_data.append((title_id, data.get('data', {})))
+
+        return manga_data
+
+    @staticmethod
+    def parse_chapter_infos(manga_data: Iterable[Tuple[str, dict]], chapter_ids: Iterable[str],
+                            service_id: int) -> Tuple[List[tuple], List[tuple]]:
+        """
+        Args:
+            manga_data: Title id and manga api data pairs
+            chapter_ids: Chapter identifiers whose titles will be updated
+            service_id: Id of the mangadex service
+
+        Returns:
+            Tuple of chapter title rows and manga info rows
+        """
+        chapters = []
+        manga_info = []
+
+        for title_id, data in manga_data:
             manga = data.get('manga', {})
             cover = manga.get('cover_url')
             if cover:
@@ -399,12 +467,9 @@ class MangaDex(BaseScraper):
                     service_id
                 ))
 
-            if idx % 10 == 0:
-                time.sleep(1)
-                sleep += 0.2
-            else:
-                time.sleep(sleep)
+        return chapters, manga_info
 
+    def save_chapter_infos(self, chapters: List[tuple], manga_info: List[tuple]):
         if not chapters:
             return
 
@@ -4,10 +4,12 @@ from datetime import datetime, timedelta, timezone
 from typing import Optional, List, Union, Tuple
 
 import requests
-from psycopg2.extras import execute_batch
 
 from src.enums import Status
+from src.errors import ServiceUpdateFailed
 from src.scrapers.base_scraper import BaseScraper, BaseChapter
+from src.utils.async_fetch import AsyncFetcher
+from src.utils.http import NOT_MODIFIED, NotModified
 from src.utils.utilities import random_timedelta
 from .protobuf import mangaplus_pb2
 from ...db.models.manga import MangaService
@@ -270,6 +272,8 @@ class MangaPlus(BaseScraper):
     SPECIAL_CHAPTER_REGEX = re.compile(r'\s*(#?ex|one[- ]?shot)s*', re.I)
     CHAPTER_URL_FORMAT = 'https://mangaplus.shueisha.co.jp/viewer/{}'
     MANGA_URL_FORMAT = 'https://mangaplus.shueisha.co.jp/titles/{}'
+    # Used when the release of the next chapter cannot be estimated
+    DEFAULT_UPDATE_INTERVAL = timedelta(hours=4)
 
     @staticmethod
     def min_update_interval() -> timedelta:
@@ -286,39 +290,57 @@ class MangaPlus(BaseScraper):
 
         return int(match.groups()[0]), None
 
-    def parse_series(self, title_id: str) -> Union[bool, Optional[TitleDetailViewWrapper]]:
+    def parse_series(self, title_id: str, conditional: bool = True) -> Union[None, NotModified, TitleDetailViewWrapper]:
+        """
+        Args:
+            title_id: Title id of the manga
+            conditional: If False the series is fetched even when it hasn't changed
+        """
+        url = self.API.format(title_id)
         try:
-            r = requests.get(self.API.format(title_id))
+            r = self.http.get_conditional(url) if conditional else self.http.get(url)
         except requests.RequestException:
             logger.exception('Failed to fetch series')
             return
 
+        return self.title_detail_from_response(url, r)
+
+    def title_detail_from_response(self, url: str, r: Union[requests.Response, NotModified]) -> Union[None, NotModified, TitleDetailViewWrapper]:
+        if r is NOT_MODIFIED:
+            return r
+
         if r.status_code != 200:
             return
 
         resp = ResponseWrapper(r.content)
         title_detail = resp.title_detail_view
+        if title_detail:
+            self.stage_validators(url, r)
 
         return title_detail
 
-    @staticmethod
-    def get_all_titles(api_url: str) -> Optional[AllTitlesViewWrapper]:
+    def get_all_titles(self, api_url: str) -> Union[None, NotModified, AllTitlesViewWrapper]:
         try:
-            r = requests.get(api_url)
+            r = self.http.get_conditional(api_url)
         except requests.RequestException:
             logger.exception('Failed to fetch all mangaplus titles')
             return
 
+        if r is NOT_MODIFIED:
+            return r
+
         if r.status_code != 200:
             return
 
         resp = ResponseWrapper(r.content)
         all_titles = resp.all_titles_view
+        if all_titles:
+            self.stage_validators(api_url, r)
 
         return all_titles
 
     def add_series(self, title_id: str) -> Optional[bool]:
-        series = self.parse_series(title_id)
+        series = self.parse_series(title_id, conditional=False)
         if not isinstance(series, TitleDetailViewWrapper):
             return series
 
@@ -343,7 +365,10 @@ class MangaPlus(BaseScraper):
     def scrape_service(self, service_id: int, feed_url: str, last_update: Optional[datetime], title_id: Optional[str] = None):
         self.dbutil.update_service_whole(service_id, timedelta(days=1) + self.min_update_interval())
         all_titles = self.get_all_titles(feed_url)
-        if not all_titles:
+        if all_titles is None:
+            raise ServiceUpdateFailed(f'Failed to fetch all titles from {feed_url}')
+
+        if all_titles is NOT_MODIFIED:
             return all_titles
 
         titles = all_titles.titles
@@ -370,17 +395,59 @@ class MangaPlus(BaseScraper):
 
     def scrape_series(self, title_id: str, service_id: int, manga_id: int,
                       feed_url=None) -> Optional[bool]:
-        series = self.parse_series(title_id)
+        series = self.fetch_series(title_id, service_id, manga_id, feed_url)
+        if series is NOT_MODIFIED:
+            self.skip_update(service_id, manga_id)
+            return False
+
         if not isinstance(series, TitleDetailViewWrapper):
             return series
 
+        return self.save_series(series, title_id, service_id, manga_id, feed_url)
+
+    def fetch_series(self, title_id: str, service_id: int, manga_id: int,
+                     feed_url=None) -> Union[None, NotModified, TitleDetailViewWrapper]:
+        return self.parse_series(title_id)
+
+    async def fetch_series_async(self, fetcher: AsyncFetcher, title_id: str, service_id: int, manga_id: int,
+                                 feed_url=None) -> Union[None, NotModified, TitleDetailViewWrapper]:
+        url = self.API.format(title_id)
+        try:
+            r = await fetcher.get(url, conditional=True)
+        except requests.RequestException:
+            logger.exception('Failed to fetch series')
+            return
+
+        return self.title_detail_from_response(url, r)
+
+    def next_release_update(self, next_release: datetime) -> datetime:
+        """
+        Returns the time of the next update based on the release time of the next chapter
+        """
+        if next_release.tzinfo is not None:
+            next_release = next_release.astimezone(timezone.utc).replace(tzinfo=None)
+
+        if next_release > datetime.utcnow():
+            return next_release
+
+        # Release time has passed but the chapter wasn't out yet
+        return self.next_update(next_release)
+
+    def skip_update(self, service_id: int, manga_id: int) -> None:
+        # The title detail has not changed so the release time of the next
+        # chapter is the same as the one saved during the last update
+        next_release = self.dbutil.get_next_release(service_id, manga_id)
+        if next_release is None:
+            super().skip_update(service_id, manga_id)
+            return
+
+        self.dbutil.update_manga_next_update(service_id, manga_id, self.next_release_update(next_release))
+
+    def save_series(self, series: TitleDetailViewWrapper, title_id: str,
+                    service_id: int, manga_id: int, feed_url=None) -> Optional[bool]:
         return self.add_chapters(series, service_id, manga_id)
 
     def add_chapters(self, series: TitleDetailViewWrapper, service_id: int, manga_id: int) -> Optional[bool]:
-        sql = 'INSERT INTO chapters (manga_id, service_id, title, chapter_number, chapter_decimal, chapter_identifier, release_date, "group") ' \
-              'VALUES (%s, %s, %s, %s, %s, %s, %s, \'Shueisha\') ON CONFLICT DO NOTHING '
-
-        base_values = (manga_id, service_id)
         chapters: List[ChapterWrapper] = [*series.first_chapter_list, *series.last_chapter_list]
 
         # Update chapter number for special chapters
@@ -396,22 +463,18 @@ class MangaPlus(BaseScraper):
 
             c._chapter_number = prev_chapter.chapter_number
 
-        data = [(*base_values, c.title, c.chapter_number, c.decimal,
-                 c.chapter_identifier, c.release_date)
-                for c in chapters]
-
         now = datetime.utcnow()
-        next_update = now + timedelta(hours=4)
+        # None means that the next update is based on the estimated release of the manga
+        next_update = None
         disabled = False
         completed = False
         if series.next_timestamp:
-            next_update = series.next_timestamp
+            next_update = self.next_release_update(series.next_timestamp)
         elif series.non_appearance_info:
             release_info = series.non_appearance_info.lower()
             if 'hiatus' in release_info:
                 next_update = now + timedelta(days=1)
             elif 'completed' in release_info:
-                next_update = None
                 disabled = True
                 completed = True
 
@@ -426,13 +489,21 @@ class MangaPlus(BaseScraper):
 
         with self.conn:
             with self.conn.cursor() as cursor:
-                execute_batch(cursor, sql, data)
+                self.dbutil.add_chapters(cursor, manga_id, service_id, chapters, fetch=False)
 
-                sql = 'UPDATE manga_service SET last_check=%s, next_update=%s, disabled=%s WHERE manga_id=%s AND service_id=%s'
-                cursor.execute(sql, [now, next_update, disabled, manga_id, service_id])
                 if newest_chapter:
                     self.dbutil.update_latest_chapter(cursor, ((manga_id, newest_chapter.chapter_number, newest_chapter.release_date),))
 
+                if next_update is None and not completed:
+                    estimate = self.dbutil.get_release_estimate(cursor, manga_id)
+                    if estimate and estimate['estimated_release']:
+                        next_update = self.next_update(estimate['estimated_release'], estimate['release_interval'])
+                    else:
+                        next_update = now + self.DEFAULT_UPDATE_INTERVAL
+
+                sql = 'UPDATE manga_service SET last_check=%s, next_update=%s, disabled=%s, next_release=%s WHERE manga_id=%s AND service_id=%s'
+                cursor.execute(sql, [now, next_update, disabled, series.next_timestamp, manga_id, service_id])
+
                 if completed:
                     sql = 'INSERT INTO manga_info (manga_id, status, artist, author) VALUES (%s, %s, %s, %s) ON CONFLICT (manga_id) DO UPDATE SET status=EXCLUDED.status'
                     author = series.title.author.split(' / ')
@@ -1,20 +1,29 @@
 import logging
+import os
 import re
 import time
 import typing
 from calendar import timegm
-from datetime import datetime, timedelta
-from typing import Dict, Optional, List, Any
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, List, Any, Union, Set, Tuple, Iterable
+from urllib.parse import parse_qsl, urlencode
 
-import feedparser
+import psycopg2
+from feedparser import FeedParserDict
 from lxml import etree
 
-from src.errors import FeedHttpError, InvalidFeedError, RequiredInformationMissing
+from src.errors import FeedHttpError, InvalidFeedError, RequiredInformationMissing, ServiceUpdateFailed
 from src.scrapers.base_scraper import BaseScraper, BaseChapter
+from src.utils.async_fetch import AsyncFetcher
+from src.utils.http import NOT_MODIFIED, NotModified
 from src.utils.utilities import match_title, is_valid_feed, get_latest_chapters
 
 logger = logging.getLogger('debug')
 
+# Update all Reddit manga with combined multireddit feeds. Set to any non empty value to enable
+REDDIT_COMBINED_FEEDS = bool(os.environ.get('REDDIT_COMBINED_FEEDS'))
+
 
 class Chapter(BaseChapter):
     def __init__(self, chapter: Optional[str], chapter_identifier: str, title_id: str,
@@ -82,14 +91,27 @@ class Reddit(BaseScraper):
     NAME = 'Reddit'
     CHAPTER_REGEX = re.compile(r'(?:.+?)?(chapter|update) (?P<chapter>\d+)(?: \(?part (?P<decimal>\d+)\)?)?(?P<language> \[.+?])?(?: translated)?', re.I)
     SUBREDDIT_REGEX = re.compile(r'https?://(?:www\.)?reddit.com/(r/\w+).*')
+    FEED_URL_REGEX = re.compile(r'https?://(?:www\.)?reddit\.com/r/(?P<subreddit>\w+)(?P<path>/[^?#]*)?(?:\?(?P<query>[^#]*))?$')
     UPDATE_INTERVAL = timedelta(minutes=30)
     CHAPTER_URL_FORMAT = '{}'
     MANGA_URL_FORMAT = 'https://www.reddit.com/r/{}'
+    FEED_URL = URL
+    # Maximum amount of subreddits combined into a single multireddit feed
+    MAX_SUBREDDITS_PER_FEED = 25
+    # Amount of posts requested from a combined feed. Reddit returns at most 100
+    COMBINED_FEED_LIMIT = 100
 
     @staticmethod
     def min_update_interval() -> timedelta:
         return Reddit.UPDATE_INTERVAL
 
+    def set_checked(self, service_id: int) -> None:
+        try:
+            super().set_checked(service_id)
+            self.dbutil.update_service_whole(service_id, self.min_update_interval())
+        except psycopg2.Error:
+            logger.exception(f'Failed to update service {service_id}')
+
     @staticmethod
     def parse_feed(entries: typing.Iterable[dict]) -> List[Chapter]:
         chapters = []
@@ -141,22 +163,73 @@ class Reddit(BaseScraper):
         return chapters
 
     def scrape_series(self, title_id: str, service_id: int, manga_id: int, feed_url: Optional[str] = None) -> Optional[bool]:
+        chapters = self.fetch_series(title_id, service_id, manga_id, feed_url)
+        if chapters is None:
+            return
+
+        if chapters is NOT_MODIFIED:
+            self.skip_update(service_id, manga_id)
+            return False
+
+        return self.save_series(chapters, title_id, service_id, manga_id, feed_url)
+
+    def fetch_series(self, title_id: str, service_id: int, manga_id: int, feed_url: Optional[str] = None) -> Union[None, NotModified, List[Chapter]]:
         if not feed_url:
             raise RequiredInformationMissing('Feed url is missing when it is required')
 
-        feed = feedparser.parse(feed_url)
+        try:
+            feed = self.fetch_feed(feed_url)
+        except FeedHttpError:
+            logger.exception(f'Failed to fetch feed {feed_url}')
+            return
+
+        return self.chapters_from_feed(feed_url, feed)
+
+    async def fetch_series_async(self, fetcher: AsyncFetcher, title_id: str, service_id: int, manga_id: int,
+                                 feed_url: Optional[str] = None) -> Union[None, NotModified, List[Chapter]]:
+        if not feed_url:
+            raise RequiredInformationMissing('Feed url is missing when it is required')
+
+        try:
+            feed = await self.fetch_feed_async(fetcher, feed_url)
+        except FeedHttpError:
+            logger.exception(f'Failed to fetch feed {feed_url}')
+            return
+
+        return self.chapters_from_feed(feed_url, feed)
+
+    def chapters_from_feed(self, feed_url: str, feed: Union[FeedParserDict, NotModified]) -> Union[None, NotModified, List[Chapter]]:
+        if feed is NOT_MODIFIED:
+            return feed
+
         try:
             is_valid_feed(feed)
         except (FeedHttpError, InvalidFeedError):
             logger.exception(f'Failed to fetch feed {feed_url}')
             return
 
+        return self.parse_feed(feed.entries)
+
+    def save_series(self, chapters: List[Chapter], title_id: str, service_id: int, manga_id: int, feed_url: Optional[str] = None) -> Optional[bool]:
+        return self.save_chapters(chapters, service_id, manga_id, feed_url)
+
+    def save_chapters(self, chapters: List[Chapter], service_id: int, manga_id: int,
+                      feed_url: Optional[str] = None, schedule: bool = True) -> bool:
+        """
+        Args:
+            schedule: Whether the next update of the manga is scheduled.
+                      Service wide updates set the next update themselves
+
+        Returns:
+            True if new chapters were added
+        """
         self.dbutil.set_manga_last_checked(service_id, manga_id, datetime.utcnow())
-        self.dbutil.update_manga_next_update(service_id, manga_id, self.next_update())
 
-        chapters = self.dbutil.get_only_latest_entries(service_id, self.parse_feed(feed.entries))
+        chapters = self.dbutil.get_new_entries(service_id, chapters)
         if not chapters:
             logger.debug(f'Nothing to update in {feed_url}')
+            if schedule:
+                self.schedule_next_update(service_id, manga_id)
             return False
 
         logger.info(f'{len(chapters)} new chapters on {feed_url}')
@@ -169,7 +242,179 @@ class Reddit(BaseScraper):
             'release_date': c.release_date
         } for c in chapters]
         self.dbutil.update_latest_chapter(tuple(c for c in get_latest_chapters(chapter_rows).values()))
+        if schedule:
+            # Scheduled after the latest chapter is updated so the new estimated release is used
+            self.schedule_next_update(service_id, manga_id)
         return True
 
-    def scrape_service(self, service_id: int, feed_url: str, last_update: Optional[datetime], title_id: Optional[str] = None):
-        return None
+    @staticmethod
+    def group_feeds(manga: Iterable[dict]) -> Dict[str, Dict[str, List[dict]]]:
+        """
+        Groups the feeds of the manga into multireddit feeds. Feeds that
+        only differ by their subreddit are combined into one feed of all
+        of their subreddits e.g. r/a/.rss and r/b/.rss into r/a+b/.rss
+
+        Args:
+            manga: Rows with the manga_id, title_id and feed_url of the manga
+
+        Returns:
+            Dict of feed urls to the manga of the feed grouped by their lowercase subreddit
+        """
+        groups: Dict[Tuple[str, str], Dict[str, List[dict]]] = defaultdict(lambda: defaultdict(list))
+        feeds: Dict[str, Dict[str, List[dict]]] = {}
+        for row in manga:
+            m = Reddit.FEED_URL_REGEX.match(row['feed_url'])
+            if not m:
+                # Feeds that can't be combined are fetched as is
+                feeds.setdefault(row['feed_url'], defaultdict(list))[''].append(row)
+                continue
+
+            query = sorted((k, v) for k, v in parse_qsl(m.group('query') or '') if k != 'limit')
+            path = m.group('path') or '/.rss'
+            groups[(path, urlencode(query))][m.group('subreddit').lower()].append(row)
+
+        for (path, query), subreddits in groups.items():
+            names = sorted(subreddits.keys())
+            query = '&'.join(filter(None, (query, f'limit={Reddit.COMBINED_FEED_LIMIT}')))
+            for i in range(0, len(names), Reddit.MAX_SUBREDDITS_PER_FEED):
+                chunk = names[i:i+Reddit.MAX_SUBREDDITS_PER_FEED]
+                url = f'{Reddit.URL}/r/{"+".join(chunk)}{path}?{query}'
+                feeds[url] = {name: subreddits[name] for name in chunk}
+
+        return feeds
+
+    @staticmethod
+    def split_feed(url: str, subreddits: Dict[str, List[dict]]) -> List[Tuple[str, Dict[str, List[dict]]]]:
+        """
+        Splits a combined feed into two feeds with half of the subreddits each
+        """
+        names = sorted(subreddits.keys())
+        combined = f'/r/{"+".join(names)}/'
+        half = len(names) // 2
+        return [
+            (url.replace(combined, f'/r/{"+".join(chunk)}/', 1), {name: subreddits[name] for name in chunk})
+            for chunk in (names[:half], names[half:])
+        ]
+
+    @staticmethod
+    def is_truncated(feed: FeedParserDict, subreddits: Dict[str, List[dict]]) -> bool:
+        """
+        A combined feed is truncated when it returned the maximum amount of
+        entries and even the oldest one was posted after some manga of the
+        feed was last checked, as posts between the two were left out.
+        """
+        if len(feed.entries) < Reddit.COMBINED_FEED_LIMIT:
+            return False
+
+        last_checks = [row.get('last_check') for rows in subreddits.values() for row in rows]
+        if None in last_checks:
+            return True
+
+        dates = [post.get('published_parsed') or post.get('updated_parsed') for post in feed.entries]
+        dates = [d for d in dates if d]
+        if not dates:
+            return True
+
+        oldest = datetime.fromtimestamp(timegm(min(dates)), timezone.utc)
+        return oldest > min(last_checks)
+
+    def scrape_service(self, service_id: int, feed_url: str, last_update: Optional[datetime], title_id: Optional[str] = None) -> Optional[Set[int]]:
+        """
+        Updates all manga of the service with combined multireddit feeds
+        instead of fetching the feed of each manga separately. Only used when
+        REDDIT_COMBINED_FEEDS is set. Manga whose feed was fetched
+        successfully are not updated separately while the service wide
+        updates keep running.
+
+        Combined feeds that were truncated are split in half and fetched
+        again. Manga of a single subreddit feed that is still truncated
+        are left to be updated separately.
+
+        Returns:
+            Ids of the manga that got new chapters
+
+        Raises:
+            ServiceUpdateFailed: If none of the feeds could be fetched
+        """
+        manga_ids = set()
+        if not REDDIT_COMBINED_FEEDS:
+            logger.warning('Reddit service wide update skipped as REDDIT_COMBINED_FEEDS is not set')
+            return manga_ids
+
+        feeds = list(self.group_feeds(self.dbutil.get_feed_manga(service_id)).items())
+
+        # All feeds are fetched before anything is written so no transaction
+        # is kept open during the requests
+        fetched = []
+        failed = 0
+        total = 0
+        while feeds:
+            url, subreddits = feeds.pop()
+            total += 1
+            try:
+                feed = self.fetch_feed(url)
+            except FeedHttpError:
+                logger.exception(f'Failed to fetch feed {url}')
+                failed += 1
+                continue
+
+            chapters = self.chapters_from_feed(url, feed)
+            if chapters is None:
+                failed += 1
+                continue
+
+            combined = '' not in subreddits
+            truncated = combined and chapters is not NOT_MODIFIED and self.is_truncated(feed, subreddits)
+            if truncated and len(subreddits) > 1:
+                logger.info(f'Feed {url} was truncated. Splitting it')
+                feeds.extend(self.split_feed(url, subreddits))
+                continue
+
+            fetched.append((url, subreddits, chapters, truncated))
+
+        # Manga of the feeds that failed are still updated separately so a
+        # few failed feeds are not a failure of the whole service
+        if total and failed == total:
+            raise ServiceUpdateFailed(f'Failed to fetch all {failed} feeds of service {service_id}')
+
+        next_update = datetime.utcnow() + self.min_update_interval() * 2
+        for url, subreddits, chapters, truncated in fetched:
+            if chapters is not NOT_MODIFIED:
+                # Split the entries back to the subreddits they were posted in.
+                # Feeds that were not combined have every entry under ''
+                by_subreddit = defaultdict(list)
+                for chapter in chapters:
+                    by_subreddit['' if '' in subreddits else chapter.title_id.lower()].append(chapter)
+
+                for subreddit, rows in subreddits.items():
+                    for row in rows:
+                        # Some posts of truncated feeds were missed so those manga are
+                        # scheduled normally to be updated separately
+                        if by_subreddit[subreddit] and self.save_chapters(by_subreddit[subreddit], service_id, row['manga_id'], url, schedule=truncated):
+                            manga_ids.add(row['manga_id'])
+
+            if truncated:
+                continue
+
+            # The manga are updated by the next service wide update
+            checked = [row['manga_id'] for rows in subreddits.values() for row in rows]
+            self.dbutil.update_manga_next_updates(service_id, checked, next_update)
+
+        return manga_ids
+
+    def add_service(self):
+        if REDDIT_COMBINED_FEEDS:
+            return self.add_service_whole()
+
+        return BaseScraper.add_service(self)
+
+    def enable_combined_feeds(self) -> None:
+        """
+        Adds the service wide update to an already existing Reddit service
+        """
+        sql = 'INSERT INTO service_whole (service_id, feed_url, last_check, next_update, last_id) ' \
+              'SELECT service_id, %s, NULL, NULL, NULL FROM services WHERE service_id=%s ' \
+              'ON CONFLICT DO NOTHING'
+        with self.conn:
+            with self.conn.cursor() as cur:
+                cur.execute(sql, (self.FEED_URL, self.ID))
@@ -2,6 +2,7 @@ import pickle
 import unittest
 import os
 from typing import Iterable, Union
+from unittest.mock import patch
 
 import responses
 
@@ -10,6 +11,7 @@ from src.scrapers import KodanshaComics, ComiXology, SCRAPERS
 from src.scrapers.kodansha import Manga
 from src.tests.testing_utils import BaseTestClasses, spy_on
 from src.tests.scrapers.testing_scraper import DummyScraper
+from src.utils.http import HttpClient, Validators, NOT_MODIFIED
 
 test_site = os.path.join(os.path.dirname(__file__), 'test_data.html')
 logger = setup_logging.setup()
@@ -65,7 +67,7 @@ class TestKodanshaScraper(BaseTestClasses.ModelAssertions, BaseTestClasses.Datab
         # Mock scrapers
         dummy = spy_on(DummyScraperForKodansha(self.conn, self.dbutil))
 
-        def create_dummy(conn, dbutil):
+        def create_dummy(conn, dbutil, http=None):
             dummy._conn = conn
             dummy._dbutil = dbutil
             return dummy
@@ -92,7 +94,7 @@ class TestKodanshaScraper(BaseTestClasses.ModelAssertions, BaseTestClasses.Datab
         # Mock scrapers
         dummy = spy_on(DummyScraperForKodansha(self.conn, self.dbutil))
 
-        def create_dummy(conn, dbutil):
+        def create_dummy(conn, dbutil, http=None):
             dummy._conn = conn
             dummy._dbutil = dbutil
             return dummy
@@ -108,5 +110,45 @@ class TestKodanshaScraper(BaseTestClasses.ModelAssertions, BaseTestClasses.Datab
         self.assertEqual(dummy.update_selected_manga.call_count, 8, msg='More than 8 manga were updated')
 
 
+    @responses.activate
+    def test_forced_update_ignores_validators(self):
+        test_url = 'https://www.kodanshatest.com'
+        body = self.read_test_site()
+
+        def callback(request):
+            if 'If-None-Match' in request.headers:
+                return 304, {}, ''
+            return 200, {'ETag': '"simulpubs"'}, body
+
+        responses.add_callback(responses.GET, test_url, callback=callback)
+
+        dummy = spy_on(DummyScraperForKodansha(self.conn, self.dbutil))
+
+        def create_dummy(conn, dbutil, http=None):
+            dummy._conn = conn
+            dummy._dbutil = dbutil
+            return dummy
+
+        SCRAPERS[ComiXology.URL] = create_dummy
+        dummy.update_selected_manga.return_value = 2
+
+        http = HttpClient(rate_limiter=None)
+        http.validators.update({test_url: Validators(etag='"simulpubs"')})
+        kodansha = KodanshaComics(self.conn, self.dbutil, http=http)
+
+        # The service wide update is skipped when the page has not changed
+        self.assertIs(kodansha.scrape_service(KodanshaComics.ID, test_url, None), NOT_MODIFIED)
+
+        updated = kodansha.scrape_series('attack-on-titan', KodanshaComics.ID, None, feed_url=test_url)
+        self.assertTrue(updated)
+        self.assertNotIn('If-None-Match', responses.calls[-1].request.headers)
+        self.assertEqual(dummy.update_selected_manga.call_count, 1)
+
+    def test_not_modified_is_not_an_update(self):
+        kodansha = KodanshaComics(self.conn, self.dbutil)
+        with patch.object(kodansha, '_scrape_service', return_value=NOT_MODIFIED):
+            self.assertIs(kodansha.scrape_series('attack-on-titan', KodanshaComics.ID, None, feed_url='https://www.kodanshatest.com'), False)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,17 +2,21 @@ import os
 import pickle
 import unittest
 from unittest.mock import patch
-from unittest.mock import MagicMock
 
 import feedparser
+import responses
+
+from src.errors import ServiceUpdateFailed
 
 from src.scrapers.mangadex import MangaDex, Chapter
 import setup_logging
 
-from src.tests.testing_utils import get_conn, mock_feedparse, spy_on
+from src.tests.testing_utils import get_conn, spy_on
 from src.utils.dbutils import DbUtil
+from src.utils.http import HttpClient, NOT_MODIFIED
 
 test_feed = os.path.join(os.path.dirname(__file__), 'feed.xml')
+test_feed_url = 'https://mangadex.org/rss/test_feed'
 logger = setup_logging.setup()
 
 
@@ -21,7 +25,7 @@ class MangadexTests(unittest.TestCase):
     def setUp(self) -> None:
         self._conn = get_conn()
         self.dbutil = spy_on(DbUtil(self._conn))
-        self.mangadex = MangaDex(self._conn, self.dbutil)
+        self.mangadex = MangaDex(self._conn, self.dbutil, http=HttpClient(rate_limiter=None))
 
     def tearDown(self) -> None:
         self._conn.close()
@@ -63,29 +67,52 @@ class MangadexTests(unittest.TestCase):
         for a, b in zip(chapters, old_chapters):
             self.chapters_equal(a, b)
 
-    @patch('feedparser.parse', wraps=mock_feedparse(test_feed))
+    @staticmethod
+    def add_feed_response(**kwargs):
+        with open(test_feed, 'rb') as f:
+            responses.add(responses.GET, test_feed_url, body=f.read(),
+                          content_type='application/rss+xml; charset=utf-8', **kwargs)
+
+    @responses.activate
     @patch.object(MangaDex, 'update_chapter_infos', lambda *_, **__: None)
-    def test_parse_feed(self, parse: MagicMock):
+    def test_parse_feed(self):
+        self.add_feed_response()
         with self._conn:
-            updated = self.mangadex.scrape_service(MangaDex.ID, 'test_feed', None)
-        parse.assert_called_once()
-        parse.assert_called_with('test_feed')
+            updated = self.mangadex.scrape_service(MangaDex.ID, test_feed_url, None)
+        self.assertEqual(len(responses.calls), 1)
         self.assertIsNotNone(updated)
         self.assertGreater(len(updated), 0)
 
         with self._conn:
             # Parse feed again to make sure it works with duplicate inputs
-            updated = self.mangadex.scrape_service(MangaDex.ID, 'test_feed', None)
-        self.assertEqual(parse.call_count, 2)
+            updated = self.mangadex.scrape_service(MangaDex.ID, test_feed_url, None)
+        self.assertEqual(len(responses.calls), 2)
         self.assertIsNone(updated)
 
-    @patch('feedparser.parse', wraps=mock_feedparse('invalid_feed'))
+    @responses.activate
     @patch.object(MangaDex, 'update_chapter_infos', lambda *_, **__: None)
-    def test_parse_invalid_feed(self, parse: MagicMock):
-        updated = self.mangadex.scrape_service(MangaDex.ID, 'invalid_feed', None)
-        parse.assert_called_once()
-        parse.assert_called_with('invalid_feed')
-        self.assertIsNone(updated)
+    def test_parse_invalid_feed(self):
+        responses.add(responses.GET, test_feed_url, body='invalid_feed')
+        self.assertRaises(ServiceUpdateFailed, self.mangadex.scrape_service, MangaDex.ID, test_feed_url, None)
+        self.assertEqual(len(responses.calls), 1)
+
+        self.mangadex.commit_validators()
+        self.assertIsNone(self.mangadex.http.validators.get(test_feed_url))
+
+    @responses.activate
+    @patch.object(DbUtil, 'get_new_entries', return_value=[])
+    def test_feed_not_modified(self, _):
+        self.add_feed_response(headers={'ETag': '"abc"'})
+        self.mangadex.scrape_service(MangaDex.ID, test_feed_url, None)
+
+        # Validators are not used before they are committed
+        self.assertIsNone(self.mangadex.http.validators.get(test_feed_url))
+        self.mangadex.commit_validators()
+
+        responses.replace(responses.GET, test_feed_url, status=304)
+        updated = self.mangadex.scrape_service(MangaDex.ID, test_feed_url, None)
+        self.assertIs(updated, NOT_MODIFIED)
+        self.assertEqual(responses.calls[1].request.headers['If-None-Match'], '"abc"')
 
 
 if __name__ == '__main__':
@@ -2,6 +2,8 @@ import json
 import os
 import unittest
 from base64 import b64decode
+from unittest.mock import patch
+from datetime import datetime, timedelta, timezone
 
 import responses
 
@@ -53,6 +55,36 @@ class TestMangaPlusParser(BaseTestClasses.DatabaseTestCase):
         self.assertTrue(self.mangaplus.scrape_series(title_id, MangaPlus.ID, manga_id))
         self.assertEqual(len(responses.calls), 1)
 
+        with self.conn.cursor() as cur:
+            cur.execute('SELECT next_update FROM manga_service WHERE manga_id=%s AND service_id=%s', (manga_id, MangaPlus.ID))
+            next_update = cur.fetchone()[0]
+
+        self.assertIsNotNone(next_update)
+        self.assertDateGreater(next_update, datetime.utcnow())
+
+    @responses.activate
+    @patch.object(MangaPlus, 'min_update_interval', return_value=timedelta(minutes=15))
+    def test_not_modified_uses_next_release(self, _):
+        title_id = '100072'
+        manga_id = 4
+        responses.add(responses.GET, MangaPlus.API.format(title_id),
+                      body=self.request_data_jojo)
+        series = self.mangaplus.parse_series(title_id, conditional=False)
+        self.assertIsNotNone(series.next_timestamp)
+        self.assertTrue(self.mangaplus.save_series(series, title_id, MangaPlus.ID, manga_id))
+
+        next_release = self.dbutil.get_next_release(MangaPlus.ID, manga_id)
+        self.assertEqual(next_release, series.next_timestamp.replace(tzinfo=timezone.utc))
+
+        self.mangaplus.skip_update(MangaPlus.ID, manga_id)
+        with self.conn.cursor() as cur:
+            cur.execute('SELECT next_update FROM manga_service WHERE manga_id=%s AND service_id=%s', (manga_id, MangaPlus.ID))
+            next_update = cur.fetchone()[0]
+        self.conn.commit()
+
+        expected = self.mangaplus.next_release_update(series.next_timestamp)
+        self.assertLess(abs(next_update.astimezone(timezone.utc).replace(tzinfo=None) - expected), timedelta(seconds=10))
+
 
 if __name__ == '__main__':
     unittest.main()
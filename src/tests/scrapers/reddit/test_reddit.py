@@ -1,15 +1,20 @@
 import pickle
 import unittest
 import os
-from unittest.mock import patch, MagicMock
+from datetime import datetime, timezone
+from unittest.mock import patch
 
 import feedparser
+import responses
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 
 import setup_logging
 from src.scrapers import Reddit
-from src.tests.testing_utils import BaseTestClasses, mock_feedparse
+from src.tests.testing_utils import BaseTestClasses
+from src.utils.http import HttpClient
 
 test_feed = os.path.join(os.path.dirname(__file__), 'test_data.xml')
+test_feed_url = 'https://www.reddit.com/r/test/.rss'
 logger = setup_logging.setup()
 
 
@@ -35,26 +40,155 @@ class TestRedditScraper(BaseTestClasses.ModelAssertions, BaseTestClasses.Databas
         for a, b in zip(chapters, correct_chapters):
             self.assertChaptersEqual(a, b)
 
-    @patch('feedparser.parse', wraps=mock_feedparse(test_feed))
-    def test_parse_feed(self, parse: MagicMock):
-        reddit = Reddit(self._conn, self.dbutil)
-        feed_url = 'reddit_test_feed'
+    @staticmethod
+    def add_feed_response(**kwargs):
+        with open(test_feed, 'rb') as f:
+            responses.add(responses.GET, test_feed_url, body=f.read(),
+                          content_type='application/rss+xml; charset=utf-8', **kwargs)
+
+    @responses.activate
+    def test_parse_feed(self):
+        self.add_feed_response()
+        reddit = Reddit(self._conn, self.dbutil, http=HttpClient(rate_limiter=None))
+        feed_url = test_feed_url
         manga_id = self.dbutil.add_single_series(Reddit.ID, 'RedditTest', 'Reddit test manga', feed_url)
         with self._conn:
             did_update = reddit.scrape_series('RedditTest', Reddit.ID, manga_id, feed_url)
 
-        parse.assert_called_once()
-        parse.assert_called_with(feed_url)
+        self.assertEqual(len(responses.calls), 1)
         self.assertIsNotNone(did_update)
         self.assertTrue(did_update)
 
         with self._conn:
             # Parse feed again to make sure it works with duplicate inputs
             did_update = reddit.scrape_series('TestTitleId', Reddit.ID, manga_id, feed_url)
-        self.assertEqual(parse.call_count, 2)
+        self.assertEqual(len(responses.calls), 2)
         self.assertIsNotNone(did_update)
         self.assertFalse(did_update)
 
+    @responses.activate
+    def test_not_modified_skips_parsing(self):
+        self.add_feed_response(headers={'Last-Modified': 'Sat, 05 Dec 2020 10:00:00 GMT'})
+        reddit = Reddit(self._conn, self.dbutil, http=HttpClient(rate_limiter=None))
+        chapters = reddit.fetch_series('RedditTest', Reddit.ID, 1, test_feed_url)
+        self.assertGreater(len(chapters), 0)
+        reddit.commit_validators()
+
+        responses.replace(responses.GET, test_feed_url, status=304)
+        with patch.object(reddit, 'parse_feed') as parse_feed, \
+                patch.object(reddit, 'save_series') as save_series, \
+                patch.object(reddit, 'skip_update') as skip_update:
+            did_update = reddit.scrape_series('RedditTest', Reddit.ID, 1, test_feed_url)
+
+        self.assertFalse(did_update)
+        self.assertEqual(responses.calls[1].request.headers['If-Modified-Since'], 'Sat, 05 Dec 2020 10:00:00 GMT')
+        parse_feed.assert_not_called()
+        save_series.assert_not_called()
+        skip_update.assert_called_once_with(Reddit.ID, 1)
+
+    def test_group_feeds(self):
+        search = 'https://www.reddit.com/r/{}/search.rss?sort=new&restrict_sr=on&q=flair%3AMURATA%2BCHAPTER'
+        manga = [
+            {'manga_id': 1, 'title_id': 'a', 'feed_url': 'https://www.reddit.com/r/A/.rss'},
+            {'manga_id': 2, 'title_id': 'b', 'feed_url': 'https://reddit.com/r/b/.rss?limit=10'},
+            {'manga_id': 3, 'title_id': 'c', 'feed_url': search.format('c')},
+            {'manga_id': 4, 'title_id': 'd', 'feed_url': search.format('d')},
+            {'manga_id': 5, 'title_id': 'e', 'feed_url': 'https://example.com/feed.rss'},
+        ]
+
+        feeds = Reddit.group_feeds(manga)
+        self.assertDictEqual({url: {k: [r['manga_id'] for r in v] for k, v in subs.items()} for url, subs in feeds.items()}, {
+            'https://www.reddit.com/r/a+b/.rss?limit=100': {'a': [1], 'b': [2]},
+            'https://www.reddit.com/r/c+d/search.rss?q=flair%3AMURATA%2BCHAPTER&restrict_sr=on&sort=new&limit=100': {'c': [3], 'd': [4]},
+            'https://example.com/feed.rss': {'': [5]},
+        })
+
+        with patch.object(Reddit, 'MAX_SUBREDDITS_PER_FEED', 1):
+            self.assertEqual(len(Reddit.group_feeds(manga)), 5)
+
+    @responses.activate
+    def test_scrape_service_combines_feeds(self):
+        combined_url = 'https://www.reddit.com/r/onepunchman+redditcombinedtest/.rss?limit=100'
+        with open(test_feed, 'rb') as f:
+            responses.add(responses.GET, combined_url, body=f.read(),
+                          content_type='application/rss+xml; charset=utf-8')
+
+        reddit = Reddit(self._conn, self.dbutil, http=HttpClient(rate_limiter=None))
+        opm = self.dbutil.add_single_series(Reddit.ID, 'OnePunchMan', 'One punch man', 'https://www.reddit.com/r/OnePunchMan/.rss')
+        other = self.dbutil.add_single_series(Reddit.ID, 'RedditCombinedTest', 'Reddit combined test', 'https://www.reddit.com/r/RedditCombinedTest/.rss')
+
+        statuses = []
+        real_fetch_feed = reddit.fetch_feed
+
+        def fetch_feed(url):
+            statuses.append(reddit.conn.info.transaction_status)
+            return real_fetch_feed(url)
+
+        last_check = datetime(2020, 10, 4, tzinfo=timezone.utc)
+        with patch.object(reddit.dbutil, 'get_feed_manga', return_value=[
+            {'manga_id': opm, 'title_id': 'OnePunchMan', 'feed_url': 'https://www.reddit.com/r/OnePunchMan/.rss', 'last_check': last_check},
+            {'manga_id': other, 'title_id': 'RedditCombinedTest', 'feed_url': 'https://www.reddit.com/r/RedditCombinedTest/.rss', 'last_check': last_check},
+        ]), patch.object(reddit, 'save_chapters', return_value=True) as save_chapters, \
+                patch.object(reddit, 'fetch_feed', side_effect=fetch_feed), \
+                patch('src.scrapers.reddit.REDDIT_COMBINED_FEEDS', True):
+            manga_ids = reddit.scrape_service(Reddit.ID, Reddit.FEED_URL, None)
+
+        # No transaction is open while fetching
+        self.assertListEqual(statuses, [TRANSACTION_STATUS_IDLE])
+        self.assertEqual(len(responses.calls), 1)
+        self.assertSetEqual(manga_ids, {opm})
+        save_chapters.assert_called_once()
+        chapters, service_id, manga_id = save_chapters.call_args.args[:3]
+        self.assertEqual(manga_id, opm)
+        self.assertIs(save_chapters.call_args.kwargs['schedule'], False)
+        self.assertGreater(len(chapters), 0)
+
+        with self._conn.cursor() as cur:
+            cur.execute('SELECT COUNT(*) FROM manga_service WHERE service_id=%s AND manga_id IN %s AND next_update > NOW()',
+                        (Reddit.ID, (opm, other)))
+            self.assertEqual(cur.fetchone()[0], 2)
+
+
+    @responses.activate
+    def test_scrape_service_splits_truncated_feeds(self):
+        # The test feed has 25 entries of which the oldest is from 2019-11-01
+        with open(test_feed, 'rb') as f:
+            body = f.read()
+        empty = b'<?xml version="1.0" encoding="UTF-8"?><feed xmlns="http://www.w3.org/2005/Atom"><title>empty</title></feed>'
+        for url, feed in (('onepunchman+redditcombinedtest', body), ('onepunchman', body), ('redditcombinedtest', empty)):
+            responses.add(responses.GET, f'https://www.reddit.com/r/{url}/.rss?limit=25', body=feed,
+                          content_type='application/rss+xml; charset=utf-8')
+
+        reddit = Reddit(self._conn, self.dbutil, http=HttpClient(rate_limiter=None))
+        opm = self.dbutil.add_single_series(Reddit.ID, 'OnePunchMan', 'One punch man', 'https://www.reddit.com/r/OnePunchMan/.rss')
+        other = self.dbutil.add_single_series(Reddit.ID, 'RedditCombinedTest', 'Reddit combined test', 'https://www.reddit.com/r/RedditCombinedTest/.rss')
+
+        last_check = datetime(2019, 6, 1, tzinfo=timezone.utc)
+        with patch.object(reddit.dbutil, 'get_feed_manga', return_value=[
+            {'manga_id': opm, 'title_id': 'OnePunchMan', 'feed_url': 'https://www.reddit.com/r/OnePunchMan/.rss', 'last_check': last_check},
+            {'manga_id': other, 'title_id': 'RedditCombinedTest', 'feed_url': 'https://www.reddit.com/r/RedditCombinedTest/.rss', 'last_check': last_check},
+        ]), patch.object(reddit, 'save_chapters', return_value=True) as save_chapters, \
+                patch.object(Reddit, 'COMBINED_FEED_LIMIT', 25), \
+                patch('src.scrapers.reddit.REDDIT_COMBINED_FEEDS', True):
+            manga_ids = reddit.scrape_service(Reddit.ID, Reddit.FEED_URL, None)
+
+        self.assertEqual(len(responses.calls), 3)
+        self.assertSetEqual(manga_ids, {opm})
+        save_chapters.assert_called_once()
+
+        # The single subreddit feed is still truncated so the manga is updated separately
+        with self._conn.cursor() as cur:
+            cur.execute('SELECT manga_id FROM manga_service WHERE service_id=%s AND manga_id IN %s AND next_update > NOW()',
+                        (Reddit.ID, (opm, other)))
+            self.assertEqual([r[0] for r in cur], [other])
+
+    def test_scrape_service_disabled(self):
+        reddit = Reddit(self._conn, self.dbutil, http=HttpClient(rate_limiter=None))
+        with patch.object(reddit.dbutil, 'get_feed_manga') as get_feed_manga:
+            self.assertSetEqual(reddit.scrape_service(Reddit.ID, Reddit.FEED_URL, None), set())
+
+        get_feed_manga.assert_not_called()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -3,6 +3,7 @@ from typing import Optional
 
 from src.scrapers.base_scraper import BaseScraper
 from src.utils.dbutils import DbUtil
+from src.utils.http import HttpClient
 
 
 class DummyScraper(BaseScraper):
@@ -25,5 +26,5 @@ class DummyScraper(BaseScraper):
                        title_id: Optional[str] = None):
         pass
 
-    def __init__(self, conn, dbutil: DbUtil):
-        super().__init__(conn, dbutil)
+    def __init__(self, conn, dbutil: DbUtil, http: Optional[HttpClient] = None):
+        super().__init__(conn, dbutil, http=http)
@@ -1,11 +1,28 @@
+import json
+import os
+import tempfile
+import threading
+import time
 import unittest
+from datetime import datetime, timedelta, timezone
 from unittest import mock
 
+import psycopg2
+import responses
+from psycopg2.extensions import Notify
+
 from src.db.models.scheduled_run import ScheduledRun
-from src.scheduler import UpdateScheduler
+from src.scheduler import UpdateScheduler, MangaServiceInfo
 from src.tests.scrapers.testing_scraper import DummyScraper
 from src.tests.testing_utils import BaseTestClasses, spy_on, set_db_environ
 from src.scrapers import SCRAPERS, MangaPlus, MangaDex
+from src.utils.dbutils import DbUtil
+from src.utils.deadline import deadline
+from src.utils.circuit_breaker import FAILURE_THRESHOLD, BreakerState
+from src.utils.http import HttpClient, NOT_MODIFIED
+from src.utils.known_chapters import KnownChapters
+from src.utils.throughput import ServiceThroughput
+from src.utils.work_queue import WorkQueue
 
 
 class SchedulerRunTest(BaseTestClasses.DatabaseTestCase):
@@ -17,27 +34,422 @@ class SchedulerRunTest(BaseTestClasses.DatabaseTestCase):
         self.scraper1 = spy_on(DummyScraper(self._conn, self.dbutil))
         self.scraper2 = spy_on(DummyScraper(self._conn, self.dbutil))
         self.scheduler = UpdateScheduler()
+        self.addCleanup(self.scheduler.fetcher.close)
+
+        # Known chapters are not shared between tests or saved to disk
+        self.scheduler.known_chapters = KnownChapters(path=None)
+        patcher = mock.patch('src.utils.dbutils.known_chapters', self.scheduler.known_chapters)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # The spies wrap the real async method which would call the real fetch_series
+        for scraper in (self.scraper1, self.scraper2):
+            scraper.fetch_series_async.side_effect = self.fetch_series_async(scraper)
 
         SCRAPERS.clear()
         SCRAPERS[MangaPlus.URL] = lambda *_, **__: self.scraper1
         SCRAPERS[MangaDex.URL] = lambda *_, **__: self.scraper2
 
+    @staticmethod
+    def fetch_series_async(scraper):
+        async def fetch_series_async(fetcher, *args):
+            return await fetcher.run(scraper.fetch_series, *args)
+        return fetch_series_async
+
+    def run_async(self, coro):
+        return self.scheduler.fetcher.submit(coro).result()
+
+    def run_scheduled_runs_only(self):
+        """
+        Runs run_once with only the scheduled runs claimed
+        """
+        with mock.patch.object(self.scheduler, 'queue_due_manga', return_value=({}, [])), \
+                mock.patch.object(self.scheduler, 'claim_due_services', return_value=[]):
+            self.scheduler.run_once()
+
     def test_scheduled_runs_without_data(self):
-        with self._conn.cursor() as cur:
-            self.assertFalse(any(False for _ in self.dbutil.get_scheduled_runs(cur)))
+        with self.scheduler.conn() as conn:
+            queue = WorkQueue()
+            scrapers, runs = self.scheduler.queue_scheduled_runs(conn, queue)
+            conn.rollback()
+
+        self.assertDictEqual(scrapers, {})
+        self.assertListEqual(runs, [])
+        self.assertFalse(queue)
 
-        self.scheduler.do_scheduled_runs()
+        self.run_scheduled_runs_only()
+        self.scraper1.fetch_series.assert_not_called()
+        self.scraper2.fetch_series.assert_not_called()
 
     def test_scheduled_runs_with_data(self):
         manga_id = 1
         self.dbutil.add_scheduled_runs([ScheduledRun(manga_id, MangaPlus.ID), ScheduledRun(manga_id, MangaDex.ID)])
-        self.scheduler.do_scheduled_runs()
-        self.scraper1.scrape_series.assert_called_with(mock.ANY, MangaPlus.ID, manga_id, feed_url=None)
-        self.scraper2.scrape_series.assert_called_with(mock.ANY, MangaDex.ID, manga_id, feed_url=mock.ANY)
+
+        with self.scheduler.conn() as conn:
+            queue = WorkQueue()
+            scrapers, runs = self.scheduler.queue_scheduled_runs(conn, queue)
+            conn.rollback()
+
+        self.assertSetEqual(set(scrapers), {MangaPlus.ID, MangaDex.ID})
+        self.assertSetEqual(set(runs), {(manga_id, MangaPlus.ID), (manga_id, MangaDex.ID)})
+
+        self.run_scheduled_runs_only()
+        self.scraper1.fetch_series.assert_called_once_with(mock.ANY, MangaPlus.ID, manga_id, None)
+        self.scraper2.fetch_series.assert_called_once_with(mock.ANY, MangaDex.ID, manga_id, mock.ANY)
+        self.scraper1.save_series.assert_called_once_with(True, mock.ANY, MangaPlus.ID, manga_id, None)
+        self.scraper2.save_series.assert_called_once_with(True, mock.ANY, MangaDex.ID, manga_id, mock.ANY)
+        self.assertEqual(len(self.scheduler.pool._used), 0)
+
+        with self._conn.cursor() as cur:
+            cur.execute('SELECT COUNT(*) FROM manga_service WHERE manga_id=%s AND lease_expires IS NOT NULL', (manga_id,))
+            self.assertEqual(cur.fetchone()[0], 0, 'Leases were not released')
 
         with self._conn.cursor() as cur:
             self.assertFalse(any(False for _ in self.dbutil.get_scheduled_runs(cur)))
 
+    def test_scrape_manga_no_connection_while_fetching(self):
+        used_while_fetching = []
+
+        def fetch_series(*_, **__):
+            used_while_fetching.append(len(self.scheduler.pool._used))
+            return True
+
+        self.scraper1.fetch_series.side_effect = fetch_series
+        info = MangaServiceInfo(title_id='test_title', manga_id=1, service_id=MangaPlus.ID, feed_url=None)
+
+        self.run_async(self.scheduler.scrape_manga(self.scraper1, info))
+
+        self.assertListEqual(used_while_fetching, [0])
+        self.scraper1.save_series.assert_called_once_with(True, 'test_title', MangaPlus.ID, 1, None)
+        self.assertEqual(len(self.scheduler.pool._used), 0)
+
+    def test_scrape_manga_not_modified(self):
+        self.scraper1.fetch_series.return_value = NOT_MODIFIED
+        info = MangaServiceInfo(title_id='test_title', manga_id=1, service_id=MangaPlus.ID, feed_url=None)
+
+        self.assertIs(self.run_async(self.scheduler.scrape_manga(self.scraper1, info)), False)
+
+        self.scraper1.save_series.assert_not_called()
+        self.scraper1.skip_update.assert_called_once_with(MangaPlus.ID, 1)
+        self.assertEqual(len(self.scheduler.pool._used), 0)
+
+        self.scraper1.fetch_series.return_value = True
+        self.scraper1.save_series.return_value = False
+        self.run_async(self.scheduler.scrape_manga(self.scraper1, info))
+
+        self.assertDictEqual(self.scheduler.report_unchanged(), {MangaPlus.ID: (1, 2)})
+        self.assertDictEqual(self.scheduler.report_unchanged(), {})
+
+    def test_load_known_chapters(self):
+        with self.scheduler.conn() as conn:
+            self.scheduler.load_known_chapters(conn)
+            with conn.cursor() as cur:
+                cur.execute('SELECT service_id, chapter_identifier, chapter_id FROM chapters ORDER BY chapter_id DESC LIMIT 1')
+                service_id, chapter_identifier, chapter_id = cur.fetchone()
+
+        known = self.scheduler.known_chapters
+        self.assertTrue(known.contains(service_id, chapter_identifier))
+        self.assertEqual(known.max_chapter_id, chapter_id)
+
+    def test_load_known_chapters_from_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'known_chapters.bin')
+            self.scheduler.known_chapters = KnownChapters(path)
+            with self.scheduler.conn() as conn:
+                self.scheduler.load_known_chapters(conn)
+            self.scheduler.save_known_chapters()
+
+            # Chapters deleted while the scheduler was not running are not known after loading
+            with self.scheduler.conn() as conn:
+                with conn:
+                    with conn.cursor() as cur:
+                        manga_id = DbUtil(conn).add_single_series(cur, DummyScraper.ID, 'known_chapters_file', 'known chapters file')
+                        cur.execute('INSERT INTO chapters (manga_id, service_id, title, chapter_number, chapter_identifier, release_date) '
+                                    'VALUES (%s, %s, %s, 1, %s, NOW()) RETURNING chapter_id',
+                                    (manga_id, DummyScraper.ID, 'Deleted', 'known_chapters_deleted'))
+
+                self.scheduler.known_chapters = KnownChapters(path)
+                self.scheduler.load_known_chapters(conn)
+                self.scheduler.save_known_chapters()
+                self.assertTrue(self.scheduler.known_chapters.contains(DummyScraper.ID, 'known_chapters_deleted'))
+
+                with conn:
+                    with conn.cursor() as cur:
+                        cur.execute('DELETE FROM chapters WHERE chapter_identifier=%s', ('known_chapters_deleted',))
+
+                known = self.scheduler.known_chapters = KnownChapters(path)
+                self.scheduler.load_known_chapters(conn)
+
+        self.assertFalse(known.contains(DummyScraper.ID, 'known_chapters_deleted'))
+        self.assertGreater(len(known), 0)
+
+    def test_deleted_chapter_notify(self):
+        known = KnownChapters(path=None)
+        known.load([(1, DummyScraper.ID, 'deleted_chapter')])
+        self.scheduler.known_chapters = known
+
+        payload = json.dumps({'table': 'chapters', 'service_id': DummyScraper.ID, 'chapter_identifier': 'deleted_chapter'})
+        with mock.patch.object(self.scheduler, 'wake_up') as wake_up:
+            self.scheduler.on_notify(Notify(0, 'scheduler', payload))
+
+        wake_up.assert_not_called()
+        self.assertFalse(known.contains(DummyScraper.ID, 'deleted_chapter'))
+
+    def test_validators_committed_only_on_success(self):
+        info = MangaServiceInfo(title_id='test_title', manga_id=1, service_id=MangaPlus.ID, feed_url=None)
+
+        self.scraper1.save_series.side_effect = ValueError
+        self.run_async(self.scheduler.scrape_manga(self.scraper1, info))
+        self.scraper1.commit_validators.assert_not_called()
+
+        self.scraper1.save_series.side_effect = None
+        self.scraper1.save_series.return_value = True
+        self.run_async(self.scheduler.scrape_manga(self.scraper1, info))
+        self.scraper1.commit_validators.assert_called_once()
+
+    def test_process_queue_skips_failing_service(self):
+        self.scraper1.fetch_series.side_effect = ValueError
+        queue = WorkQueue()
+        for manga_id in range(1, FAILURE_THRESHOLD + 2):
+            queue.put(MangaServiceInfo(title_id=str(manga_id), manga_id=manga_id, service_id=MangaPlus.ID, feed_url=None))
+        queue.put(MangaServiceInfo(title_id='test', manga_id=1, service_id=MangaDex.ID, feed_url=None))
+
+        with mock.patch.object(self.scheduler, 'postpone_manga'):
+            self.run_async(self.scheduler.process_queue(
+                queue,
+                {MangaPlus.ID: SCRAPERS[MangaPlus.URL], MangaDex.ID: SCRAPERS[MangaDex.URL]}
+            ))
+
+        # Service is skipped after too many errors in a row
+        self.assertEqual(self.scraper1.fetch_series.call_count, FAILURE_THRESHOLD)
+        self.scraper2.fetch_series.assert_called_once()
+        self.assertEqual(len(queue), 0)
+
+    def test_process_queue_deadline(self):
+        info = MangaServiceInfo(title_id='1', manga_id=1, service_id=MangaPlus.ID, feed_url=None)
+        queue = WorkQueue()
+        queue.put(info)
+        queue.put(MangaServiceInfo(title_id='2', manga_id=2, service_id=MangaDex.ID, feed_url=None))
+
+        async def process_queue():
+            with deadline(0):
+                return await self.scheduler.process_queue(
+                    queue,
+                    {MangaPlus.ID: SCRAPERS[MangaPlus.URL], MangaDex.ID: SCRAPERS[MangaDex.URL]}
+                )
+
+        self.assertSetEqual(self.run_async(process_queue()), set())
+        self.scraper1.fetch_series.assert_not_called()
+        self.scraper2.fetch_series.assert_not_called()
+        self.assertSetEqual(self.scheduler.pop_skipped(), {(1, MangaPlus.ID), (2, MangaDex.ID)})
+        self.assertSetEqual(self.scheduler.pop_skipped(), set())
+
+    def test_deadline_failure_not_postponed(self):
+        info = MangaServiceInfo(title_id='test_title', manga_id=1, service_id=MangaPlus.ID, feed_url=None)
+
+        with mock.patch.object(self.scheduler, 'postpone_manga') as postpone, deadline(0):
+            self.assertIsNone(self.scheduler.save_manga(self.scraper1, info, None))
+
+        postpone.assert_not_called()
+        self.assertSetEqual(self.scheduler.pop_skipped(), {(1, MangaPlus.ID)})
+
+    def test_statement_timeout(self):
+        def get_timeout():
+            with self.scheduler.conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute('SHOW statement_timeout')
+                    return cur.fetchone()[0]
+
+        default = get_timeout()
+        with deadline(60):
+            self.assertEqual(get_timeout(), '1min')
+        self.assertEqual(get_timeout(), default)
+
+    def test_workers_respect_concurrency_limit(self):
+        running = []
+        max_running = []
+        lock = threading.Lock()
+
+        def fetch_series(*_, **__):
+            with lock:
+                running.append(1)
+                max_running.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+            return None
+
+        self.scraper1.fetch_series.side_effect = fetch_series
+        self.scheduler.throughput = {MangaPlus.ID: ServiceThroughput(MangaPlus.ID, concurrency=2)}
+        queue = WorkQueue()
+        for manga_id in range(1, 7):
+            queue.put(MangaServiceInfo(title_id=str(manga_id), manga_id=manga_id, service_id=MangaPlus.ID, feed_url=None))
+
+        with mock.patch.object(self.scheduler, 'postpone_manga'), \
+             mock.patch('src.utils.circuit_breaker.FAILURE_THRESHOLD', 10):
+            for r in self.scheduler.start_workers(queue, {MangaPlus.ID: SCRAPERS[MangaPlus.URL]}):
+                r.result()
+
+        self.assertEqual(len(max_running), 6)
+        self.assertLessEqual(max(max_running), 2)
+
+    def test_scrape_whole_service_errors_isolated(self):
+        self.scraper1.scrape_service.side_effect = ValueError
+        self.scraper2.scrape_service.return_value = {1, 2}
+
+        futures = [
+            self.scheduler.thread_pool.submit(self.scheduler.scrape_whole_service, MangaPlus.ID, SCRAPERS[MangaPlus.URL], 'feed1'),
+            self.scheduler.thread_pool.submit(self.scheduler.scrape_whole_service, MangaDex.ID, SCRAPERS[MangaDex.URL], 'feed2'),
+        ]
+
+        self.assertSetEqual(futures[0].result(), set())
+        self.assertSetEqual(futures[1].result(), {1, 2})
+        self.scraper1.set_checked.assert_called_once_with(MangaPlus.ID)
+        self.scraper2.set_checked.assert_called_once_with(MangaDex.ID)
+        self.assertEqual(len(self.scheduler.pool._used), 0)
+
+    def test_circuit_breaker_persisted(self):
+        self.scraper1.scrape_service.side_effect = ValueError
+        for _ in range(FAILURE_THRESHOLD):
+            self.scheduler.scrape_whole_service(MangaPlus.ID, SCRAPERS[MangaPlus.URL], 'feed')
+
+        with self.scheduler.conn() as conn:
+            with conn.cursor() as cur:
+                DbUtil.update_circuit_breakers(cur, self.scheduler.pop_dirty_breakers())
+                self.assertListEqual(self.scheduler.pop_dirty_breakers(), [])
+
+                cur.execute('SELECT consecutive_failures, disabled_until > NOW() FROM services WHERE service_id=%s', (MangaPlus.ID,))
+                self.assertEqual(tuple(cur.fetchone()), (FAILURE_THRESHOLD, True))
+
+                # Open services are not claimed
+                cur.execute('UPDATE service_whole SET next_update=NULL, lease_expires=NULL')
+                service_ids = [s[0] for s in self.scheduler.claim_due_services(conn)]
+                self.assertNotIn(MangaPlus.ID, service_ids)
+            conn.rollback()
+
+    def test_failed_service_postponed(self):
+        with self.scheduler.conn() as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute('UPDATE service_whole SET next_update=NULL, lease_expires=NULL WHERE service_id=%s', (MangaDex.ID,))
+
+        self.scraper2.scrape_service.side_effect = psycopg2.OperationalError
+        with mock.patch.object(self.scraper2, 'set_checked'):
+            self.assertSetEqual(self.scheduler.scrape_whole_service(MangaDex.ID, SCRAPERS[MangaDex.URL], 'feed'), set())
+
+        # Database errors are failures of the service too
+        breaker = self.scheduler.get_breaker(MangaDex.ID)
+        self.assertEqual(breaker.failures, 1)
+        self.scheduler.breakers.clear()
+
+        with self.scheduler.conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute('SELECT next_update > NOW() + %s FROM service_whole WHERE service_id=%s',
+                            (breaker.backoff - timedelta(minutes=1), MangaDex.ID))
+                self.assertTrue(cur.fetchone()[0])
+            conn.rollback()
+
+    @responses.activate
+    def test_failed_service_feed_opens_circuit(self):
+        feed_url = 'https://mangadex.org/rss/failing'
+        responses.add(responses.GET, feed_url, status=404)
+
+        def Scraper(conn, dbutil):
+            return MangaDex(conn, dbutil, http=HttpClient(rate_limiter=None))
+
+        with mock.patch('src.utils.circuit_breaker.FAILURE_THRESHOLD', 2):
+            for _ in range(2):
+                self.assertSetEqual(self.scheduler.scrape_whole_service(MangaDex.ID, Scraper, feed_url), set())
+
+            breaker = self.scheduler.get_breaker(MangaDex.ID)
+            self.assertEqual(breaker.failures, 2)
+            self.assertIs(breaker.state(datetime.now(timezone.utc)), BreakerState.OPEN)
+
+        # The breaker state is not saved so other tests are not affected
+        self.scheduler.breakers.clear()
+
+    def test_circuit_breaker_single_probe(self):
+        with self.scheduler.conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE services SET consecutive_failures=%s, disabled_until=NOW() - INTERVAL '1 minute' "
+                            'WHERE service_id=%s', (FAILURE_THRESHOLD, MangaDex.ID))
+                cur.execute("INSERT INTO manga (title) VALUES ('probe1'), ('probe2') RETURNING manga_id")
+                for manga_id, in cur.fetchall():
+                    cur.execute('INSERT INTO manga_service (manga_id, service_id, title_id) VALUES (%s, %s, %s)',
+                                (manga_id, MangaDex.ID, f'probe{manga_id}'))
+                cur.execute('UPDATE service_whole SET next_update=NULL, lease_expires=NULL WHERE service_id=%s', (MangaDex.ID,))
+
+            queue = WorkQueue()
+            self.scheduler.queue_due_manga(conn, queue)
+            services = self.scheduler.claim_due_services(conn)
+
+            # Only one manga is updated and the service wide feed waits for the result of the probe
+            self.assertEqual(len(queue.remove(lambda i: i['service_id'] == MangaDex.ID)), 1)
+            self.assertNotIn(MangaDex.ID, [s[0] for s in services])
+            self.assertTrue(self.scheduler.get_breaker(MangaDex.ID).probing)
+            conn.rollback()
+
+    def test_manga_without_scraper_postponed(self):
+        with self.scheduler.conn() as conn:
+            with conn.cursor() as cur:
+                manga_id = DbUtil(conn).add_single_series(cur, DummyScraper.ID, 'no_scraper', 'no scraper')
+                cur.execute("UPDATE manga_service SET next_update=NOW() - INTERVAL '1 hour' WHERE manga_id=%s", (manga_id,))
+
+            queue = WorkQueue()
+            _, claimed = self.scheduler.queue_due_manga(conn, queue)
+
+            self.assertIn((manga_id, DummyScraper.ID), claimed)
+            self.assertFalse(queue.remove(lambda i: i['manga_id'] == manga_id))
+
+            with conn.cursor() as cur:
+                cur.execute('SELECT next_update > NOW() + INTERVAL \'1 hour\' FROM manga_service WHERE manga_id=%s', (manga_id,))
+                self.assertTrue(cur.fetchone()[0])
+            conn.rollback()
+
+    def test_run_forever_stops(self):
+        calls = []
+
+        def run_once():
+            calls.append(1)
+            if len(calls) == 2:
+                self.scheduler.stop()
+            # Next update in the past so the loop continues without sleeping
+            return datetime.utcnow() - timedelta(minutes=1)
+
+        with mock.patch.object(self.scheduler, 'run_once', side_effect=run_once):
+            self.scheduler.run_forever(listen=False)
+
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(self.scheduler.stopped)
+
+    def test_run_forever_survives_errors(self):
+        after_tick = mock.MagicMock(side_effect=self.scheduler.stop)
+
+        with mock.patch.object(self.scheduler, 'run_once', side_effect=ValueError):
+            self.scheduler.run_forever(after_tick=after_tick, listen=False)
+
+        after_tick.assert_called_once()
+
+    def test_notification_wakes_up(self):
+        listener = self.scheduler.start_listener()
+        try:
+            self.assertTrue(listener.listening.wait(5))
+            self.dbutil.add_scheduled_runs([ScheduledRun(1, MangaPlus.ID)])
+            self.assertTrue(self.scheduler._wakeup_event.wait(5))
+        finally:
+            listener.stop()
+            self.dbutil.delete_scheduled_runs([(1, MangaPlus.ID)])
+
+    def test_seconds_until(self):
+        max_sleep = self.scheduler.MAX_SLEEP.total_seconds()
+        self.assertEqual(self.scheduler.seconds_until(None), max_sleep)
+        self.assertEqual(self.scheduler.seconds_until(datetime.utcnow() - timedelta(hours=1)), 0)
+        self.assertEqual(self.scheduler.seconds_until(datetime.now(timezone.utc) + timedelta(days=1)), max_sleep)
+
+        seconds = self.scheduler.seconds_until(datetime.utcnow() + timedelta(minutes=1))
+        self.assertGreater(seconds, 0)
+        self.assertLessEqual(seconds, 60)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+import responses
+
+from src.utils.async_fetch import AsyncFetcher
+from src.utils.deadline import deadline, remaining, DeadlineExceeded
+from src.utils.http import HttpClient, NOT_MODIFIED, Validators
+from src.utils.ratelimit import TokenBucket
+
+
+class TestAsyncFetcher(unittest.TestCase):
+    url = 'https://example.com/test'
+
+    def setUp(self) -> None:
+        self.http = HttpClient(rate_limiter=None)
+        self.fetcher = AsyncFetcher(http=self.http, max_transfers=4)
+        self.addCleanup(self.fetcher.close)
+
+    @responses.activate
+    def test_get(self):
+        responses.add(responses.GET, self.url, body='ok')
+
+        r = self.fetcher.submit(self.fetcher.get(self.url)).result()
+        self.assertEqual(r.text, 'ok')
+
+        self.http.validators.update({self.url: Validators.from_response(r)})
+        self.assertIs(self.fetcher.submit(self.fetcher.get(self.url, conditional=True)).result(), NOT_MODIFIED)
+
+    def test_host_concurrency(self):
+        running = []
+        max_running = []
+        lock = threading.Lock()
+
+        def get(*_, **__):
+            with lock:
+                running.append(1)
+                max_running.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.pop()
+
+        fetcher = AsyncFetcher(http=self.http, host_concurrency={'example.com': 2})
+        self.addCleanup(fetcher.close)
+
+        with mock.patch.object(self.http, 'get', side_effect=get):
+            futures = [fetcher.submit(fetcher.get(self.url)) for _ in range(6)]
+            for f in futures:
+                f.result()
+
+        self.assertEqual(len(max_running), 6)
+        self.assertLessEqual(max(max_running), 2)
+
+    def test_rate_limit_wait_on_loop(self):
+        limiter = mock.MagicMock()
+        limiter.bucket.return_value.reserve.return_value = 0.05
+        self.http.limiter = limiter
+
+        async def get():
+            await self.fetcher.get(self.url)
+            return self.fetcher.waited()
+
+        with mock.patch.object(self.http, 'get') as http_get:
+            waited = self.fetcher.submit(get()).result()
+
+        self.assertGreaterEqual(waited, 0.05)
+        http_get.assert_called_once_with(self.url, rate_limit=False)
+        # Waits of other tasks are not counted
+        self.assertEqual(self.fetcher.submit(self._waited()).result(), 0)
+
+    def test_deadline(self):
+        bucket = TokenBucket(rate=1 / 30)
+        bucket.reserve()
+        limiter = mock.MagicMock()
+        limiter.bucket.return_value = bucket
+        self.http.limiter = limiter
+
+        async def get():
+            return await self.fetcher.get(self.url)
+
+        with mock.patch.object(self.http, 'get') as http_get, deadline(10):
+            # Doesn't wait for the rate limit when the deadline would pass while waiting
+            self.assertRaises(DeadlineExceeded, self.fetcher.submit(get()).result, 1)
+
+            # The rate limit slot is not used up
+            self.assertLessEqual(bucket.reserve(), 30)
+
+            # The deadline is visible in the transfer threads
+            self.assertIsNotNone(self.fetcher.submit(self.fetcher.run(remaining)).result())
+
+        http_get.assert_not_called()
+
+    @responses.activate
+    def test_cache_uses_one_rate_limit_slot(self):
+        responses.add(responses.GET, self.url, body='ok')
+        limiter = mock.MagicMock()
+        limiter.bucket.return_value.reserve.return_value = 0.05
+        self.http.limiter = limiter
+
+        async def get():
+            return await asyncio.gather(*[self.fetcher.get(self.url, cache=True) for _ in range(5)])
+
+        self.assertListEqual([r.text for r in self.fetcher.submit(get()).result()], ['ok'] * 5)
+        # Cache hits don't wait for the rate limiter
+        self.assertEqual(self.fetcher.submit(self.fetcher.get(self.url, cache=True)).result().text, 'ok')
+
+        self.assertEqual(len(responses.calls), 1)
+        limiter.bucket.return_value.reserve.assert_called_once()
+
+    async def _waited(self):
+        return self.fetcher.waited()
+
+
+if __name__ == '__main__':
+    unittest.main()
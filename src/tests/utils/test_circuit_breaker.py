@@ -0,0 +1,62 @@
+import unittest
+from datetime import datetime, timezone
+
+from src.utils.circuit_breaker import (
+    CircuitBreaker, BreakerState, FAILURE_THRESHOLD, BASE_BACKOFF, MAX_BACKOFF,
+    PROBE_TIMEOUT
+)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = datetime(2020, 8, 10, 12, tzinfo=timezone.utc)
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(1)
+        for _ in range(FAILURE_THRESHOLD - 1):
+            self.assertFalse(breaker.on_failure(self.now))
+        self.assertIs(breaker.state(self.now), BreakerState.CLOSED)
+
+        self.assertTrue(breaker.on_failure(self.now))
+        self.assertIs(breaker.state(self.now), BreakerState.OPEN)
+        self.assertEqual(breaker.disabled_until, self.now + BASE_BACKOFF)
+        self.assertIs(breaker.state(self.now + BASE_BACKOFF), BreakerState.HALF_OPEN)
+
+    def test_success_resets(self):
+        breaker = CircuitBreaker(1, failures=FAILURE_THRESHOLD - 1)
+        breaker.on_success()
+        self.assertFalse(breaker.on_failure(self.now))
+        self.assertEqual(breaker.failures, 1)
+
+    def test_failures_while_open_ignored(self):
+        breaker = CircuitBreaker(1, failures=FAILURE_THRESHOLD, disabled_until=self.now + BASE_BACKOFF)
+        breaker.dirty = False
+        self.assertTrue(breaker.on_failure(self.now))
+        self.assertEqual(breaker.failures, FAILURE_THRESHOLD)
+        self.assertFalse(breaker.dirty)
+
+    def test_probe(self):
+        breaker = CircuitBreaker(1, failures=FAILURE_THRESHOLD, disabled_until=self.now)
+        self.assertIs(breaker.state(self.now), BreakerState.HALF_OPEN)
+
+        breaker.start_probe(self.now)
+        self.assertIs(breaker.state(self.now), BreakerState.OPEN)
+        self.assertEqual(breaker.disabled_until, self.now + PROBE_TIMEOUT)
+
+        # Failed probe doubles the backoff
+        self.assertTrue(breaker.on_failure(self.now))
+        self.assertEqual(breaker.disabled_until, self.now + BASE_BACKOFF * 2)
+
+        breaker.start_probe(self.now)
+        breaker.on_success()
+        self.assertIs(breaker.state(self.now), BreakerState.CLOSED)
+        self.assertIsNone(breaker.disabled_until)
+        self.assertEqual(breaker.failures, 0)
+
+    def test_max_backoff(self):
+        breaker = CircuitBreaker(1, failures=1000)
+        self.assertEqual(breaker.backoff, MAX_BACKOFF)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,12 @@
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
 from types import GeneratorType
+from unittest.mock import patch
 
 from src.tests.scrapers.testing_scraper import DummyScraper
-from src.tests.testing_utils import Chapter, BaseTestClasses, spy_on
+from src.scrapers import MangaPlus
+from src.tests.testing_utils import Chapter, BaseTestClasses, spy_on, get_conn
+from src.utils.known_chapters import KnownChapters
 
 
 testing_series = {
@@ -200,6 +203,155 @@ class TestDbUtil(BaseTestClasses.DatabaseTestCase):
                 self.assertDatesNotEqual(row['estimated_release_old'], row['estimated_release'])
                 self.assertDateGreater(row['estimated_release'], release)
 
+    def test_update_chapter_intervals(self):
+        with self._conn:
+            with self._conn.cursor() as cur:
+                weekly = self.dbutil.add_single_series(cur, DummyScraper.ID, 'interval_weekly', 'interval weekly')
+                single = self.dbutil.add_single_series(cur, DummyScraper.ID, 'interval_single', 'interval single')
+                release = datetime(2020, 12, 1, 12)
+
+                sql = 'INSERT INTO chapters ' \
+                      '(manga_id, service_id, title, chapter_number, chapter_identifier, release_date) ' \
+                      'VALUES (%s, %s, %s, %s, %s, %s)'
+                for i in range(5):
+                    cur.execute(sql, (weekly, DummyScraper.ID, 'weekly', i, f'interval_weekly_{i}', release + timedelta(days=7*i)))
+                cur.execute(sql, (single, DummyScraper.ID, 'single', 1, 'interval_single_1', release))
+
+                self.dbutil.update_chapter_intervals(cur, [weekly, single])
+
+                cur.execute('SELECT manga_id, release_interval FROM manga WHERE manga_id IN %s', ((weekly, single),))
+                intervals = {r['manga_id']: r['release_interval'] for r in cur}
+                self.assertDictEqual(intervals, {weekly: timedelta(days=7), single: None})
+
+    def test_copy_chapters(self):
+        try:
+            with self._conn.cursor() as cur:
+                manga_id = self.dbutil.add_single_series(cur, DummyScraper.ID, 'copy_manga', 'copy manga')
+                release = datetime(2020, 12, 1, 12)
+                self.dbutil.add_chapters(cur, manga_id, DummyScraper.ID, [
+                    Chapter(chapter_title='existing', chapter_number=1, release_date=release,
+                            chapter_identifier='copy_1', title_id='copy_manga', manga_title='copy manga')
+                ])
+
+                title = 'tab\tnewline\nbackslash\\N'
+                rows = [
+                    (manga_id, DummyScraper.ID, 'existing', 1, None, 'copy_1', release, None),
+                    (manga_id, DummyScraper.ID, title, 2, 5, 'copy_2', release, 'group'),
+                    (manga_id, DummyScraper.ID, 'no date', 3, None, 'copy_3', None, None),
+                    (manga_id, DummyScraper.ID, 'duplicate', 3, None, 'copy_3', None, None),
+                ]
+
+                inserted = self.dbutil.copy_chapters(cur, rows)
+                self.assertCountEqual([r['chapter_identifier'] for r in inserted], ['copy_2', 'copy_3'])
+                self.assertListEqual(self.dbutil.copy_chapters(cur, rows), [])
+                self.assertListEqual(self.dbutil.copy_chapters(cur, []), [])
+
+                cur.execute('SELECT title, chapter_decimal, "group" FROM chapters WHERE service_id=%s AND chapter_identifier=%s',
+                            (DummyScraper.ID, 'copy_2'))
+                self.assertListEqual(list(cur.fetchone()), [title, 5, 'group'])
+        finally:
+            self._conn.rollback()
+
+    def test_get_new_entries(self):
+        chapters = [
+            Chapter(chapter_title=f'new entries {i}', chapter_number=i, release_date=datetime.utcnow(),
+                    chapter_identifier=f'new_entries_{i}', title_id='new_entries', manga_title='new entries')
+            for i in range(3)
+        ]
+        with self._conn:
+            with self._conn.cursor() as cur:
+                manga_id = self.dbutil.add_single_series(cur, DummyScraper.ID, 'new_entries', 'new entries')
+                self.dbutil.add_chapters(cur, manga_id, DummyScraper.ID, chapters[:1], fetch=False)
+
+        with self._conn:
+            with self._conn.cursor() as cur:
+                entries = self.dbutil.get_new_entries(cur, DummyScraper.ID, [*chapters, chapters[2]])
+                self.assertSetEqual(set(entries), set(chapters[1:]))
+
+                self.assertFalse(self.dbutil.get_new_entries(cur, DummyScraper.ID, []))
+
+                # Chapters confirmed to exist are dropped without a query.
+                # Chapters inserted by the ongoing transaction are not known until committed
+                self.dbutil.add_chapters(cur, manga_id, DummyScraper.ID, chapters[1:2], fetch=False)
+                known = KnownChapters(path=None)
+                known.load([(0, DummyScraper.ID, 'loaded')])
+                with patch('src.utils.dbutils.known_chapters', known):
+                    self.assertSetEqual(set(self.dbutil.get_new_entries(cur, DummyScraper.ID, chapters)), {chapters[2]})
+                    self.assertTrue(known.contains(DummyScraper.ID, chapters[0].chapter_identifier))
+                    self.assertFalse(known.contains(DummyScraper.ID, chapters[1].chapter_identifier))
+                    self.assertFalse(known.contains(DummyScraper.ID, chapters[2].chapter_identifier))
+
+                    with patch.object(cur, 'execute') as execute:
+                        self.assertFalse(self.dbutil.get_new_entries(cur, DummyScraper.ID, chapters[:1]))
+                    execute.assert_not_called()
+
+    def test_claim_due_manga(self):
+        now = datetime.utcnow()
+        lease = timedelta(minutes=5)
+        manga = [
+            # title_id, next_update, follows
+            ('due_test_1', now - timedelta(hours=1), 0),
+            ('due_test_2', now - timedelta(days=2), 0),
+            ('due_test_3', now - timedelta(hours=1), 3),
+            ('due_test_4', now + timedelta(hours=1), 3),
+        ]
+
+        with self._conn.cursor() as cur:
+            for title_id, next_update, follows in manga:
+                cur.execute('INSERT INTO manga (title) VALUES (%s) RETURNING manga_id', (title_id,))
+                manga_id = cur.fetchone()[0]
+                cur.execute('INSERT INTO manga_service (manga_id, service_id, title_id, next_update) VALUES (%s, %s, %s, %s)',
+                            (manga_id, DummyScraper.ID, title_id, next_update))
+                for user_id in [1, 3, 4][:follows]:
+                    cur.execute('INSERT INTO user_follows (manga_id, service_id, user_id) VALUES (%s, %s, %s)',
+                                (manga_id, DummyScraper.ID, user_id))
+
+            rows = [r for r in self.dbutil.claim_due_manga(cur, {DummyScraper.ID: 1}, lease)]
+            self.assertListEqual([r['title_id'] for r in rows], ['due_test_2'])
+
+            # Leased manga are not claimed again
+            rows = [r for r in self.dbutil.claim_due_manga(cur, {DummyScraper.ID: 100}, lease) if r['title_id'].startswith('due_test')]
+            self.assertListEqual([r['title_id'] for r in rows], ['due_test_3', 'due_test_1'])
+            self.assertListEqual(list(self.dbutil.claim_due_manga(cur, {DummyScraper.ID: 100}, lease)), [])
+
+            self.dbutil.release_leases(cur, [(rows[0]['manga_id'], DummyScraper.ID)])
+            rows = list(self.dbutil.claim_due_manga(cur, {DummyScraper.ID: 100}, lease))
+            self.assertListEqual([r['title_id'] for r in rows], ['due_test_3'])
+
+        self._conn.rollback()
+
+    def test_claim_skips_locked_rows(self):
+        other_conn = get_conn()
+        lease = timedelta(minutes=5)
+
+        def claimed_manga():
+            with self._conn.cursor() as cur:
+                ids = [r['manga_id'] for r in self.dbutil.claim_due_manga(cur, {MangaPlus.ID: 100}, lease)]
+            self._conn.rollback()
+            return ids
+
+        try:
+            self.assertIn(1, claimed_manga())
+
+            with other_conn.cursor() as cur:
+                cur.execute('SELECT 1 FROM manga_service WHERE manga_id=1 AND service_id=%s FOR UPDATE', (MangaPlus.ID,))
+
+            self.assertNotIn(1, claimed_manga())
+        finally:
+            other_conn.rollback()
+            other_conn.close()
+
+    def test_fetch_state(self):
+        url = 'https://example.com/fetch_state'
+        with self._conn.cursor() as cur:
+            self.dbutil.update_fetch_state(cur, [(url, '"abc"', None, None)])
+            self.dbutil.update_fetch_state(cur, [(url, '"def"', 'Sat, 05 Dec 2020 10:00:00 GMT', 'digest')])
+            rows = {r['url']: r for r in self.dbutil.get_fetch_state(cur)}
+
+        self.assertEqual(rows[url]['etag'], '"def"')
+        self.assertEqual(rows[url]['last_modified'], 'Sat, 05 Dec 2020 10:00:00 GMT')
+        self.assertEqual(rows[url]['digest'], 'digest')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,49 @@
+import contextvars
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils.deadline import (
+    deadline, remaining, expired, bound_timeout, statement_timeout,
+    DeadlineExceeded, MIN_STATEMENT_TIMEOUT
+)
+
+
+class TestDeadline(unittest.TestCase):
+    def test_no_deadline(self):
+        self.assertIsNone(remaining())
+        self.assertFalse(expired())
+        self.assertEqual(bound_timeout((5, 30)), (5, 30))
+        self.assertIsNone(statement_timeout())
+
+    def test_bound_timeout(self):
+        with deadline(10):
+            self.assertLessEqual(remaining(), 10)
+            self.assertEqual(bound_timeout(5), 5)
+            connect, read = bound_timeout((5, 30))
+            self.assertEqual(connect, 5)
+            self.assertLessEqual(read, 10)
+            self.assertLessEqual(bound_timeout(None), 10)
+
+        self.assertIsNone(remaining())
+
+    def test_expired(self):
+        with deadline(0):
+            time.sleep(0.001)
+            self.assertTrue(expired())
+            self.assertRaises(DeadlineExceeded, bound_timeout, 5)
+            # Statements still get time to finish
+            self.assertEqual(statement_timeout(), MIN_STATEMENT_TIMEOUT * 1000)
+
+    def test_propagates_with_context(self):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with deadline(10):
+                f = executor.submit(contextvars.copy_context().run, remaining)
+                self.assertIsNotNone(f.result())
+
+                # Threads don't see the deadline without the context
+                self.assertIsNone(executor.submit(remaining).result())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,242 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+import responses
+
+from src.scrapers.base_scraper import BaseScraper
+from src.tests.scrapers.testing_scraper import DummyScraper
+from src.utils.deadline import deadline, DeadlineExceeded
+from src.utils.http import (
+    HttpClient, http_client, DEFAULT_TIMEOUT, NOT_MODIFIED, Validators,
+    ValidatorStore, ResponseCache, parse_html
+)
+
+
+class TestHttpClient(unittest.TestCase):
+    url = 'https://example.com/test'
+
+    @responses.activate
+    def test_default_timeout(self):
+        responses.add(responses.GET, self.url, body='ok')
+        client = HttpClient(rate_limiter=None)
+
+        with mock.patch.object(client.session, 'request', wraps=client.session.request) as request:
+            client.get(self.url)
+            self.assertEqual(request.call_args.kwargs['timeout'], DEFAULT_TIMEOUT)
+
+            client.get(self.url, timeout=1)
+            self.assertEqual(request.call_args.kwargs['timeout'], 1)
+
+    @responses.activate
+    def test_session_reused(self):
+        responses.add(responses.GET, self.url, body='ok')
+        client = HttpClient(rate_limiter=None)
+
+        adapter = client.session.get_adapter(self.url)
+        self.assertIs(adapter, client.session.get_adapter('http://example.org'))
+        self.assertGreater(adapter.max_retries.total, 0)
+        self.assertNotIn(429, adapter.max_retries.status_forcelist)
+
+        self.assertEqual(client.get(self.url).text, 'ok')
+        self.assertEqual(client.get(self.url).text, 'ok')
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_rate_limiter_used(self):
+        responses.add(responses.GET, self.url, status=429, headers={'Retry-After': '10'})
+        limiter = mock.MagicMock()
+        client = HttpClient(rate_limiter=limiter)
+
+        r = client.get(self.url)
+        limiter.acquire.assert_called_once_with(self.url)
+        limiter.feedback.assert_called_once_with(self.url, 429, r.headers)
+
+    @responses.activate
+    def test_deadline(self):
+        responses.add(responses.GET, self.url, body='ok')
+        client = HttpClient(rate_limiter=None)
+
+        with mock.patch.object(client.session, 'request', wraps=client.session.request) as request:
+            with deadline(20):
+                client.get(self.url)
+            connect, read = request.call_args.kwargs['timeout']
+            self.assertEqual(connect, DEFAULT_TIMEOUT[0])
+            self.assertLessEqual(read, 20)
+
+            with deadline(0):
+                self.assertRaises(DeadlineExceeded, client.get, self.url)
+            self.assertEqual(request.call_count, 1)
+
+    @responses.activate
+    def test_get_conditional(self):
+        client = HttpClient(rate_limiter=None)
+        responses.add(responses.GET, self.url, body='ok')
+
+        r = client.get_conditional(self.url)
+        self.assertEqual(r.text, 'ok')
+        self.assertNotIn('If-None-Match', responses.calls[0].request.headers)
+
+        client.validators.update({self.url: Validators('"abc"', 'Sat, 05 Dec 2020 10:00:00 GMT')})
+        responses.replace(responses.GET, self.url, status=304)
+
+        self.assertIs(client.get_conditional(self.url, headers={'Accept': 'text/xml'}), NOT_MODIFIED)
+        headers = responses.calls[1].request.headers
+        self.assertEqual(headers['If-None-Match'], '"abc"')
+        self.assertEqual(headers['If-Modified-Since'], 'Sat, 05 Dec 2020 10:00:00 GMT')
+        self.assertEqual(headers['Accept'], 'text/xml')
+
+    @responses.activate
+    def test_unchanged_body(self):
+        client = HttpClient(rate_limiter=None)
+        responses.add(responses.GET, self.url, body='body', headers={'ETag': '"1"'})
+
+        r = client.get_conditional(self.url)
+        self.assertEqual(r.text, 'body')
+        client.validators.update({self.url: Validators.from_response(r)})
+
+        # Same body with a new etag is not modified and the new etag is used from now on
+        responses.replace(responses.GET, self.url, body='body', headers={'ETag': '"2"'})
+        self.assertIs(client.get_conditional(self.url), NOT_MODIFIED)
+        self.assertEqual(client.validators.get(self.url).etag, '"2"')
+
+        responses.replace(responses.GET, self.url, body='changed')
+        self.assertEqual(client.get_conditional(self.url).text, 'changed')
+        self.assertEqual(responses.calls[2].request.headers['If-None-Match'], '"2"')
+
+    @responses.activate
+    def test_parse_html(self):
+        client = HttpClient(rate_limiter=None)
+        html = '<html><head><meta charset="utf-8"></head><body><p>Shingeki no Kyojin – 進撃の巨人</p></body></html>'
+        responses.add(responses.GET, self.url, body=html.encode('utf-8'), content_type='text/html')
+
+        for stream in (False, True):
+            with client.get(self.url, stream=stream) as r:
+                root = parse_html(r)
+            self.assertEqual(root.cssselect('p')[0].text, 'Shingeki no Kyojin – 進撃の巨人')
+
+        responses.replace(responses.GET, self.url, body=html.encode('utf-8'), content_type='text/html; charset=utf-8')
+        with client.get(self.url, stream=True) as r:
+            self.assertEqual(parse_html(r).cssselect('p')[0].text, 'Shingeki no Kyojin – 進撃の巨人')
+
+        self.assertRaises(ValueError, client.get, self.url, cache=True, stream=True)
+
+    def test_scraper_uses_shared_client(self):
+        scraper = DummyScraper(None, None)
+        self.assertIs(scraper.http, http_client)
+
+        client = HttpClient()
+        scraper = DummyScraper(None, None, http=client)
+        self.assertIs(scraper.http, client)
+        self.assertIsInstance(scraper, BaseScraper)
+
+
+class TestValidatorStore(unittest.TestCase):
+    def test_dirty(self):
+        store = ValidatorStore()
+        store.load([('a', '"a"', None, None)])
+        self.assertEqual(store.get('a'), Validators('"a"'))
+        self.assertListEqual(store.pop_dirty(), [])
+
+        store.update({'a': Validators('"a"'), 'b': Validators(None, 'date', 'digest')})
+        self.assertListEqual(store.pop_dirty(), [('b', None, 'date', 'digest')])
+        self.assertListEqual(store.pop_dirty(), [])
+
+        store.update({'a': Validators('"a2"')})
+        self.assertListEqual(store.pop_dirty(), [('a', '"a2"', None, None)])
+
+    def test_load_does_not_override(self):
+        store = ValidatorStore()
+        store.update({'a': Validators('"new"')})
+        store.load([('a', '"old"', None, None)])
+        self.assertEqual(store.get('a'), Validators('"new"'))
+
+
+class TestResponseCache(unittest.TestCase):
+    url = 'https://example.com/test'
+
+    @responses.activate
+    def test_cached_get(self):
+        client = HttpClient(rate_limiter=None)
+        responses.add(responses.GET, self.url, body='ok')
+
+        self.assertEqual(client.get(self.url, cache=True).text, 'ok')
+        self.assertEqual(client.get(self.url, cache=True).text, 'ok')
+        self.assertEqual(len(responses.calls), 1)
+
+        # Uncached requests always go through
+        client.get(self.url)
+        self.assertEqual(len(responses.calls), 2)
+
+        client.cache.clear()
+        client.get(self.url, cache=True)
+        self.assertEqual(len(responses.calls), 3)
+
+    @responses.activate
+    def test_errors_not_cached(self):
+        client = HttpClient(rate_limiter=None, retries=0)
+        responses.add(responses.GET, self.url, status=404)
+
+        client.get(self.url, cache=True)
+        client.get(self.url, cache=True)
+        self.assertEqual(len(responses.calls), 2)
+
+    def test_ttl_and_size(self):
+        cache = ResponseCache(maxsize=2, ttl=60)
+        r = mock.Mock(status_code=200)
+
+        for url in ('a', 'b', 'a', 'c'):
+            cache.get_or_fetch(url, lambda: r)
+
+        # b was the least recently used
+        self.assertIsNone(cache.get('b'))
+        self.assertIs(cache.get('a'), r)
+        self.assertIs(cache.get('c'), r)
+
+        with mock.patch('src.utils.http.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 1)
+
+    def test_single_flight(self):
+        cache = ResponseCache()
+        r = mock.Mock(status_code=200)
+        started = threading.Event()
+        release = threading.Event()
+        fetch = mock.Mock()
+
+        def slow_fetch():
+            fetch()
+            started.set()
+            release.wait(5)
+            return r
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_fetch(self.url, slow_fetch)))
+                   for _ in range(4)]
+        threads[0].start()
+        started.wait(5)
+        for t in threads[1:]:
+            t.start()
+
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        fetch.assert_called_once()
+        self.assertListEqual(results, [r] * 4)
+
+    def test_single_flight_error(self):
+        cache = ResponseCache()
+
+        def fetch():
+            raise ValueError
+
+        self.assertRaises(ValueError, cache.get_or_fetch, self.url, fetch)
+        # Failed requests are not remembered
+        r = mock.Mock(status_code=200)
+        self.assertIs(cache.get_or_fetch(self.url, lambda: r), r)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from src.utils.known_chapters import KnownChapters, MERGE_THRESHOLD
+
+
+class TestKnownChapters(unittest.TestCase):
+    def test_only_loaded_services(self):
+        known = KnownChapters(path=None)
+        known.add(1, ['a'])
+        self.assertFalse(known.contains(1, 'a'))
+
+        known.load([(5, 1, 'a'), (3, 2, 'b')])
+        known.add(1, ['c'])
+        self.assertTrue(known.contains(1, 'a'))
+        self.assertTrue(known.contains(1, 'c'))
+        self.assertTrue(known.contains(2, 'b'))
+        self.assertFalse(known.contains(1, 'b'))
+        self.assertFalse(known.contains(3, 'a'))
+        self.assertEqual(known.max_chapter_id, 5)
+        self.assertEqual(len(known), 3)
+
+    def test_merge(self):
+        known = KnownChapters(path=None)
+        known.load([(1, 1, 'loaded')])
+        identifiers = [str(i) for i in range(MERGE_THRESHOLD + 10)]
+        known.add(1, identifiers)
+        known.add(1, identifiers)
+
+        self.assertEqual(len(known), len(identifiers) + 1)
+        self.assertTrue(all(known.contains(1, i) for i in identifiers))
+        self.assertFalse(known.contains(1, 'missing'))
+
+    def test_discard(self):
+        known = KnownChapters(path=None)
+        known.load([(1, 1, 'a'), (2, 1, 'b'), (3, 2, 'a')])
+        known.add(1, ['c'])
+
+        known.discard(1, 'a')
+        known.discard(1, 'c')
+        known.discard(1, 'missing')
+        known.discard(3, 'a')
+
+        self.assertFalse(known.contains(1, 'a'))
+        self.assertFalse(known.contains(1, 'c'))
+        self.assertTrue(known.contains(1, 'b'))
+        self.assertTrue(known.contains(2, 'a'))
+        self.assertDictEqual(known.counts(), {1: 1, 2: 1})
+
+    def test_save_and_read(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'known_chapters.bin')
+            known = KnownChapters(path)
+            self.assertFalse(known.read(1))
+            known.database_id = 1
+
+            known.load([(10, 1, 'a'), (20, 2, 'b')])
+            known.add(2, ['c'])
+            known.save()
+
+            restored = KnownChapters(path)
+            self.assertTrue(restored.read(1))
+            self.assertEqual(restored.max_chapter_id, 20)
+            self.assertTrue(restored.contains(1, 'a'))
+            self.assertTrue(restored.contains(2, 'b'))
+            self.assertTrue(restored.contains(2, 'c'))
+            self.assertFalse(restored.contains(1, 'b'))
+
+            # Files saved from another database are ignored
+            self.assertFalse(KnownChapters(path).read(2))
+
+            with open(path, 'wb') as f:
+                f.write(b'invalid file')
+            with mock.patch('src.utils.known_chapters.logger'):
+                self.assertFalse(KnownChapters(path).read(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
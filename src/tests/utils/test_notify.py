@@ -0,0 +1,84 @@
+import queue
+import unittest
+from datetime import datetime, timedelta
+
+from src.db.models.scheduled_run import ScheduledRun
+from src.scrapers import MangaPlus
+from src.tests.testing_utils import BaseTestClasses, get_conn
+from src.utils.notify import NotifyListener, parse_payload
+
+
+class TestNotifyListener(BaseTestClasses.DatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+
+        self.notifications = queue.Queue()
+        self.listener = NotifyListener(get_conn, lambda n: self.notifications.put(parse_payload(n)))
+        self.listener.POLL_TIMEOUT = 0.1
+        self.listener.start()
+        self.assertTrue(self.listener.listening.wait(5), 'Listener did not start')
+
+    def tearDown(self) -> None:
+        self.listener.stop()
+        self.listener.join(1)
+        super().tearDown()
+
+    def get_notification(self, timeout: float = 5):
+        try:
+            return self.notifications.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def test_scheduled_run_notifies(self):
+        manga_id = 1
+        self.dbutil.add_scheduled_runs([ScheduledRun(manga_id, MangaPlus.ID)])
+        try:
+            self.assertDictEqual(
+                self.get_notification(),
+                {'table': 'scheduled_runs', 'manga_id': manga_id, 'service_id': MangaPlus.ID}
+            )
+        finally:
+            self.dbutil.delete_scheduled_runs([(manga_id, MangaPlus.ID)])
+
+    def test_next_update_notifies_only_when_moved_earlier(self):
+        manga_id = 1
+        with self.conn.cursor() as cur:
+            cur.execute('SELECT next_update FROM manga_service WHERE manga_id=%s AND service_id=%s', (manga_id, MangaPlus.ID))
+            original = cur.fetchone()[0]
+
+        try:
+            self.dbutil.update_manga_next_update(MangaPlus.ID, manga_id, datetime.utcnow() + timedelta(days=1))
+            self.dbutil.update_manga_next_update(MangaPlus.ID, manga_id, datetime.utcnow() + timedelta(days=2))
+            self.assertIsNone(self.get_notification(1))
+
+            self.dbutil.update_manga_next_update(MangaPlus.ID, manga_id, datetime.utcnow())
+            self.assertDictEqual(
+                self.get_notification(),
+                {'table': 'manga_service', 'manga_id': manga_id, 'service_id': MangaPlus.ID}
+            )
+        finally:
+            self.dbutil.update_manga_next_update(MangaPlus.ID, manga_id, original)
+            self.get_notification(1)
+
+    def test_batch_next_update_never_moved_earlier(self):
+        manga_id = 1
+        with self.conn.cursor() as cur:
+            cur.execute('SELECT next_update FROM manga_service WHERE manga_id=%s AND service_id=%s', (manga_id, MangaPlus.ID))
+            original = cur.fetchone()[0]
+
+        try:
+            self.dbutil.update_manga_next_update(MangaPlus.ID, manga_id, datetime.utcnow() + timedelta(days=2))
+            self.dbutil.update_manga_next_updates(MangaPlus.ID, [manga_id], datetime.utcnow() + timedelta(days=1))
+            self.assertIsNone(self.get_notification(1))
+
+            with self.conn.cursor() as cur:
+                cur.execute('SELECT next_update > NOW() + INTERVAL \'36 hours\' FROM manga_service WHERE manga_id=%s AND service_id=%s',
+                            (manga_id, MangaPlus.ID))
+                self.assertTrue(cur.fetchone()[0])
+        finally:
+            self.dbutil.update_manga_next_update(MangaPlus.ID, manga_id, original)
+            self.get_notification(1)
+
+
+if __name__ == '__main__':
+    unittest.main()
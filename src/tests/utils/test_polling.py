@@ -0,0 +1,68 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from src.utils.polling import next_poll, release_window, MIN_WINDOW, MAX_WINDOW
+
+
+class TestPolling(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = datetime(2020, 8, 10, 12)
+        self.min_interval = timedelta(minutes=15)
+        self.max_interval = timedelta(hours=12)
+        self.weekly = timedelta(days=7)
+
+    def next_poll(self, estimated_release, release_interval=None):
+        return next_poll(self.min_interval, estimated_release, release_interval,
+                         max_interval=self.max_interval, now=self.now)
+
+    def test_release_window(self):
+        self.assertEqual(release_window(None), MIN_WINDOW)
+        self.assertEqual(release_window(timedelta(hours=5)), MIN_WINDOW)
+        self.assertEqual(release_window(timedelta(days=3)), timedelta(hours=7, minutes=12))
+        self.assertEqual(release_window(timedelta(days=90)), MAX_WINDOW)
+
+    def test_no_estimate(self):
+        self.assertEqual(self.next_poll(None), self.now + self.min_interval)
+
+    def test_inside_window(self):
+        self.assertEqual(self.next_poll(self.now + timedelta(hours=1), self.weekly), self.now + self.min_interval)
+        self.assertEqual(self.next_poll(self.now - timedelta(hours=1), self.weekly), self.now + self.min_interval)
+
+    def test_before_window(self):
+        # Window of a weekly release starts 12 hours before the release
+        self.assertEqual(self.next_poll(self.now + timedelta(hours=24), self.weekly), self.now + timedelta(hours=6))
+
+        # Far away releases are capped to max interval
+        self.assertEqual(self.next_poll(self.now + timedelta(days=6), self.weekly), self.now + self.max_interval)
+
+        # Wait gets shorter the closer the window is
+        self.assertEqual(self.next_poll(self.now + timedelta(hours=16), self.weekly), self.now + timedelta(hours=2))
+        self.assertEqual(self.next_poll(self.now + timedelta(hours=14), self.weekly), self.now + timedelta(hours=1))
+
+        # Never polls after the window has started
+        self.assertEqual(self.next_poll(self.now + timedelta(hours=12, minutes=10), self.weekly), self.now + timedelta(minutes=10))
+
+    def test_after_window(self):
+        estimate = self.now - timedelta(hours=1, minutes=30)
+        waits = []
+        for hours in range(4):
+            self.now = estimate + MIN_WINDOW + timedelta(hours=hours)
+            waits.append(self.next_poll(estimate) - self.now)
+
+        self.assertListEqual(waits, [self.min_interval * 2 ** i for i in range(4)])
+
+        self.now = estimate + timedelta(days=2)
+        self.assertEqual(self.next_poll(estimate), self.now + self.max_interval)
+
+    def test_after_window_stops_at_next_release(self):
+        estimate = self.now - timedelta(days=6, hours=4)
+        next_window = estimate + self.weekly - MAX_WINDOW
+        self.assertEqual(self.next_poll(estimate, self.weekly), next_window)
+
+    def test_timezone_aware(self):
+        estimate = (self.now + timedelta(hours=24)).replace(tzinfo=timezone.utc)
+        self.assertEqual(self.next_poll(estimate, self.weekly), self.now + timedelta(hours=6))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+from src.tests.testing_utils import BaseTestClasses, get_conn
+from src.utils.prepared import PreparedStatements
+
+
+class TestPreparedStatements(BaseTestClasses.DatabaseTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.statements = PreparedStatements()
+        self.name = self.statements.register('test_add', 'SELECT $1 + $2', ('int', 'int'))
+
+    def test_prepared_once_per_connection(self):
+        with self._conn.cursor() as cur:
+            self.assertEqual(self.statements.execute(cur, self.name, (1, 2)).fetchone()[0], 3)
+            self.assertEqual(self.statements.execute(cur, self.name, (3, 4)).fetchone()[0], 7)
+        self._conn.rollback()
+
+        # Prepared statements are not removed by a rollback
+        self.statements.prepare_all(self._conn)
+        self.assertDictEqual(self.statements.pop_stats(), {self.name: (1, 2)})
+
+        other = get_conn()
+        self.addCleanup(other.close)
+        self.assertFalse(self.statements.is_prepared(other, self.name))
+        self.statements.prepare_all(other)
+        self.assertTrue(self.statements.is_prepared(other, self.name))
+        with other.cursor() as cur:
+            self.assertEqual(self.statements.execute(cur, self.name, (5, 6)).fetchone()[0], 11)
+
+        self.assertDictEqual(self.statements.pop_stats(), {self.name: (1, 1)})
+
+    def test_register_duplicate(self):
+        self.assertRaises(ValueError, self.statements.register, self.name, 'SELECT 1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from unittest import mock
+
+from src.utils.ratelimit import TokenBucket, RateLimiter, parse_retry_after, get_host
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        patcher = mock.patch('src.utils.ratelimit.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst(self):
+        bucket = TokenBucket(rate=2, burst=3)
+        waits = [bucket.reserve() for _ in range(5)]
+        self.assertListEqual(waits, [0, 0, 0, 0.5, 1])
+
+    def test_refill(self):
+        bucket = TokenBucket(rate=1, burst=1)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 1)
+
+        self.clock.now += 10
+        self.assertEqual(bucket.reserve(), 0)
+
+    def test_block(self):
+        bucket = TokenBucket(rate=1, burst=5)
+        bucket.block(30)
+        self.assertEqual(bucket.reserve(), 30)
+        # No burst after being blocked
+        self.assertEqual(bucket.reserve(), 31)
+
+    def test_max_wait(self):
+        bucket = TokenBucket(rate=1, burst=1)
+        self.assertEqual(bucket.reserve(max_wait=1), 0)
+        # Too long waits don't reserve the slot
+        self.assertIsNone(bucket.reserve(max_wait=1))
+        self.assertEqual(bucket.reserve(max_wait=2), 1)
+        self.assertEqual(bucket.reserve(), 2)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_buckets_per_host(self):
+        limiter = RateLimiter({'a.com': (1, 2)}, default=(5, 1))
+        self.assertIs(limiter.bucket('https://a.com/test'), limiter.bucket('http://A.com/other?x=1'))
+        self.assertIsNot(limiter.bucket('https://a.com'), limiter.bucket('https://b.com'))
+        self.assertEqual(limiter.bucket('https://a.com').burst, 2)
+        self.assertEqual(limiter.bucket('https://b.com').rate, 5)
+
+    @mock.patch('src.utils.ratelimit.time.sleep')
+    def test_acquire_sleeps(self, sleep: mock.MagicMock):
+        limiter = RateLimiter(default=(0.001, 1))
+        limiter.acquire('https://a.com')
+        sleep.assert_not_called()
+
+        limiter.acquire('https://a.com')
+        sleep.assert_called_once()
+        self.assertGreater(sleep.call_args[0][0], 900)
+
+    def test_feedback(self):
+        limiter = RateLimiter(default=(1000, 1))
+        limiter.feedback('https://a.com', 200, {'Retry-After': '120'})
+        self.assertLess(limiter.bucket('https://a.com').reserve(), 1)
+
+        limiter.feedback('https://a.com', 503, {})
+        self.assertLess(limiter.bucket('https://a.com').reserve(), 1)
+
+        limiter.feedback('https://a.com', 429, {'retry-after': '120'})
+        self.assertGreater(limiter.bucket('https://a.com').reserve(), 100)
+
+    def test_parse_retry_after(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('invalid'))
+        self.assertEqual(parse_retry_after('30'), 30)
+        self.assertEqual(parse_retry_after('-5'), 0)
+
+        retry_at = datetime.now(timezone.utc) + timedelta(minutes=2)
+        seconds = parse_retry_after(format_datetime(retry_at, usegmt=True))
+        self.assertGreater(seconds, 100)
+        self.assertLessEqual(seconds, 120)
+
+    def test_get_host(self):
+        self.assertEqual(get_host('https://www.Reddit.com/r/test/.rss'), 'www.reddit.com')
+        self.assertEqual(get_host('test_feed'), 'test_feed')
+
+
+if __name__ == '__main__':
+    unittest.main()
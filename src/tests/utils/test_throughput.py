@@ -0,0 +1,67 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from src.utils.throughput import ServiceThroughput, SLOW_LATENCY
+
+
+class TestServiceThroughput(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = datetime(2020, 8, 10, 12, tzinfo=timezone.utc)
+
+    def test_quota(self):
+        throughput = ServiceThroughput(1, manga_per_hour=40)
+        # Starts with a full burst
+        self.assertEqual(throughput.claim_limit(self.now), 10)
+        throughput.consume(10)
+        self.assertEqual(throughput.claim_limit(self.now), 0)
+
+        self.assertEqual(throughput.claim_limit(self.now + timedelta(minutes=3)), 2)
+        # Unused quota is capped to burst
+        self.assertEqual(throughput.claim_limit(self.now + timedelta(hours=5)), 10)
+
+    def test_next_allowed(self):
+        throughput = ServiceThroughput(1, manga_per_hour=60, allowance=0.5, allowance_updated=self.now)
+        self.assertEqual(throughput.next_allowed(), self.now + timedelta(seconds=30))
+
+        throughput.refill(self.now + timedelta(minutes=1))
+        self.assertIsNone(throughput.next_allowed())
+
+    def test_additive_increase(self):
+        throughput = ServiceThroughput(1, max_concurrency=3)
+        self.assertEqual(throughput.limit, 1)
+
+        throughput.on_success(1)
+        self.assertEqual(throughput.limit, 2)
+        # Increase slows down as concurrency grows
+        throughput.on_success(1)
+        throughput.on_success(1)
+        self.assertEqual(throughput.limit, 2)
+        throughput.on_success(1)
+        self.assertEqual(throughput.limit, 3)
+
+        for _ in range(10):
+            throughput.on_success(1)
+        self.assertEqual(throughput.concurrency, 3)
+
+    def test_slow_responses_dont_increase(self):
+        throughput = ServiceThroughput(1)
+        throughput.on_success(SLOW_LATENCY + 1)
+        self.assertEqual(throughput.concurrency, 1)
+
+        throughput = ServiceThroughput(1, latency=1)
+        throughput.on_success(5)
+        self.assertEqual(throughput.concurrency, 1)
+        self.assertGreater(throughput.latency, 1)
+
+    def test_multiplicative_decrease(self):
+        throughput = ServiceThroughput(1, max_concurrency=8, concurrency=8)
+        throughput.on_failure()
+        self.assertEqual(throughput.limit, 4)
+        throughput.on_failure()
+        throughput.on_failure()
+        throughput.on_failure()
+        self.assertEqual(throughput.limit, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+from src.utils.work_queue import WorkQueue
+
+
+class TestWorkQueue(unittest.TestCase):
+    def test_priority_order(self):
+        queue = WorkQueue()
+        queue.put('low', 1)
+        queue.put('high', 10)
+        queue.put('first', 5)
+        queue.put('second', 5)
+
+        self.assertEqual(len(queue), 4)
+        self.assertListEqual([queue.pop() for _ in range(4)], ['high', 'first', 'second', 'low'])
+        self.assertIsNone(queue.pop())
+
+    def test_remove(self):
+        queue = WorkQueue()
+        for i in range(6):
+            queue.put(i, i)
+
+        self.assertListEqual(sorted(queue.remove(lambda i: i % 2 == 0)), [0, 2, 4])
+        self.assertListEqual(queue.remove(lambda i: i > 10), [])
+        self.assertListEqual([queue.pop() for _ in range(len(queue))], [5, 3, 1])
+
+    def test_pop_accepted(self):
+        queue = WorkQueue()
+        for i in range(6):
+            queue.put(i, i)
+
+        self.assertEqual(queue.pop(lambda i: i % 2 == 0), 4)
+        self.assertIsNone(queue.pop(lambda i: i > 10))
+        self.assertListEqual([queue.pop() for _ in range(len(queue))], [5, 3, 2, 1, 0])
+
+    def test_grouped(self):
+        queue = WorkQueue(key=lambda i: i % 2)
+        for i in range(6):
+            queue.put(i, i)
+
+        self.assertEqual(len(queue), 6)
+        self.assertEqual(queue.pop(lambda i: i % 2 == 0), 4)
+        self.assertIsNone(queue.pop(lambda i: i > 10))
+        self.assertListEqual(sorted(queue.remove(lambda i: i == 1 or i == 2)), [1, 2])
+        self.assertListEqual([queue.pop() for _ in range(len(queue))], [5, 3, 0])
+        self.assertIsNone(queue.pop())
+
+
+if __name__ == '__main__':
+    unittest.main()
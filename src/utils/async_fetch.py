@@ -0,0 +1,175 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextvars import ContextVar
+from typing import Optional, Dict, Union, Callable, TypeVar, Coroutine, Any, Mapping
+
+import requests
+
+from src.utils import deadline
+from src.utils.http import HttpClient, http_client, NotModified
+from src.utils.ratelimit import get_host
+
+logger = logging.getLogger('debug')
+
+T = TypeVar('T')
+
+# Maximum amount of requests transferring data at the same time.
+# Requests waiting for the rate limiter or a free slot of their host don't count.
+MAX_TRANSFERS = 32
+
+# Maximum amount of concurrent requests per host
+HOST_CONCURRENCY: Dict[str, int] = {}
+DEFAULT_HOST_CONCURRENCY = 16
+
+# Seconds the current task has waited before its requests were sent
+_waited: ContextVar[float] = ContextVar('fetch_waited', default=0.0)
+
+
+class AsyncFetcher:
+    """
+    Runs scraper network I/O on an asyncio event loop in a background thread.
+
+    Waiting for a free slot of the host and for the rate limiter happens on
+    the event loop so any amount of requests can be in flight at once. Only
+    requests that are transferring data use one of the transfer threads,
+    which make the request with the shared http client. Parsing and database
+    writes are done synchronously by the callers.
+    """
+    def __init__(self, http: HttpClient = http_client,
+                 max_transfers: int = MAX_TRANSFERS,
+                 host_concurrency: Mapping[str, int] = None,
+                 default_concurrency: int = DEFAULT_HOST_CONCURRENCY):
+        self.http = http
+        self._host_concurrency = dict(HOST_CONCURRENCY if host_concurrency is None else host_concurrency)
+        self._default_concurrency = default_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_transfers, thread_name_prefix='fetch')
+        # Only accessed from the event loop
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        # Url to the request of a cached url that is in flight
+        self._cache_misses: Dict[str, 'asyncio.Future[requests.Response]'] = {}
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name='fetch-loop', daemon=True)
+                self._thread.start()
+
+            return self._loop
+
+    def submit(self, coro: Coroutine[Any, Any, T]) -> 'Future[T]':
+        """
+        Runs the coroutine on the event loop of the fetcher with the
+        context of the caller so context variables such as the deadline
+        are visible to it. Can be called from any thread except the
+        event loop thread.
+
+        Returns:
+            Future of the return value of the coroutine
+        """
+        ctx = contextvars.copy_context()
+
+        async def run_in_context():
+            # The task runs in a copy of the context of the event loop thread
+            for var, value in ctx.items():
+                var.set(value)
+            return await coro
+
+        return asyncio.run_coroutine_threadsafe(run_in_context(), self._get_loop())
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = get_host(url)
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self._host_concurrency.get(host, self._default_concurrency))
+            self._semaphores[host] = semaphore
+
+        return semaphore
+
+    async def get(self, url: str, conditional: bool = False, cache: bool = False,
+                  **kwargs) -> Union[requests.Response, NotModified]:
+        """
+        Makes a get request without blocking the event loop
+
+        Args:
+            url: The url
+            conditional: Use HttpClient.get_conditional instead of HttpClient.get
+            cache: Use the response cache of the http client. Cached responses and
+                   concurrent requests of the same url are returned without
+                   waiting for the host or the rate limiter
+            **kwargs: Passed to the http client
+
+        Raises:
+            requests.RequestException: If the request fails
+            DeadlineExceeded: If the deadline passes before the request can be made
+        """
+        if cache:
+            r = self.http.cache.get(url)
+            if r is not None:
+                return r
+
+            # Concurrent requests of the url wait for the same request so only
+            # the request that is actually sent waits for the host and the rate limiter
+            task = self._cache_misses.get(url)
+            if task is None:
+                task = asyncio.ensure_future(self._get(url, conditional, cache=True, **kwargs))
+                self._cache_misses[url] = task
+                task.add_done_callback(lambda _: self._cache_misses.pop(url, None))
+
+            return await asyncio.shield(task)
+
+        return await self._get(url, conditional, **kwargs)
+
+    async def _get(self, url: str, conditional: bool, **kwargs) -> Union[requests.Response, NotModified]:
+        queued = time.monotonic()
+        async with self._host_semaphore(url):
+            if self.http.limiter:
+                # The slot is only reserved if it can be used before the deadline
+                wait = self.http.limiter.bucket(url).reserve(max_wait=deadline.remaining())
+                if wait is None:
+                    raise deadline.DeadlineExceeded(f'Deadline would pass while waiting for the rate limit of {url}')
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+            _waited.set(_waited.get() + time.monotonic() - queued)
+
+            f = self.http.get_conditional if conditional else self.http.get
+            return await self.run(f, url, rate_limit=False, **kwargs)
+
+    async def run(self, f: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Runs a blocking function on the transfer threads with the current context
+        """
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(ctx.run, f, *args, **kwargs))
+
+    @staticmethod
+    def waited() -> float:
+        """
+        Returns:
+            Total amount of seconds the current task has waited for host slots
+            and the rate limiter. Used to exclude waits from response times.
+        """
+        return _waited.get()
+
+    def close(self) -> None:
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+        self._executor.shutdown(wait=False)
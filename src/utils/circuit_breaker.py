@@ -0,0 +1,103 @@
+import enum
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+# Consecutive failed updates after which the circuit opens
+FAILURE_THRESHOLD = 3
+
+# Time the circuit stays open after opening. Doubled after every failed probe
+BASE_BACKOFF = timedelta(minutes=10)
+MAX_BACKOFF = timedelta(hours=12)
+
+# Time a probe can take before another probe is allowed
+PROBE_TIMEOUT = timedelta(minutes=15)
+
+
+class BreakerState(enum.Enum):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of a single service.
+
+    The circuit opens after FAILURE_THRESHOLD consecutive failed updates and
+    the service is not updated until disabled_until. After that the circuit
+    is half-open and a single update is let through as a probe. A successful
+    probe closes the circuit while a failed one opens it again with double
+    the previous backoff. State is persisted in the services table so it
+    carries over between runs and schedulers.
+    """
+    def __init__(self, service_id: int, failures: int = 0,
+                 disabled_until: Optional[datetime] = None):
+        self.service_id = service_id
+        self.failures = failures
+        self.disabled_until = disabled_until
+        self.probing = False
+        # Set when the state has changed and needs to be saved
+        self.dirty = False
+        self._lock = threading.Lock()
+
+    @property
+    def backoff(self) -> timedelta:
+        """
+        Time the circuit stays open with the current amount of failures
+        """
+        exponent = max(self.failures - FAILURE_THRESHOLD, 0)
+        # Cap the exponent so the multiplication can't overflow timedelta
+        return min(BASE_BACKOFF * 2 ** min(exponent, 16), MAX_BACKOFF)
+
+    def state(self, now: datetime) -> BreakerState:
+        with self._lock:
+            if self.disabled_until is not None and self.disabled_until > now:
+                return BreakerState.OPEN
+
+            if self.failures >= FAILURE_THRESHOLD:
+                return BreakerState.HALF_OPEN
+
+            return BreakerState.CLOSED
+
+    def start_probe(self, now: datetime) -> None:
+        """
+        Keeps the circuit open for others while the probe is running
+        """
+        with self._lock:
+            self.probing = True
+            self.disabled_until = now + PROBE_TIMEOUT
+            self.dirty = True
+
+    def on_success(self) -> None:
+        """
+        Records a successful update and closes the circuit
+        """
+        with self._lock:
+            if self.failures or self.disabled_until is not None:
+                self.dirty = True
+
+            self.probing = False
+            self.failures = 0
+            self.disabled_until = None
+
+    def on_failure(self, now: datetime) -> bool:
+        """
+        Records a failed update. Failures of updates that were already
+        running when the circuit opened are ignored.
+
+        Returns:
+            True if the circuit is open after the failure
+        """
+        with self._lock:
+            if not self.probing and self.disabled_until is not None and self.disabled_until > now:
+                return True
+
+            self.probing = False
+            self.failures += 1
+            self.dirty = True
+            if self.failures < FAILURE_THRESHOLD:
+                return False
+
+            self.disabled_until = now + self.backoff
+            return True
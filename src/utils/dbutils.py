@@ -1,3 +1,4 @@
+import io
 import logging
 import statistics
 from datetime import datetime, timedelta
@@ -12,6 +13,8 @@ from psycopg2.extras import execute_values, DictRow
 from src.db.models.manga import MangaService
 from src.db.models.scheduled_run import ScheduledRun
 from src.scrapers import base_scraper
+from src.utils.known_chapters import known_chapters
+from src.utils.prepared import statements
 from src.utils.utilities import round_seconds
 
 logger = logging.getLogger('debug')
@@ -20,6 +23,24 @@ maintenance = logging.getLogger('maintenance')
 
 BaseChapter = TypeVar('BaseChapter', bound=Type['base_scraper.BaseChapter'])
 
+# Amount of chapters after which add_chapters uses COPY instead of a multi row insert
+COPY_THRESHOLD = 500
+
+ChapterRow = Tuple[int, int, str, int, Optional[int], str, Optional[datetime], Optional[str]]
+
+_copy_escapes = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def _copy_value(value: Any) -> str:
+    """
+    Formats a value for COPY text format
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value).translate(_copy_escapes)
+
 
 class TransactionFunction(Protocol):
     def __call__(self, cur: Cursor, *args, **kwargs) -> Any: ...
@@ -48,10 +69,44 @@ class DbUtil:
     def conn(self) -> Connection:
         return self._conn
 
+    _update_manga_next_update = statements.register(
+        'update_manga_next_update',
+        'UPDATE manga_service SET next_update=$1 WHERE manga_id=$2 AND service_id=$3'
+    )
+
     @optional_transaction
     def update_manga_next_update(self, cur: Cursor, service_id: int, manga_id: int, next_update: datetime):
-        sql = 'UPDATE manga_service SET next_update=%s WHERE manga_id=%s AND service_id=%s'
-        cur.execute(sql, (next_update, manga_id, service_id))
+        statements.execute(cur, self._update_manga_next_update, (next_update, manga_id, service_id))
+
+    @optional_transaction
+    def update_manga_next_updates(self, cur: Cursor, service_id: int, manga_ids: Collection[int], next_update: datetime):
+        if not manga_ids:
+            return
+
+        # Only moved forward so the change doesn't wake up the schedulers
+        sql = 'UPDATE manga_service SET next_update=GREATEST(next_update, %s) WHERE service_id=%s AND manga_id=ANY(%s)'
+        cur.execute(sql, (next_update, service_id, list(manga_ids)))
+
+    @optional_transaction
+    def get_release_estimate(self, cur: Cursor, manga_id: int) -> Optional[DictRow]:
+        """
+        Returns:
+            Row with the estimated_release and release_interval of the manga
+        """
+        sql = 'SELECT estimated_release, release_interval FROM manga WHERE manga_id=%s'
+        cur.execute(sql, (manga_id,))
+        return cur.fetchone()
+
+    @optional_transaction
+    def get_next_release(self, cur: Cursor, service_id: int, manga_id: int) -> Optional[datetime]:
+        """
+        Returns:
+            Release time of the next chapter announced by the service if known
+        """
+        sql = 'SELECT next_release FROM manga_service WHERE manga_id=%s AND service_id=%s'
+        cur.execute(sql, (manga_id, service_id))
+        row = cur.fetchone()
+        return row[0] if row else None
 
     @optional_transaction
     def get_service_manga(self, cur: Cursor, service_id: int, include_only=None) -> list:
@@ -66,6 +121,17 @@ class DbUtil:
         cur.execute(sql, args)
         return cur.fetchall()
 
+    @optional_transaction
+    def get_feed_manga(self, cur: Cursor, service_id: int) -> List[DictRow]:
+        """
+        Returns:
+            Enabled manga of the service that have a feed url
+        """
+        sql = 'SELECT manga_id, title_id, feed_url, last_check FROM manga_service ' \
+              'WHERE service_id=%s AND feed_url IS NOT NULL AND NOT disabled'
+        cur.execute(sql, (service_id,))
+        return cur.fetchall()
+
     @optional_transaction
     def get_service(self, cur: Cursor, service_url: str) -> Optional[int]:
         sql = 'SELECT service_id FROM services WHERE url=%s'
@@ -80,12 +146,291 @@ class DbUtil:
 
     @staticmethod
     def get_scheduled_runs(cur: Cursor) -> Cursor:
-        sql = 'SELECT sr.manga_id, sr.service_id, ms.title_id FROM scheduled_runs sr ' \
-              'LEFT JOIN manga_service ms ON sr.manga_id = ms.manga_id AND sr.service_id = ms.service_id'
+        """
+        Selects all scheduled runs with the information required to run them.
+        Feed url is the feed url of the manga or if that's not defined
+        the feed url of the service.
+        """
+        sql = 'SELECT sr.manga_id, sr.service_id, ms.title_id, s.url, COALESCE(ms.feed_url, sw.feed_url) as feed_url ' \
+              'FROM scheduled_runs sr ' \
+              'LEFT JOIN manga_service ms ON sr.manga_id = ms.manga_id AND sr.service_id = ms.service_id ' \
+              'LEFT JOIN services s ON sr.service_id = s.service_id ' \
+              'LEFT JOIN service_whole sw ON sr.service_id = sw.service_id'
 
         cur.execute(sql)
         return cur
 
+    @staticmethod
+    def claim_scheduled_runs(cur: Cursor, lease: timedelta) -> Cursor:
+        """
+        Claims the scheduled runs whose manga isn't leased by another
+        scheduler by leasing their manga_service rows. Runs of manga that
+        are not found from manga_service are also returned with a null title_id.
+        The lease is visible to other schedulers once the transaction is committed.
+
+        Args:
+            cur: The cursor
+            lease: How long the claimed rows are leased for
+        """
+        sql = '''
+            WITH claimed AS (
+                UPDATE manga_service ms SET lease_expires = NOW() + %s
+                FROM (
+                    SELECT ms2.manga_id, ms2.service_id
+                    FROM scheduled_runs sr
+                    INNER JOIN manga_service ms2 ON sr.manga_id = ms2.manga_id AND sr.service_id = ms2.service_id
+                    WHERE ms2.lease_expires IS NULL OR ms2.lease_expires < NOW()
+                    FOR UPDATE OF ms2 SKIP LOCKED
+                ) c
+                WHERE ms.manga_id = c.manga_id AND ms.service_id = c.service_id
+                RETURNING ms.manga_id, ms.service_id, ms.title_id, ms.feed_url
+            )
+            SELECT sr.manga_id, sr.service_id, c.title_id, s.url, COALESCE(c.feed_url, sw.feed_url) as feed_url
+            FROM scheduled_runs sr
+            LEFT JOIN claimed c ON sr.manga_id = c.manga_id AND sr.service_id = c.service_id
+            LEFT JOIN manga_service ms ON sr.manga_id = ms.manga_id AND sr.service_id = ms.service_id
+            LEFT JOIN services s ON sr.service_id = s.service_id
+            LEFT JOIN service_whole sw ON sr.service_id = sw.service_id
+            WHERE c.manga_id IS NOT NULL OR ms.manga_id IS NULL
+        '''
+
+        cur.execute(sql, (lease,))
+        return cur
+
+    _claim_due_manga = statements.register('claim_due_manga', '''
+            WITH due AS (
+                SELECT ms.manga_id, ms.service_id
+                FROM manga_service ms
+                INNER JOIN services s ON s.service_id = ms.service_id
+                WHERE NOT (s.disabled OR ms.disabled) AND (s.disabled_until IS NULL OR s.disabled_until < NOW())
+                      AND (ms.next_update IS NULL OR ms.next_update < NOW())
+                      AND (ms.lease_expires IS NULL OR ms.lease_expires < NOW())
+                FOR UPDATE OF ms SKIP LOCKED
+            ), ranked AS (
+                SELECT ms.service_id, s.url, ms.title_id, ms.manga_id, ms.feed_url, p.priority,
+                       ROW_NUMBER() OVER (PARTITION BY ms.service_id ORDER BY p.priority DESC, ms.manga_id) as rank
+                FROM due d
+                INNER JOIN manga_service ms ON ms.manga_id = d.manga_id AND ms.service_id = d.service_id
+                INNER JOIN services s ON s.service_id = ms.service_id
+                INNER JOIN manga m ON m.manga_id = ms.manga_id
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) as follows FROM user_follows uf
+                    WHERE uf.manga_id = ms.manga_id AND (uf.service_id IS NULL OR uf.service_id = ms.service_id)
+                ) f
+                CROSS JOIN LATERAL (
+                    SELECT EXTRACT(EPOCH FROM NOW() - COALESCE(ms.next_update, ms.last_check, NOW())) / 3600
+                           + 2 * LN(1 + f.follows)
+                           + CASE WHEN m.estimated_release <= NOW() AND (ms.last_check IS NULL OR ms.last_check < m.estimated_release)
+                                  THEN 3 ELSE 0 END as priority
+                ) p
+            ), claimed AS (
+                UPDATE manga_service ms SET lease_expires = NOW() + $1
+                FROM ranked r
+                INNER JOIN unnest($2::int[], $3::int[]) l(service_id, lim) ON l.service_id = r.service_id
+                WHERE r.rank <= l.lim AND ms.manga_id = r.manga_id AND ms.service_id = r.service_id
+                RETURNING r.service_id, r.url, r.title_id, r.manga_id, r.feed_url, r.priority
+            )
+            SELECT * FROM claimed ORDER BY priority DESC
+    ''', ('interval', 'int[]', 'int[]'))
+
+    @staticmethod
+    def claim_due_manga(cur: Cursor, limits: Dict[int, int], lease: timedelta) -> Cursor:
+        """
+        Claims the manga that need to be updated ordered by priority by
+        leasing them. Rows locked or leased by other schedulers are skipped.
+        At most limits[service_id] manga are claimed for each service.
+        Services not in limits are skipped.
+
+        Priority is the amount of hours the manga is overdue with extra
+        weight given to followed manga and manga whose estimated release
+        has passed since the last check.
+        """
+        return statements.execute(cur, DbUtil._claim_due_manga, (lease, list(limits.keys()), list(limits.values())))
+
+    @staticmethod
+    def claim_due_services(cur: Cursor, lease: timedelta) -> Cursor:
+        """
+        Claims the services whose service wide feeds need to be updated
+        by leasing their service_whole rows
+        """
+        sql = '''
+            UPDATE service_whole sw SET lease_expires = NOW() + %s
+            FROM (
+                SELECT sw2.service_id
+                FROM service_whole sw2
+                INNER JOIN services s2 ON s2.service_id = sw2.service_id
+                WHERE NOT s2.disabled AND (s2.disabled_until IS NULL OR s2.disabled_until < NOW())
+                      AND (sw2.next_update IS NULL OR sw2.next_update < NOW())
+                      AND (sw2.lease_expires IS NULL OR sw2.lease_expires < NOW())
+                FOR UPDATE OF sw2 SKIP LOCKED
+            ) c, services s
+            WHERE sw.service_id = c.service_id AND s.service_id = sw.service_id
+            RETURNING sw.service_id, sw.feed_url, s.url
+        '''
+
+        cur.execute(sql, (lease,))
+        return cur
+
+    @staticmethod
+    def get_service_throughput(cur: Cursor) -> List[DictRow]:
+        """
+        Returns the throughput settings and state of all services.
+        The rows are locked until the end of the transaction so the
+        allowances can be updated without races between schedulers.
+        """
+        sql = 'INSERT INTO service_throughput (service_id) SELECT service_id FROM services ON CONFLICT DO NOTHING'
+        cur.execute(sql)
+
+        sql = '''
+            SELECT service_id, manga_per_hour, max_concurrency, concurrency, allowance, allowance_updated, latency
+            FROM service_throughput
+            FOR UPDATE
+        '''
+        cur.execute(sql)
+        return cur.fetchall()
+
+    @staticmethod
+    def get_circuit_breakers(cur: Cursor) -> List[DictRow]:
+        """
+        Returns the circuit breaker state of all services
+        """
+        sql = 'SELECT service_id, consecutive_failures as failures, disabled_until FROM services'
+        cur.execute(sql)
+        return cur.fetchall()
+
+    @staticmethod
+    def update_circuit_breakers(cur: Cursor, data: Collection[Tuple[int, int, Optional[datetime]]]) -> None:
+        """
+        Args:
+            cur: The cursor
+            data: List of service id, consecutive failures, disabled until tuples
+        """
+        if not data:
+            return
+
+        sql = '''
+            UPDATE services s SET consecutive_failures=c.failures, disabled_until=c.disabled_until::timestamptz
+            FROM (VALUES %s) as c(service_id, failures, disabled_until)
+            WHERE s.service_id = c.service_id
+        '''
+        execute_values(cur, sql, data, page_size=len(data))
+
+    @staticmethod
+    def update_service_allowances(cur: Cursor, data: Collection[Tuple[int, float, datetime]]) -> None:
+        """
+        Args:
+            cur: The cursor
+            data: List of service id, allowance, allowance updated tuples
+        """
+        if not data:
+            return
+
+        sql = '''
+            UPDATE service_throughput st SET allowance=c.allowance, allowance_updated=c.allowance_updated::timestamptz
+            FROM (VALUES %s) as c(service_id, allowance, allowance_updated)
+            WHERE st.service_id = c.service_id
+        '''
+        execute_values(cur, sql, data, page_size=len(data))
+
+    @optional_transaction
+    def update_service_concurrency(self, cur: Cursor, data: Collection[Tuple[int, float, Optional[float]]]) -> None:
+        """
+        Args:
+            cur: Optional database cursor
+            data: List of service id, concurrency, latency tuples
+        """
+        if not data:
+            return
+
+        sql = '''
+            UPDATE service_throughput st SET concurrency=c.concurrency, latency=c.latency::real
+            FROM (VALUES %s) as c(service_id, concurrency, latency)
+            WHERE st.service_id = c.service_id
+        '''
+        execute_values(cur, sql, data, page_size=len(data))
+
+    @optional_transaction
+    def release_leases(self, cur: Cursor, manga: Collection[Tuple[int, int]], service_ids: Collection[int] = ()) -> None:
+        """
+        Releases leases taken by the claim functions
+
+        Args:
+            cur: Optional database cursor
+            manga: Manga id, service id pairs of the leased manga_service rows
+            service_ids: Service ids of the leased service_whole rows
+        """
+        if manga:
+            sql = '''
+                UPDATE manga_service ms SET lease_expires = NULL
+                FROM (VALUES %s) as c(manga_id, service_id)
+                WHERE ms.manga_id = c.manga_id AND ms.service_id = c.service_id
+            '''
+            execute_values(cur, sql, list(manga), page_size=len(manga))
+
+        if service_ids:
+            sql = 'UPDATE service_whole SET lease_expires = NULL WHERE service_id = ANY(%s)'
+            cur.execute(sql, (list(service_ids),))
+
+    @staticmethod
+    def get_fetch_state(cur: Cursor) -> List[DictRow]:
+        """
+        Returns the validators of all stored urls
+        """
+        cur.execute('SELECT url, etag, last_modified, digest FROM fetch_state')
+        return cur.fetchall()
+
+    @staticmethod
+    def get_chapter_identifiers(cur: Cursor, after_chapter_id: int = 0) -> Generator[Tuple[int, int, str], None, None]:
+        """
+        Streams the identifiers of all chapters added after the given chapter id.
+        Uses a server side cursor so the chapters are not loaded into memory at once.
+
+        Returns:
+            chapter_id, service_id, chapter_identifier tuples
+        """
+        with cur.connection.cursor(name='chapter_identifiers', cursor_factory=Cursor) as named:
+            named.itersize = 10000
+            named.execute('SELECT chapter_id, service_id, chapter_identifier FROM chapters WHERE chapter_id > %s', (after_chapter_id,))
+            yield from named
+
+    @staticmethod
+    def get_database_identity(cur: Cursor) -> Tuple[int, str]:
+        """
+        Returns:
+            The system identifier of the database cluster and the name of the database
+        """
+        cur.execute('SELECT system_identifier, current_database() FROM pg_control_system()')
+        return cur.fetchone()
+
+    @staticmethod
+    def get_chapter_counts(cur: Cursor, max_chapter_id: int) -> Dict[int, int]:
+        """
+        Returns:
+            Amount of chapters of each service up to the given chapter id
+        """
+        cur.execute('SELECT service_id, COUNT(*) FROM chapters WHERE chapter_id <= %s GROUP BY service_id', (max_chapter_id,))
+        return {service_id: count for service_id, count in cur}
+
+    @optional_transaction
+    def update_fetch_state(self, cur: Cursor, data: Collection[Tuple[str, Optional[str], Optional[str], Optional[str]]]) -> None:
+        """
+        Args:
+            cur: Optional database cursor
+            data: List of url, etag, last modified, digest tuples
+        """
+        if not data:
+            return
+
+        sql = '''
+            INSERT INTO fetch_state (url, etag, last_modified, digest) VALUES %s
+            ON CONFLICT (url) DO UPDATE SET
+                etag=EXCLUDED.etag,
+                last_modified=EXCLUDED.last_modified,
+                digest=EXCLUDED.digest,
+                updated_at=CURRENT_TIMESTAMP
+        '''
+        execute_values(cur, sql, list(data), page_size=len(data))
+
     @optional_transaction
     def delete_scheduled_runs(self, cur: Cursor, to_delete: List[Tuple[int, int]]) -> int:
         """
@@ -115,33 +460,41 @@ class DbUtil:
 
     @optional_transaction
     def update_chapter_interval(self, cur: Cursor, manga_id: int) -> None:
-        sql = '''
-            SELECT MIN(release_date) release_date, chapter_number
-            FROM chapters
-            WHERE manga_id=%s AND chapter_decimal IS NULL
-            GROUP BY chapter_number
-            ORDER BY chapter_number DESC LIMIT 30'''
-        cur.execute(sql, (manga_id,))
-        chapters = []
+        self.update_chapter_intervals(cur, [manga_id])
+
+    @staticmethod
+    def calculate_chapter_interval(manga_id: int, chapters: List[DictRow]) -> Optional[timedelta]:
+        """
+        Calculates the release interval of a manga from its latest chapters
+
+        Args:
+            manga_id: Id of the manga. Used for logging
+            chapters: Rows with the release_date and chapter_number of the
+                      latest chapters ordered by chapter number descending
+
+        Returns:
+            The interval or None if it couldn't be calculated
+        """
+        used = []
         last = None
-        for c in cur:
+        for c in chapters:
             if not last:
                 last = c
-                chapters.append(c)
+                used.append(c)
                 continue
 
             if last['chapter_number']-c['chapter_number'] > 2:
                 break
             last = c
-            chapters.append(c)
+            used.append(c)
 
-        if len(chapters) < 2:
+        if len(used) < 2:
             maintenance.info(f'Not enough chapters to calculate release interval for {manga_id}')
-            return
+            return None
 
         intervals = []
         accuracy = 60*60*4  # 4h
-        for a, b in zip(chapters[:-1], chapters[1:]):
+        for a, b in zip(used[:-1], used[1:]):
             t = a['release_date']-b['release_date']
             t = round_seconds(t.total_seconds(), accuracy)
             # Ignore updates within 4 hours of each other
@@ -151,7 +504,7 @@ class DbUtil:
 
         if not intervals:
             maintenance.info(f'Not enough valid intervals to calculate release interval for {manga_id}')
-            return
+            return None
 
         try:
             interval = statistics.mode(intervals)
@@ -160,10 +513,52 @@ class DbUtil:
             interval = round_seconds(interval, accuracy)
 
         # TODO add warning when interval differs too much from mean
-        interval = timedelta(seconds=interval)
-        sql = 'UPDATE manga SET release_interval=%s WHERE manga_id=%s'
-        logger.info(f'Interval for {manga_id} set to {interval}')
-        cur.execute(sql, (interval, manga_id))
+        return timedelta(seconds=interval)
+
+    @optional_transaction
+    def update_chapter_intervals(self, cur: Cursor, manga_ids: Collection[int]) -> None:
+        """
+        Updates the release intervals of the given manga. The latest chapters
+        of every manga are selected with one query and the intervals are
+        saved with one update.
+        """
+        if not manga_ids:
+            return
+
+        sql = '''
+            SELECT manga_id, release_date, chapter_number FROM (
+                SELECT manga_id, MIN(release_date) release_date, chapter_number,
+                       ROW_NUMBER() OVER (PARTITION BY manga_id ORDER BY chapter_number DESC) as rank
+                FROM chapters
+                WHERE manga_id=ANY(%s) AND chapter_decimal IS NULL
+                GROUP BY manga_id, chapter_number
+            ) c
+            WHERE rank <= 30
+            ORDER BY manga_id, chapter_number DESC'''
+        cur.execute(sql, (list(manga_ids),))
+
+        chapters: Dict[int, List[DictRow]] = {manga_id: [] for manga_id in manga_ids}
+        for row in cur:
+            chapters[row['manga_id']].append(row)
+
+        data = []
+        for manga_id, rows in chapters.items():
+            interval = self.calculate_chapter_interval(manga_id, rows)
+            if interval is None:
+                continue
+
+            logger.info(f'Interval for {manga_id} set to {interval}')
+            data.append((manga_id, interval))
+
+        if not data:
+            return
+
+        sql = '''
+            UPDATE manga m SET release_interval=c.release_interval
+            FROM (VALUES %s) as c(manga_id, release_interval)
+            WHERE m.manga_id = c.manga_id
+        '''
+        execute_values(cur, sql, data, page_size=len(data))
 
     @optional_transaction
     def add_single_series(self, cur: Cursor, service_id: int, title_id: str,
@@ -195,22 +590,21 @@ class DbUtil:
 
             manga_titles[manga_title] = manga
 
-        args = [(x,) for x in manga_titles.keys()]
-        format_args = ','.join(['%s' for _ in args])
+        args = list(manga_titles.keys())
         already_exist = []
         now = datetime.utcnow()
 
         if duplicates:
             logger.warning(f'All duplicates found {duplicates}')
 
-        if format_args:
+        if args:
             # This sql filters out manga in this service already. This is because
             # this function assumes all series added in this function are new
-            sql = f'SELECT MIN(manga.manga_id), LOWER(title), COUNT(manga.manga_id) ' \
-                  f'FROM manga LEFT JOIN manga_service ms ON ms.service_id=%s AND manga.manga_id=ms.manga_id ' \
-                  f'WHERE ms.manga_id IS NULL AND LOWER(title) IN ({format_args}) GROUP BY LOWER(title)'
+            sql = 'SELECT MIN(manga.manga_id), LOWER(title), COUNT(manga.manga_id) ' \
+                  'FROM manga LEFT JOIN manga_service ms ON ms.service_id=%s AND manga.manga_id=ms.manga_id ' \
+                  'WHERE ms.manga_id IS NULL AND LOWER(title)=ANY(%s) GROUP BY LOWER(title)'
 
-            cur.execute(sql, (service_id, *args))
+            cur.execute(sql, (service_id, args))
 
             for row in cur:
                 if row[2] == 1:
@@ -290,22 +684,21 @@ class DbUtil:
 
             manga_titles[manga_title] = chapters
 
-        args = [(x,) for x in manga_titles.keys()]
-        format_args = ','.join(['%s' for _ in args])
+        args = list(manga_titles.keys())
         already_exist = []
         now = datetime.utcnow()
 
         if duplicates:
             logger.warning(f'All duplicates found {duplicates}')
 
-        if format_args:
+        if args:
             # This sql filters out manga in this service already. This is because
             # this function assumes all series added in this function are new
-            sql = f'SELECT MIN(manga.manga_id), LOWER(title), COUNT(manga.manga_id) ' \
-                  f'FROM manga LEFT JOIN manga_service ms ON ms.service_id=%s AND manga.manga_id=ms.manga_id ' \
-                  f'WHERE ms.manga_id IS NULL AND LOWER(title) IN ({format_args}) GROUP BY LOWER(title)'
+            sql = 'SELECT MIN(manga.manga_id), LOWER(title), COUNT(manga.manga_id) ' \
+                  'FROM manga LEFT JOIN manga_service ms ON ms.service_id=%s AND manga.manga_id=ms.manga_id ' \
+                  'WHERE ms.manga_id IS NULL AND LOWER(title)=ANY(%s) GROUP BY LOWER(title)'
 
-            cur.execute(sql, (service_id, *args))
+            cur.execute(sql, (service_id, args))
 
             for row in cur:
                 if row[2] == 1:
@@ -361,11 +754,18 @@ class DbUtil:
         sql = 'UPDATE service_whole SET last_check=%s, next_update=%s WHERE service_id=%s'
         cur.execute(sql, [now, now + update_interval, service_id])
 
+    @optional_transaction
+    def postpone_service_whole(self, cur: Cursor, service_id: int, next_update: datetime) -> None:
+        """
+        Moves the next service wide update to the given time unless it's already later
+        """
+        sql = 'UPDATE service_whole SET next_update=GREATEST(next_update, %s) WHERE service_id=%s'
+        cur.execute(sql, (next_update, service_id))
+
     @staticmethod
     def find_added_titles(cur: Cursor, title_ids: Collection[str]) -> Generator[DictRow, None, None]:
-        format_ids = ','.join(['%s'] * len(title_ids))
-        sql = f'SELECT manga_id, title_id FROM manga_service WHERE title_id IN ({format_ids})'
-        cur.execute(sql, title_ids)
+        sql = 'SELECT manga_id, title_id FROM manga_service WHERE title_id=ANY(%s)'
+        cur.execute(sql, (list(title_ids),))
         for row in cur:
             yield row
 
@@ -377,11 +777,10 @@ class DbUtil:
 
     @optional_transaction
     def update_latest_release(self, cur: Cursor, data: Collection[int]) -> None:
-        format_ids = ','.join(['%s'] * len(data))
         sql = 'UPDATE manga m SET latest_release=c.release_date FROM ' \
-              f'(SELECT MAX(release_date), manga_id FROM chapters WHERE manga_id IN ({format_ids}) GROUP BY manga_id) as c(release_date, manga_id)' \
+              '(SELECT MAX(release_date), manga_id FROM chapters WHERE manga_id=ANY(%s) GROUP BY manga_id) as c(release_date, manga_id)' \
               'WHERE m.manga_id=c.manga_id'
-        cur.execute(sql, data)
+        cur.execute(sql, (list(data),))
 
     @optional_transaction
     def add_chapters(self, cur: Cursor, manga_id, service_id,
@@ -394,10 +793,56 @@ class DbUtil:
                 chapter.release_date, chapter.group
             ) for chapter in chapters
         ]
+        if len(args) >= COPY_THRESHOLD:
+            rows = self.copy_chapters(cur, args)
+            return rows if fetch else None
+
         sql = 'INSERT INTO chapters (manga_id, service_id, title, chapter_number, chapter_decimal, chapter_identifier, release_date, "group") VALUES ' \
               '%s ON CONFLICT DO NOTHING RETURNING manga_id, chapter_number, chapter_decimal, release_date, chapter_identifier'
         return execute_values(cur, sql, args, page_size=max(len(args), 300), fetch=fetch)
 
+    @optional_transaction
+    def copy_chapters(self, cur: Cursor, chapters: Iterable[ChapterRow]) -> List[DictRow]:
+        """
+        Bulk inserts chapters by streaming them with COPY into a staging table
+        and merging them into the chapters table. Much faster than add_chapters
+        for large imports and backfills. Chapters that already exist are skipped.
+
+        Args:
+            cur: Optional database cursor
+            chapters: Tuples of (manga_id, service_id, title, chapter_number,
+                      chapter_decimal, chapter_identifier, release_date, group)
+
+        Returns:
+            manga_id, chapter_number, chapter_decimal, release_date and chapter_identifier
+            of the chapters that were inserted
+        """
+        buf = io.StringIO()
+        for chapter in chapters:
+            buf.write('\t'.join(map(_copy_value, chapter)))
+            buf.write('\n')
+
+        if not buf.tell():
+            return []
+        buf.seek(0)
+
+        # The staging table lives for the session and is emptied on commit
+        sql = 'CREATE TEMP TABLE IF NOT EXISTS chapters_staging (' \
+              ' manga_id INT, service_id SMALLINT, title TEXT, chapter_number INT,' \
+              ' chapter_decimal SMALLINT, chapter_identifier TEXT,' \
+              ' release_date TIMESTAMP WITH TIME ZONE, "group" TEXT' \
+              ') ON COMMIT DELETE ROWS'
+        cur.execute(sql)
+        cur.execute('TRUNCATE chapters_staging')
+
+        cur.copy_expert('COPY chapters_staging (manga_id, service_id, title, chapter_number, chapter_decimal, chapter_identifier, release_date, "group") FROM STDIN', buf)
+
+        sql = 'INSERT INTO chapters (manga_id, service_id, title, chapter_number, chapter_decimal, chapter_identifier, release_date, "group") ' \
+              'SELECT manga_id, service_id, title, chapter_number, chapter_decimal, chapter_identifier, release_date, "group" FROM chapters_staging ' \
+              'ON CONFLICT DO NOTHING RETURNING manga_id, chapter_number, chapter_decimal, release_date, chapter_identifier'
+        cur.execute(sql)
+        return cur.fetchall()
+
     @optional_transaction
     def update_latest_chapter(self, cur: Cursor, data: Collection[Tuple[int, int, datetime]]) -> None:
         """
@@ -412,9 +857,8 @@ class DbUtil:
         if not data:
             return
 
-        format_ids = ','.join(['%s'] * len(data))
-        sql = f'SELECT latest_chapter, manga_id FROM manga WHERE manga_id IN ({format_ids})'
-        cur.execute(sql, [d[0] for d in data])
+        sql = 'SELECT latest_chapter, manga_id FROM manga WHERE manga_id=ANY(%s)'
+        cur.execute(sql, ([d[0] for d in data],))
         rows = cur.fetchall()
         if not rows:
             return
@@ -466,35 +910,54 @@ class DbUtil:
         execute_values(cur, sql, [(c.title, c.chapter_identifier) for c in chapters], page_size=200)
 
     @optional_transaction
-    def get_only_latest_entries(self,
-                                cur: Cursor,
-                                service_id: int,
-                                entries: Iterable[BaseChapter],
-                                manga_id: int = None,
-                                limit: int = 400) -> Collection[BaseChapter]:
-        if manga_id:
-            sql = 'SELECT chapter_identifier FROM chapters ' \
-                  'WHERE service_id=%s AND manga_id=%s ORDER BY chapter_id DESC LIMIT %s'
-            args = (service_id, manga_id, limit)
-        else:
-            sql = 'SELECT chapter_identifier FROM chapters ' \
-                  'WHERE service_id=%s ORDER BY chapter_id DESC LIMIT %s'
-            args = (service_id, limit)
+    def get_new_entries(self, cur: Cursor, service_id: int,
+                        entries: Iterable[BaseChapter]) -> Collection[BaseChapter]:
+        """
+        Filters out chapters that already exist in the service. The identifiers
+        are checked in the database using the unique index on
+        (service_id, chapter_identifier) so only unknown identifiers are returned.
+
+        Returns:
+            The chapters whose identifiers are not yet in the database
+        """
+        # Chapters known to exist are dropped without a query
+        entries = {e for e in entries if not known_chapters.contains(service_id, e.chapter_identifier)}
+        if not entries:
+            return entries
+
+        # Chapters inserted by the current transaction have its transaction id as their xmin.
+        # Those can still be rolled back so they are not added to the known chapters
+        sql = 'SELECT c.chapter_identifier, ch.chapter_id IS NULL, ' \
+              ' COALESCE(ch.xmin::text::bigint = txid_current_if_assigned() %% 4294967296, FALSE) ' \
+              'FROM unnest(%s::text[]) c(chapter_identifier) ' \
+              'LEFT JOIN chapters ch ON ch.service_id=%s AND ch.chapter_identifier=c.chapter_identifier'
 
         try:
-            cur.execute(sql, args)
-            chapters = set(r[0] for r in cur)
+            cur.execute(sql, ([e.chapter_identifier for e in entries], service_id))
+            new_identifiers = set()
+            committed = []
+            for chapter_identifier, is_new, uncommitted in cur:
+                if is_new:
+                    new_identifiers.add(chapter_identifier)
+                elif not uncommitted:
+                    committed.append(chapter_identifier)
+
+            known_chapters.add(service_id, committed)
 
-            return set(entries).difference(chapters)
+            return {e for e in entries if e.chapter_identifier in new_identifiers}
 
         except:
             logger.exception('Failed to get old chapters')
-            return list(entries)
+            return entries
+
+    _set_manga_last_checked = statements.register(
+        'set_manga_last_checked',
+        'UPDATE manga_service SET last_check=$1 WHERE manga_id=$2 AND service_id=$3'
+    )
 
     @optional_transaction
     def set_manga_last_checked(self, cur: Cursor, service_id: int, manga_id: int, last_checked: Optional[datetime]):
-        sql = 'UPDATE manga_service SET last_check=%s WHERE manga_id=%s AND service_id=%s'
-        cur.execute(sql, [last_checked, manga_id, service_id])
+        statements.execute(cur, self._set_manga_last_checked, (last_checked, manga_id, service_id))
 
     @optional_transaction
     def get_newest_chapter(self, cur: Cursor, manga_id: int, service_id: Optional[int] = None):
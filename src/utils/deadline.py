@@ -0,0 +1,89 @@
+import math
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Union, Tuple, Iterator
+
+import requests
+
+# Statements are given at least this many seconds even when the deadline
+# is about to pass so that work that has already been fetched can be saved
+MIN_STATEMENT_TIMEOUT = 5.0
+
+# Monotonic time when the current run must be finished
+_deadline: ContextVar[Optional[float]] = ContextVar('deadline', default=None)
+
+Timeout = Union[None, float, Tuple[Optional[float], Optional[float]]]
+
+
+class DeadlineExceeded(requests.Timeout):
+    """
+    Raised instead of making a request after the deadline has passed.
+    Subclass of requests.Timeout so it's handled like any other timeout.
+    """
+
+
+@contextmanager
+def deadline(seconds: float) -> Iterator[None]:
+    """
+    Sets the deadline of the current context. Work started in other threads
+    only sees the deadline if it's run with the context of the caller
+    e.g. using contextvars.copy_context().run
+    """
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """
+    Returns:
+        Seconds left until the deadline or None if there is no deadline
+    """
+    d = _deadline.get()
+    if d is None:
+        return None
+    return d - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def bound_timeout(timeout: Timeout) -> Timeout:
+    """
+    Limits a requests timeout to the time left until the deadline
+
+    Raises:
+        DeadlineExceeded: If the deadline has already passed
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+
+    if left <= 0:
+        raise DeadlineExceeded('Deadline exceeded before the request was made')
+
+    if timeout is None:
+        return left
+
+    if isinstance(timeout, tuple):
+        return tuple(left if t is None else min(t, left) for t in timeout)  # type: ignore[return-value]
+
+    return min(timeout, left)
+
+
+def statement_timeout() -> Optional[int]:
+    """
+    Returns:
+        The value of statement_timeout in milliseconds that makes
+        statements end around the deadline or None if there is no deadline
+    """
+    left = remaining()
+    if left is None:
+        return None
+
+    return math.ceil(max(left, MIN_STATEMENT_TIMEOUT) * 1000)
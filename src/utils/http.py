@@ -0,0 +1,376 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Optional, Mapping, Union, Tuple, Dict, Iterable, List, Callable
+
+import requests
+from lxml import etree
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from src.utils.deadline import bound_timeout
+from src.utils.ratelimit import RateLimiter, limiter
+
+logger = logging.getLogger('debug')
+
+# Connect and read timeouts in seconds
+DEFAULT_TIMEOUT: Tuple[float, float] = (5, 30)
+
+# Amount of hosts whose connections are kept alive and the amount
+# of kept alive connections per host. Should be at least the amount
+# of scheduler workers so connections aren't discarded after use.
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 8
+
+# Retries on connection errors and temporary server errors.
+# 429 and 503 are handled by the rate limiter instead of retrying.
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = frozenset({500, 502, 504})
+
+# Size of the chunks streamed responses are read in
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Maximum amount of responses in the response cache and the seconds a
+# response is reused. Long enough to cover a single scheduler run.
+CACHE_SIZE = 256
+CACHE_TTL = 120
+
+
+def create_retry(total: int = MAX_RETRIES) -> Retry:
+    return Retry(
+        total=total,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({'GET', 'HEAD'}),
+        raise_on_status=False,
+        respect_retry_after_header=False,
+    )
+
+
+class NotModified:
+    """
+    Returned instead of a response when the resource has not changed
+    since it was last processed
+    """
+    def __repr__(self):
+        return 'NOT_MODIFIED'
+
+
+NOT_MODIFIED = NotModified()
+
+
+def content_digest(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def parse_html(r: requests.Response) -> etree.ElementBase:
+    """
+    Parses the body of the response as html. When the request was made
+    with stream=True the body is fed to the parser as it's downloaded
+    instead of being buffered and decoded to a string first.
+
+    Returns:
+        The root element of the document
+    """
+    # Without a charset in the headers the parser detects the encoding from the document
+    encoding = r.encoding if 'charset' in r.headers.get('Content-Type', '') else None
+    parser = etree.HTMLParser(encoding=encoding)
+    for chunk in r.iter_content(STREAM_CHUNK_SIZE):
+        parser.feed(chunk)
+
+    return parser.close()
+
+
+class Validators:
+    """
+    Cache validators of a response used to make conditional requests.
+    The digest of the body is used to detect unchanged responses
+    from servers that don't support conditional requests.
+    """
+    __slots__ = ('etag', 'last_modified', 'digest')
+
+    def __init__(self, etag: Optional[str] = None, last_modified: Optional[str] = None,
+                 digest: Optional[str] = None):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.digest = digest
+
+    @classmethod
+    def from_response(cls, r: requests.Response) -> 'Validators':
+        return cls(r.headers.get('ETag'), r.headers.get('Last-Modified'), content_digest(r.content))
+
+    def headers(self) -> Dict[str, str]:
+        """
+        Returns:
+            Headers that make a request conditional
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def __eq__(self, other):
+        if not isinstance(other, Validators):
+            return NotImplemented
+        return (self.etag == other.etag and self.last_modified == other.last_modified
+                and self.digest == other.digest)
+
+    def __repr__(self):
+        return f'Validators(etag={self.etag!r}, last_modified={self.last_modified!r}, digest={self.digest!r})'
+
+
+class ValidatorStore:
+    """
+    Thread safe in memory store of validators per url.
+    Keeps track of changed validators so they can be saved to the database.
+    """
+    def __init__(self):
+        self._validators: Dict[str, Validators] = {}
+        self._dirty: Dict[str, Validators] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._validators)
+
+    def get(self, url: str) -> Optional[Validators]:
+        with self._lock:
+            return self._validators.get(url)
+
+    def update(self, validators: Mapping[str, Validators]) -> None:
+        with self._lock:
+            for url, v in validators.items():
+                if self._validators.get(url) != v:
+                    self._validators[url] = v
+                    self._dirty[url] = v
+
+    def load(self, rows: Iterable[Tuple[str, Optional[str], Optional[str], Optional[str]]]) -> None:
+        """
+        Adds validators loaded from the database without marking them as changed
+        """
+        with self._lock:
+            for url, etag, last_modified, digest in rows:
+                self._validators.setdefault(url, Validators(etag, last_modified, digest))
+
+    def pop_dirty(self) -> List[Tuple[str, Optional[str], Optional[str], Optional[str]]]:
+        """
+        Returns:
+            Url, etag, last modified, digest tuples of the validators changed since the last call
+        """
+        with self._lock:
+            dirty = [(url, v.etag, v.last_modified, v.digest) for url, v in self._dirty.items()]
+            self._dirty.clear()
+            return dirty
+
+
+class ResponseCache:
+    """
+    Thread safe LRU cache of successful responses keyed by url.
+    Concurrent requests of the same url are coalesced so that
+    only one of them is sent and the rest wait for its response.
+    """
+    def __init__(self, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Url to expiry time and response
+        self._responses: 'OrderedDict[str, Tuple[float, requests.Response]]' = OrderedDict()
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._responses)
+
+    def _get(self, url: str) -> Optional[requests.Response]:
+        # Must be called while holding the lock
+        cached = self._responses.get(url)
+        if cached is None:
+            return None
+
+        expires, r = cached
+        if expires <= time.monotonic():
+            del self._responses[url]
+            return None
+
+        self._responses.move_to_end(url)
+        return r
+
+    def get(self, url: str) -> Optional[requests.Response]:
+        """
+        Returns:
+            The cached response of the url or None if there is no fresh response
+        """
+        with self._lock:
+            return self._get(url)
+
+    def get_or_fetch(self, url: str, fetch: Callable[[], requests.Response]) -> requests.Response:
+        """
+        Returns the cached response of the url. If there is none, waits for
+        a request of the same url that is in flight or calls fetch.
+        Only responses with the status 200 are cached.
+
+        Raises:
+            requests.RequestException: If fetch fails. Also raised to requests waiting for it
+        """
+        with self._lock:
+            r = self._get(url)
+            if r is not None:
+                return r
+
+            future = self._in_flight.get(url)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[url] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            r = fetch()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(r)
+        finally:
+            with self._lock:
+                del self._in_flight[url]
+
+        if r.status_code == 200:
+            with self._lock:
+                self._responses[url] = (time.monotonic() + self.ttl, r)
+                self._responses.move_to_end(url)
+                while len(self._responses) > self.maxsize:
+                    self._responses.popitem(last=False)
+
+        return r
+
+    def clear(self) -> None:
+        with self._lock:
+            self._responses.clear()
+
+
+class HttpClient:
+    """
+    Thread safe http client shared by scrapers. Keeps connections alive
+    in per host pools, applies a default timeout and retry policy to
+    every request and goes through the rate limiter.
+    """
+    def __init__(self, timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT,
+                 retries: int = MAX_RETRIES,
+                 pool_connections: int = POOL_CONNECTIONS,
+                 pool_maxsize: int = POOL_MAXSIZE,
+                 rate_limiter: Optional[RateLimiter] = limiter,
+                 headers: Optional[Mapping[str, str]] = None,
+                 cache: Optional[ResponseCache] = None):
+        """
+        Args:
+            timeout: Default timeout of requests. Either a single value or
+                     a tuple of connect and read timeouts
+            retries: Maximum amount of retries of a single request
+            pool_connections: Amount of hosts to keep connection pools for
+            pool_maxsize: Maximum amount of kept alive connections per host
+            rate_limiter: Rate limiter used for requests or None to disable rate limiting
+            headers: Headers sent with every request
+            cache: Cache used for requests made with cache=True. A new cache is created by default
+        """
+        self.timeout = timeout
+        self.limiter = rate_limiter
+        self.validators = ValidatorStore()
+        self.cache = ResponseCache() if cache is None else cache
+        self.session = requests.Session()
+        if headers:
+            self.session.headers.update(headers)
+
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              max_retries=create_retry(retries))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method: str, url: str, rate_limit: bool = True, **kwargs) -> requests.Response:
+        """
+        Makes a request using the kept alive connections
+
+        Args:
+            method: Http method
+            url: The url
+            rate_limit: Wait for the rate limiter before the request. Callers
+                        that have already waited for the rate limiter set this to False
+
+        Raises:
+            requests.RequestException: If the request fails after all retries
+            DeadlineExceeded: If the deadline of the current context has passed
+        """
+        kwargs.setdefault('timeout', self.timeout)
+
+        if self.limiter and rate_limit:
+            self.limiter.acquire(url)
+
+        # Bounded after waiting for the rate limiter so the wait is taken into account
+        kwargs['timeout'] = bound_timeout(kwargs['timeout'])
+
+        r = self.session.request(method, url, **kwargs)
+
+        if self.limiter:
+            self.limiter.feedback(url, r.status_code, r.headers)
+
+        return r
+
+    def get(self, url: str, cache: bool = False, **kwargs) -> requests.Response:
+        """
+        Makes a get request
+
+        Args:
+            url: The url
+            cache: Reuse a recent response of the url and share the response
+                   with concurrent requests of the same url. Only for requests
+                   whose response only depends on the url. Can't be used with stream=True
+                   as the body of a streamed response can only be read once.
+            **kwargs: Passed to request
+        """
+        if cache:
+            if kwargs.get('stream'):
+                raise ValueError('Streamed responses cannot be cached')
+            return self.cache.get_or_fetch(url, lambda: self.request('GET', url, **kwargs))
+
+        return self.request('GET', url, **kwargs)
+
+    def get_conditional(self, url: str, **kwargs) -> Union[requests.Response, NotModified]:
+        """
+        Makes a conditional get request using the stored validators of the url
+
+        Returns:
+            The response or NOT_MODIFIED if the server responded with 304
+            or the body is the same as the last processed body
+        """
+        validators = self.validators.get(url)
+        if validators:
+            kwargs['headers'] = {**(kwargs.get('headers') or {}), **validators.headers()}
+
+        r = self.get(url, **kwargs)
+        if r.status_code == 304:
+            return NOT_MODIFIED
+
+        if r.status_code == 200 and validators and validators.digest:
+            new_validators = Validators.from_response(r)
+            if new_validators.digest == validators.digest:
+                # The body is the same as the processed one so the new
+                # header validators can be used right away
+                self.validators.update({url: new_validators})
+                return NOT_MODIFIED
+
+        return r
+
+    def close(self) -> None:
+        self.session.close()
+
+
+http_client = HttpClient()
@@ -0,0 +1,239 @@
+import hashlib
+import logging
+import os
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+logger = logging.getLogger('debug')
+
+# File the filter is saved to between restarts. Set to an empty string to disable saving.
+# Relative paths are relative to the project root so the working directory doesn't matter
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+KNOWN_CHAPTERS_FILE = os.environ.get('KNOWN_CHAPTERS_FILE', 'known_chapters.bin')
+if KNOWN_CHAPTERS_FILE:
+    KNOWN_CHAPTERS_FILE = os.path.join(_PROJECT_ROOT, KNOWN_CHAPTERS_FILE)
+
+# Amount of recently added fingerprints kept in a set before they are
+# merged into the sorted array of a service
+MERGE_THRESHOLD = 4096
+
+_MAGIC = b'KCH2'
+# Magic, id of the database, largest loaded chapter id and amount of services
+_HEADER = struct.Struct('<4sQqI')
+# Service id and amount of fingerprints
+_SERVICE_HEADER = struct.Struct('<iQ')
+
+
+def fingerprint(chapter_identifier: str) -> int:
+    """
+    Returns:
+        64-bit fingerprint of the chapter identifier
+    """
+    digest = hashlib.blake2b(chapter_identifier.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class _ServiceFilter:
+    """
+    Fingerprints of a single service. Most fingerprints are kept in a sorted
+    array which takes 8 bytes per chapter and new ones in a small set.
+    """
+    __slots__ = ('sorted', 'recent')
+
+    def __init__(self, fingerprints: Optional[array] = None):
+        self.sorted = fingerprints if fingerprints is not None else array('Q')
+        self.recent: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self.sorted) + len(self.recent)
+
+    def __contains__(self, fp: int) -> bool:
+        if fp in self.recent:
+            return True
+
+        i = bisect_left(self.sorted, fp)
+        return i < len(self.sorted) and self.sorted[i] == fp
+
+    def add(self, fp: int) -> None:
+        if fp in self:
+            return
+
+        self.recent.add(fp)
+        if len(self.recent) >= MERGE_THRESHOLD:
+            self.merge()
+
+    def discard(self, fp: int) -> None:
+        if fp in self.recent:
+            self.recent.discard(fp)
+            return
+
+        i = bisect_left(self.sorted, fp)
+        if i < len(self.sorted) and self.sorted[i] == fp:
+            del self.sorted[i]
+
+    def merge(self) -> None:
+        if not self.recent:
+            return
+
+        self.sorted = array('Q', sorted([*self.sorted, *self.recent]))
+        self.recent = set()
+
+
+class KnownChapters:
+    """
+    Thread safe in memory set of chapter identifiers that exist in the
+    database per service. Used to drop already seen feed entries before
+    querying the database.
+
+    Identifiers are stored as 64-bit fingerprints. Only identifiers of
+    committed chapters are added and deleted chapters are discarded, so the
+    only way a new chapter can be dropped is a fingerprint collision which
+    is negligibly unlikely. The filter is only used for services that have
+    been loaded. The saved file is tied to the database it was loaded from.
+    """
+    def __init__(self, path: Optional[str] = KNOWN_CHAPTERS_FILE):
+        """
+        Args:
+            path: File the filter is saved to and read from. None or empty disables saving
+        """
+        self.path = path or None
+        self._services: Dict[int, _ServiceFilter] = {}
+        # Identifies the database the chapters were loaded from
+        self.database_id = 0
+        # Largest chapter id that has been loaded from the database
+        self.max_chapter_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(map(len, self._services.values()))
+
+    def contains(self, service_id: int, chapter_identifier: str) -> bool:
+        with self._lock:
+            service = self._services.get(service_id)
+            return service is not None and fingerprint(chapter_identifier) in service
+
+    def add(self, service_id: int, chapter_identifiers: Iterable[str]) -> None:
+        """
+        Adds identifiers of chapters that exist in the database.
+        Ignored for services that have not been loaded.
+        """
+        with self._lock:
+            service = self._services.get(service_id)
+            if service is None:
+                return
+
+            for chapter_identifier in chapter_identifiers:
+                service.add(fingerprint(chapter_identifier))
+
+    def discard(self, service_id: int, chapter_identifier: str) -> None:
+        """
+        Removes the identifier of a chapter that was deleted from the database
+        """
+        with self._lock:
+            service = self._services.get(service_id)
+            if service is not None:
+                service.discard(fingerprint(chapter_identifier))
+
+    def counts(self) -> Dict[int, int]:
+        """
+        Returns:
+            Amount of known chapters of each loaded service
+        """
+        with self._lock:
+            return {service_id: len(service) for service_id, service in self._services.items()}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._services = {}
+            self.max_chapter_id = 0
+
+    def load(self, rows: Iterable[Tuple[int, int, str]]) -> None:
+        """
+        Adds chapters loaded from the database and marks their services as loaded
+
+        Args:
+            rows: chapter_id, service_id, chapter_identifier tuples
+        """
+        with self._lock:
+            for chapter_id, service_id, chapter_identifier in rows:
+                service = self._services.get(service_id)
+                if service is None:
+                    service = self._services[service_id] = _ServiceFilter()
+
+                service.add(fingerprint(chapter_identifier))
+                self.max_chapter_id = max(self.max_chapter_id, chapter_id)
+
+            for service in self._services.values():
+                service.merge()
+
+    def save(self) -> None:
+        """
+        Writes the filter to the file. The file is replaced atomically
+        """
+        path = self.path
+        if path is None:
+            return
+
+        tmp = path + '.tmp'
+        with self._lock:
+            with open(tmp, 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, self.database_id, self.max_chapter_id, len(self._services)))
+                for service_id, service in self._services.items():
+                    service.merge()
+                    f.write(_SERVICE_HEADER.pack(service_id, len(service.sorted)))
+                    service.sorted.tofile(f)
+
+        os.replace(tmp, path)
+
+    def read(self, database_id: int) -> bool:
+        """
+        Loads the filter from the file written by save. Chapters added to the
+        database after max_chapter_id still need to be loaded with load.
+
+        Args:
+            database_id: Id of the current database. Files saved from other databases are ignored
+
+        Returns:
+            False if the file does not exist, is invalid or is from another database
+        """
+        path = self.path
+        if path is None:
+            return False
+
+        try:
+            with open(path, 'rb') as f:
+                magic, file_database_id, max_chapter_id, count = _HEADER.unpack(f.read(_HEADER.size))
+                if magic != _MAGIC:
+                    logger.warning(f'Invalid known chapters file {path}')
+                    return False
+
+                if file_database_id != database_id:
+                    logger.info(f'Known chapters file {path} is from another database')
+                    return False
+
+                services = {}
+                for _ in range(count):
+                    service_id, length = _SERVICE_HEADER.unpack(f.read(_SERVICE_HEADER.size))
+                    fingerprints = array('Q')
+                    fingerprints.fromfile(f, length)
+                    services[service_id] = _ServiceFilter(fingerprints)
+
+        except FileNotFoundError:
+            return False
+        except (OSError, EOFError, struct.error):
+            logger.exception(f'Failed to read known chapters from {path}')
+            return False
+
+        with self._lock:
+            self._services = services
+            self.database_id = database_id
+            self.max_chapter_id = max_chapter_id
+
+        return True
+
+
+known_chapters = KnownChapters()
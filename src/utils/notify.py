@@ -0,0 +1,98 @@
+import json
+import logging
+import select
+import threading
+from typing import Callable, Any, Optional
+
+import psycopg2
+from psycopg2.extensions import (
+    connection as Connection, Notify, ISOLATION_LEVEL_AUTOCOMMIT
+)
+
+logger = logging.getLogger('debug')
+
+# Channel the database triggers notify on
+SCHEDULER_CHANNEL = 'scheduler'
+
+
+def parse_payload(notify: Notify) -> Optional[dict]:
+    """
+    Returns:
+        The json payload of the notification or None if it's not valid json
+    """
+    try:
+        return json.loads(notify.payload)
+    except (TypeError, ValueError):
+        return None
+
+
+class NotifyListener(threading.Thread):
+    """
+    Listens to a postgres notification channel on a dedicated connection
+    and calls the callback for every notification received.
+    Reconnects automatically if the connection is lost.
+    """
+    # Seconds between checks of the stop flag
+    POLL_TIMEOUT = 5
+    # Seconds to wait before reconnecting after a failure
+    RECONNECT_DELAY = 10
+
+    def __init__(self, connect: Callable[[], Connection],
+                 callback: Callable[[Notify], Any],
+                 channel: str = SCHEDULER_CHANNEL):
+        """
+        Args:
+            connect: Function that creates a new database connection
+            callback: Function called with each notification
+            channel: Name of the channel listened to
+        """
+        super().__init__(name=f'{channel}-listener', daemon=True)
+        self._connect = connect
+        self._callback = callback
+        self.channel = channel
+        self._stop_event = threading.Event()
+        # Set when the listener is listening to the channel
+        self.listening = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop_event.is_set()
+
+    def run(self) -> None:
+        while not self.stopped:
+            conn = None
+            try:
+                conn = self._connect()
+                self._listen(conn)
+            except psycopg2.Error:
+                logger.exception(f'Listener of channel {self.channel} failed')
+            finally:
+                self.listening.clear()
+                if conn is not None and not conn.closed:
+                    conn.close()
+
+            self._stop_event.wait(self.RECONNECT_DELAY)
+
+    def _listen(self, conn: Connection) -> None:
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            # Channel is an identifier so it can't be passed as a parameter
+            cur.execute(f'LISTEN "{self.channel}"')
+
+        self.listening.set()
+        logger.info(f'Listening to channel {self.channel}')
+
+        while not self.stopped:
+            if select.select([conn], [], [], self.POLL_TIMEOUT) == ([], [], []):
+                continue
+
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                try:
+                    self._callback(notify)
+                except Exception:
+                    logger.exception(f'Failed to handle notification {notify.payload}')
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+# Longest allowed time between two checks of a manga
+DEFAULT_MAX_INTERVAL = timedelta(hours=12)
+
+# Bounds for the half width of the window around an estimated release
+MIN_WINDOW = timedelta(hours=1)
+MAX_WINDOW = timedelta(hours=12)
+
+
+def _to_naive_utc(d: datetime) -> datetime:
+    if d.tzinfo is None:
+        return d
+    return d.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _clamp(value: timedelta, lower: timedelta, upper: timedelta) -> timedelta:
+    return min(max(value, lower), upper)
+
+
+def release_window(release_interval: Optional[timedelta]) -> timedelta:
+    """
+    Half width of the window around the estimated release during which
+    the manga is polled as often as possible. The window scales with the
+    release interval since releases of monthly series are spread out more
+    than those of weekly series.
+    """
+    if not release_interval:
+        return MIN_WINDOW
+
+    return _clamp(release_interval / 10, MIN_WINDOW, MAX_WINDOW)
+
+
+def next_poll(min_interval: timedelta,
+              estimated_release: Optional[datetime] = None,
+              release_interval: Optional[timedelta] = None,
+              max_interval: timedelta = DEFAULT_MAX_INTERVAL,
+              now: Optional[datetime] = None) -> datetime:
+    """
+    Calculates when a manga should be checked next.
+
+    Inside the window around the estimated release the manga is checked
+    every min_interval. Before the window the wait is half of the time left
+    until the window which makes checks get exponentially more frequent
+    until the window starts. After a missed window the wait doubles every
+    window width until the next predicted release. The wait is always
+    between min_interval and max_interval.
+
+    Args:
+        min_interval: Shortest allowed time between checks
+        estimated_release: Predicted release of the next chapter
+        release_interval: Average time between releases
+        max_interval: Longest allowed time between checks
+        now: The current time in UTC. Defaults to datetime.utcnow()
+
+    Returns:
+        Naive UTC datetime of the next check
+    """
+    now = _to_naive_utc(now) if now else datetime.utcnow()
+    max_interval = max(max_interval, min_interval)
+
+    if estimated_release is None:
+        return now + min_interval
+
+    estimated_release = _to_naive_utc(estimated_release)
+    width = release_window(release_interval)
+    window_start = estimated_release - width
+    window_end = estimated_release + width
+
+    if window_start <= now <= window_end:
+        return now + min_interval
+
+    if now < window_start:
+        wait = _clamp((window_start - now) / 2, min_interval, max_interval)
+        return min(now + wait, window_start)
+
+    # The release was missed. Back off exponentially based on how late it is
+    late = (now - window_end) / width
+    wait = _clamp(min_interval * 2 ** min(late, 32), min_interval, max_interval)
+    next_update = now + wait
+
+    if release_interval and release_interval > timedelta(0):
+        # Don't sleep past the start of the next predicted release
+        # in case the manga skipped a release
+        periods = (now - window_start) // release_interval + 1
+        next_update = min(next_update, window_start + release_interval * periods)
+
+    return next_update
@@ -0,0 +1,105 @@
+import logging
+import threading
+import weakref
+from collections import Counter
+from typing import Dict, Sequence, Tuple, Any, Set, MutableMapping
+
+from psycopg2.extensions import connection as Connection, cursor as Cursor
+
+logger = logging.getLogger('debug')
+
+
+class PreparedStatements:
+    """
+    Registry of frequently run statements that are prepared once per
+    connection and run by name afterwards, so the server doesn't have to
+    parse and plan them again on every run.
+
+    Statements are written with $1, $2... placeholders. Prepared statements
+    live as long as the connection, so the prepared names are tracked for
+    each connection and new connections prepare them again.
+    """
+    def __init__(self):
+        # Name to parameter types and sql
+        self._statements: Dict[str, Tuple[Tuple[str, ...], str]] = {}
+        # Connection to the names of the statements prepared on it
+        self._prepared: MutableMapping[Connection, Set[str]] = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        # Amount of times each statement was prepared and executed
+        self.prepares = Counter()
+        self.executions = Counter()
+
+    def register(self, name: str, sql: str, types: Sequence[str] = ()) -> str:
+        """
+        Args:
+            name: Name of the statement. Must be unique
+            sql: The statement with $1, $2... as placeholders
+            types: Types of the parameters. Only needed when the server
+                   can't infer them from the statement
+
+        Returns:
+            The name of the statement
+        """
+        with self._lock:
+            if name in self._statements:
+                raise ValueError(f'Statement {name} is already registered')
+            self._statements[name] = (tuple(types), sql)
+        return name
+
+    def _prepare(self, cur: Cursor, name: str) -> None:
+        types, sql = self._statements[name]
+        type_list = f'({", ".join(types)})' if types else ''
+        cur.execute(f'PREPARE {name}{type_list} AS {sql}')
+
+        with self._lock:
+            self._prepared.setdefault(cur.connection, set()).add(name)
+            self.prepares[name] += 1
+
+    def is_prepared(self, conn: Connection, name: str) -> bool:
+        with self._lock:
+            return name in self._prepared.get(conn, ())
+
+    def prepare_all(self, conn: Connection) -> None:
+        """
+        Prepares the registered statements that are not yet prepared on the connection
+        """
+        with self._lock:
+            missing = self._statements.keys() - self._prepared.get(conn, set())
+
+        if not missing:
+            return
+
+        with conn.cursor() as cur:
+            for name in missing:
+                self._prepare(cur, name)
+
+    def execute(self, cur: Cursor, name: str, args: Sequence[Any] = ()) -> Cursor:
+        """
+        Executes the statement, preparing it first if it's not prepared on the connection
+        """
+        if not self.is_prepared(cur.connection, name):
+            self._prepare(cur, name)
+
+        placeholders = f'({", ".join(["%s"] * len(args))})' if args else ''
+        cur.execute(f'EXECUTE {name}{placeholders}', args)
+
+        with self._lock:
+            self.executions[name] += 1
+        return cur
+
+    def pop_stats(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Returns:
+            Amount of prepares and executions of each statement since the last call
+        """
+        with self._lock:
+            stats = {
+                name: (self.prepares[name], self.executions[name])
+                for name in self.prepares.keys() | self.executions.keys()
+            }
+            self.prepares.clear()
+            self.executions.clear()
+        return stats
+
+
+statements = PreparedStatements()
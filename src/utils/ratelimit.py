@@ -0,0 +1,166 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple, Mapping
+from urllib.parse import urlparse
+
+logger = logging.getLogger('debug')
+
+# Requests per second and burst size per host
+HOST_LIMITS: Dict[str, Tuple[float, int]] = {
+    'mangadex.org': (1, 3),
+    'jumpg-webapi.tokyo-cdn.com': (1, 2),
+    'kodanshacomics.com': (0.2, 1),
+    'www.comixology.com': (0.2, 1),
+    'www.reddit.com': (0.5, 2),
+}
+DEFAULT_LIMIT: Tuple[float, int] = (1, 1)
+
+# Used when a 429 response doesn't tell how long to wait
+DEFAULT_RETRY_AFTER = 60
+
+
+def get_host(url: str) -> str:
+    """
+    Returns the host of the url or the url itself if it has no host
+    """
+    return urlparse(url).netloc.lower() or url.lower()
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parses the value of a Retry-After header
+
+    Returns:
+        The amount of seconds to wait or None if the value couldn't be parsed
+    """
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket implemented as a generic cell rate algorithm.
+    Allows `rate` requests per second on average with bursts of up to `burst` requests.
+    """
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._interval = 1 / rate
+        self._tolerance = (self.burst - 1) * self._interval
+        # Theoretical arrival time of the next request
+        self._tat = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: Optional[float] = None) -> Optional[float]:
+        """
+        Reserves the next request slot
+
+        Args:
+            max_wait: Don't reserve the slot if the wait would be at least this many seconds
+
+        Returns:
+            The amount of seconds the caller must wait before making the request
+            or None if the wait would have been too long and nothing was reserved
+        """
+        with self._lock:
+            now = time.monotonic()
+            tat = max(self._tat, now)
+            wait = max(tat - self._tolerance - now, 0.0)
+            if max_wait is not None and wait >= max_wait:
+                return None
+
+            self._tat = tat + self._interval
+            return wait
+
+    def block(self, seconds: float) -> None:
+        """
+        Prevents requests for the given amount of seconds. Requests after the
+        block are paced at the normal rate without a burst.
+        """
+        with self._lock:
+            blocked_until = time.monotonic() + seconds
+            self._tat = max(self._tat, blocked_until + self._tolerance)
+
+
+class RateLimiter:
+    """
+    Rate limiter shared by all scrapers and threads. Each host has its own token bucket.
+    """
+    def __init__(self, limits: Mapping[str, Tuple[float, int]] = None,
+                 default: Tuple[float, int] = DEFAULT_LIMIT):
+        self._limits = dict(limits or {})
+        self._default = default
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def bucket(self, url: str) -> TokenBucket:
+        host = get_host(url)
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(*self._limits.get(host, self._default))
+                self._buckets[host] = bucket
+
+            return bucket
+
+    def acquire(self, url: str) -> float:
+        """
+        Blocks until a request to the host of the url is allowed
+
+        Returns:
+            The amount of seconds waited
+        """
+        wait = self.bucket(url).reserve()
+        if wait > 0:
+            self._local.waited = self.waited() + wait
+            time.sleep(wait)
+
+        return wait
+
+    def waited(self) -> float:
+        """
+        Returns:
+            Total amount of seconds the current thread has waited in acquire.
+            Used to exclude ratelimit waits from response times.
+        """
+        return getattr(self._local, 'waited', 0.0)
+
+    def feedback(self, url: str, status: Optional[int], headers: Optional[Mapping[str, str]] = None) -> None:
+        """
+        Blocks the host of the url when the response tells us to slow down
+        """
+        if status not in (429, 503):
+            return
+
+        headers = headers or {}
+        retry_after = parse_retry_after(headers.get('Retry-After') or headers.get('retry-after'))
+        if retry_after is None:
+            # Only 429 is guaranteed to be a ratelimit
+            if status != 429:
+                return
+            retry_after = DEFAULT_RETRY_AFTER
+
+        logger.warning(f'Ratelimited on {get_host(url)}. Waiting {retry_after} seconds before next request')
+        self.bucket(url).block(retry_after)
+
+
+limiter = RateLimiter(HOST_LIMITS)
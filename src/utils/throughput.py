@@ -0,0 +1,118 @@
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+# Maximum amount of unused quota that can be saved up in hours
+BURST_HOURS = 0.25
+
+# Additive increase and multiplicative decrease of the concurrency
+INCREASE = 1.0
+DECREASE = 0.5
+
+# Responses slower than this or this many times slower than the average
+# are not considered healthy and won't increase concurrency
+SLOW_LATENCY = 10.0
+SLOWDOWN_FACTOR = 2.0
+# Smoothing factor of the moving average of latency
+LATENCY_ALPHA = 0.2
+
+
+class ServiceThroughput:
+    """
+    Throughput quota and adaptive concurrency of a single service.
+
+    The quota is a token bucket of manga_per_hour tokens that can hold at
+    most BURST_HOURS worth of tokens. Concurrency is controlled with additive
+    increase, multiplicative decrease. Each healthy response increases
+    concurrency by roughly one per round of requests while failures such as
+    ratelimits, server errors and timeouts halve it.
+    """
+    def __init__(self, service_id: int, manga_per_hour: float = 30,
+                 max_concurrency: int = 4, concurrency: float = 1,
+                 allowance: Optional[float] = None,
+                 allowance_updated: Optional[datetime] = None,
+                 latency: Optional[float] = None):
+        self.service_id = service_id
+        self.manga_per_hour = manga_per_hour
+        self.max_concurrency = max(max_concurrency, 1)
+        self.concurrency = min(max(concurrency, 1.0), self.max_concurrency)
+        self.allowance = allowance
+        self.allowance_updated = allowance_updated
+        self.latency = latency
+        self._lock = threading.Lock()
+
+    @property
+    def burst(self) -> float:
+        return max(1.0, self.manga_per_hour * BURST_HOURS)
+
+    @property
+    def limit(self) -> int:
+        """
+        Maximum amount of concurrent updates of the service
+        """
+        return int(self.concurrency)
+
+    def refill(self, now: datetime) -> float:
+        """
+        Adds the tokens gained since the last refill to the allowance
+
+        Returns:
+            The current allowance
+        """
+        with self._lock:
+            if self.allowance is None or self.allowance_updated is None:
+                self.allowance = self.burst
+            else:
+                hours = max((now - self.allowance_updated).total_seconds(), 0) / 3600
+                self.allowance = min(self.burst, self.allowance + hours * self.manga_per_hour)
+
+            self.allowance_updated = now
+            return self.allowance
+
+    def claim_limit(self, now: datetime) -> int:
+        """
+        Returns:
+            The amount of manga that can be updated now
+        """
+        return max(int(self.refill(now)), 0)
+
+    def consume(self, amount: int) -> None:
+        with self._lock:
+            self.allowance = (self.allowance or 0) - amount
+
+    def next_allowed(self) -> Optional[datetime]:
+        """
+        Returns:
+            The time when at least one manga can be updated
+            or None if one can be updated right away
+        """
+        with self._lock:
+            if self.allowance is None or self.allowance >= 1 or self.allowance_updated is None:
+                return None
+
+            hours = (1 - self.allowance) / self.manga_per_hour
+            return self.allowance_updated + timedelta(hours=hours)
+
+    def on_success(self, latency: float) -> None:
+        """
+        Records a successful update that took latency seconds
+        """
+        with self._lock:
+            healthy = latency <= SLOW_LATENCY and (
+                self.latency is None or latency <= self.latency * SLOWDOWN_FACTOR
+            )
+
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += LATENCY_ALPHA * (latency - self.latency)
+
+            if healthy:
+                self.concurrency = min(self.concurrency + INCREASE / self.concurrency, self.max_concurrency)
+
+    def on_failure(self) -> None:
+        """
+        Records a failed update
+        """
+        with self._lock:
+            self.concurrency = max(self.concurrency * DECREASE, 1.0)
@@ -0,0 +1,91 @@
+import heapq
+import itertools
+import threading
+from typing import Generic, TypeVar, List, Tuple, Optional, Callable, Dict, Hashable
+
+T = TypeVar('T')
+
+
+class WorkQueue(Generic[T]):
+    """
+    Thread safe priority queue. Items with the highest priority are popped first
+    and items with equal priority are popped in insertion order.
+    """
+    def __init__(self, key: Optional[Callable[[T], Hashable]] = None):
+        """
+        Args:
+            key: Optional function that groups the items. Each group has its
+                 own heap and pop only checks the first item of each group,
+                 so accept must give the same result for every item of a group.
+        """
+        # Entries are (-priority, insertion order, item) so that heapq,
+        # which is a min heap, pops the highest priority first
+        self._heaps: Dict[Hashable, List[Tuple[float, int, T]]] = {}
+        self._key = key
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(map(len, self._heaps.values()))
+
+    def put(self, item: T, priority: float = 0) -> None:
+        key = self._key(item) if self._key else None
+        with self._lock:
+            heapq.heappush(self._heaps.setdefault(key, []), (-priority, next(self._counter), item))
+
+    def pop(self, accept: Optional[Callable[[T], bool]] = None) -> Optional[T]:
+        """
+        Args:
+            accept: Optional function that tells which items can be popped
+
+        Returns:
+            The item with the highest priority that is accepted or None
+            if the queue has no such items
+        """
+        with self._lock:
+            if self._key is None:
+                heap = self._heaps.get(None)
+                return self._pop_accepted(heap, accept) if heap else None
+
+            best = None
+            for heap in self._heaps.values():
+                if heap and (best is None or heap[0] < best[0]) and (accept is None or accept(heap[0][2])):
+                    best = heap
+
+            return heapq.heappop(best)[2] if best else None
+
+    @staticmethod
+    def _pop_accepted(heap: List[Tuple[float, int, T]], accept: Optional[Callable[[T], bool]]) -> Optional[T]:
+        # Rejected entries are popped into a side list and pushed back afterwards
+        rejected = []
+        item = None
+        while heap:
+            entry = heapq.heappop(heap)
+            if accept is None or accept(entry[2]):
+                item = entry[2]
+                break
+            rejected.append(entry)
+
+        for entry in rejected:
+            heapq.heappush(heap, entry)
+
+        return item
+
+    def remove(self, predicate: Callable[[T], bool]) -> List[T]:
+        """
+        Removes all items matching the predicate
+
+        Returns:
+            The removed items
+        """
+        with self._lock:
+            removed = []
+            for key, heap in self._heaps.items():
+                removed.extend(entry[2] for entry in heap if predicate(entry[2]))
+                kept = [entry for entry in heap if not predicate(entry[2])]
+                if len(kept) != len(heap):
+                    heapq.heapify(kept)
+                    self._heaps[key] = kept
+
+            return removed